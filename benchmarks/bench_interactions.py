@@ -0,0 +1,124 @@
+"""
+Measures how /tiktok interactions are answered while auto embeds flood the
+link conversion slots and TikTok has a slow tail: how many miss Discord's
+3 second cutoff, how many are deferred, and how many of those defers were
+wasted because the answer was ready in time anyway.
+
+Deferring never (how /tiktok was), always (how the context menu was), and
+when the scheduler expects to miss the cutoff, with and without
+interactions going ahead of auto embeds. Each run is on its own videos,
+against the local fake TikTok API.
+
+Run from the repository root:
+    python -m benchmarks.bench_interactions
+    python -m benchmarks.bench_interactions --messages 600 --tail 1.2
+"""
+import asyncio
+import random
+from types import SimpleNamespace
+from typing import List
+
+from benchmarks import load_test  # first, it quiets the missing .env warnings
+import bot
+import interactions
+from interactions import InteractionScheduler
+from limiter import PrioritySemaphore
+
+
+async def run(mode: str, priority: bool, first_video: int, args, server, discord):
+    bot._interactions = InteractionScheduler(mode=mode)
+    bot._link_semaphore = PrioritySemaphore(args.link_concurrency)
+    bot.INTERACTIVE = interactions.INTERACTIVE if priority else interactions.PASSIVE
+    channel = load_test.FakeChannel(discord, next(load_test._snowflakes))
+    guild = SimpleNamespace(id=1)
+    videos = iter(range(first_video, first_video + 10 * args.messages))
+
+    def link() -> str:
+        return f"https://www.tiktok.com/@someone/video/{next(videos)}"
+
+    messages = [
+        load_test.FakeMessage(
+            discord,
+            channel,
+            load_test._user(n),
+            guild,
+            " ".join(link() for _ in range(3)),
+        )
+        for n in range(args.messages)
+    ]
+    flood = iter(messages)
+
+    async def auto_embeds() -> None:
+        for message in flood:
+            await bot.on_message_create(SimpleNamespace(message=message))
+
+    contexts: List[load_test.FakeContext] = []
+
+    async def slash(delay: float, payload: str) -> None:
+        await asyncio.sleep(delay)
+        ctx = load_test.FakeContext(discord, channel, load_test._user(7), guild)
+        contexts.append(ctx)
+        await bot.slash_tiktok.callback(ctx, payload)
+
+    late_before = discord.calls["interaction_late"]
+    defer_before = discord.calls["interaction_defer"]
+    await asyncio.gather(
+        *(auto_embeds() for _ in range(args.workers)),
+        *(slash(n * args.spacing, link()) for n in range(args.interactions)),
+    )
+    answered = sorted(ctx.first_response for ctx in contexts)
+    late = discord.calls["interaction_late"] - late_before
+    info = bot._interactions.info()
+    print(
+        f"{mode:>6} {'yes' if priority else 'no':>8} "
+        f"{(len(contexts) - late) / len(contexts):>8.1%} "
+        f"{discord.calls['interaction_defer'] - defer_before:>7} "
+        f"{info.get('wasted_defer', 0):>7} "
+        f"{load_test.percentile(answered, 0.5) * 1000:>9.0f} "
+        f"{load_test.percentile(answered, 0.95) * 1000:>9.0f}"
+    )
+
+
+async def main() -> None:
+    parser = load_test.build_parser()
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--interactions", type=int, default=100)
+    parser.add_argument("--spacing", type=float, default=0.05)
+    parser.add_argument("--link-concurrency", type=int, default=16)
+    parser.add_argument(
+        "--tail", type=float, default=1.0, help="sigma of the lognormal latency"
+    )
+    parser.set_defaults(api_latency=0.15, workers=50)
+    args = parser.parse_args()
+    server, _ = await load_test.setup(args)
+    rng = random.Random(args.seed)
+    server.latency = lambda: min(
+        10.0, rng.lognormvariate(0, args.tail) * args.api_latency
+    )
+    discord = load_test.FakeDiscord(args.discord_latency)
+    print(
+        f"{args.messages} messages with 3 links and {args.interactions} /tiktok, "
+        f"{args.link_concurrency} conversion slots, TikTok latency median "
+        f"{args.api_latency * 1000:.0f} ms, sigma {args.tail}"
+    )
+    print(
+        f"{'defer':>6} {'priority':>8} {'in time':>8} {'defers':>7} {'wasted':>7} "
+        f"{'first p50':>9} {'first p95':>9}"
+    )
+    try:
+        first_video = load_test.FIRST_VIDEO_ID + 20_000_000
+        for mode, priority in (
+            ("never", False),
+            ("always", False),
+            ("auto", False),
+            ("auto", True),
+        ):
+            await run(mode, priority, first_video, args, server, discord)
+            first_video += 10 * args.messages
+    finally:
+        await bot.on_shutdown()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Drives get_tiktok against the local fake API through a healthy, an overloaded,
+a failing and a recovered phase, with and without the adaptive limiter and
+circuit breaker.
+
+Run from the repository root:
+    python -m benchmarks.bench_limiter
+"""
+import asyncio
+import itertools
+import statistics
+import time
+from collections import Counter
+from typing import Dict, List
+
+import tiktok
+from benchmarks.fake_api import FakeTikTok
+from limiter import AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable
+from session import close_session, open_session
+
+RATE = 200  # requests per second
+PHASE_SECONDS = 3
+PHASES: List[Dict] = [
+    {"name": "healthy", "capacity": 50, "reject_above": None, "error_rate": 0.0},
+    {"name": "overloaded", "capacity": 2, "reject_above": 15, "error_rate": 0.0},
+    {"name": "failing", "capacity": 50, "reject_above": None, "error_rate": 1.0},
+    {"name": "recovered", "capacity": 50, "reject_above": None, "error_rate": 0.0},
+]
+
+_ids = itertools.count(7068971038273423621)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_phase(server: FakeTikTok, phase: Dict) -> None:
+    server.capacity = phase["capacity"]
+    server.reject_above = phase["reject_above"]
+    server.error_rate = phase["error_rate"]
+    outcomes: Counter = Counter()
+    latencies: List[float] = []
+    limits: List[float] = []
+    sent_before = server.requests["aweme_detail"]
+
+    async def one() -> None:
+        start = time.perf_counter()
+        try:
+            await tiktok.get_tiktok(next(_ids))
+        except UpstreamUnavailable:
+            outcomes["failed fast"] += 1
+            return
+        except Exception:
+            outcomes["failed"] += 1
+        else:
+            outcomes["ok"] += 1
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for _ in range(RATE * PHASE_SECONDS):
+        tasks.append(asyncio.create_task(one()))
+        limits.append(tiktok._aweme_limiter.limit)
+        await asyncio.sleep(1 / RATE)
+    await asyncio.gather(*tasks)
+
+    print(
+        f"  {phase['name']:<11}"
+        f" ok {outcomes['ok']:>4}  failed {outcomes['failed']:>4}"
+        f"  failed fast {outcomes['failed fast']:>4}"
+        f"  sent {server.requests['aweme_detail'] - sent_before:>4}"
+        f"  p50 {percentile(latencies, 0.5) * 1000:>6.0f}ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:>6.0f}ms"
+        f"  mean limit {statistics.mean(limits):>6.1f}"
+    )
+
+
+async def run(adaptive: bool) -> None:
+    if adaptive:
+        tiktok._aweme_limiter = AdaptiveLimiter(latency_target=0.5, queue_timeout=2)
+        tiktok._aweme_breaker = CircuitBreaker(failure_threshold=5, reset_timeout=1)
+    else:
+        tiktok._aweme_limiter = AdaptiveLimiter(
+            initial_limit=10**6, min_limit=10**6, max_limit=10**6
+        )
+        tiktok._aweme_breaker = CircuitBreaker(failure_threshold=10**9)
+
+    server = FakeTikTok(latency=lambda: 0.02, overload_latency=0.05)
+    tiktok.AWEME_DETAIL_URL = await server.start() + "/aweme/v1/aweme/detail/"
+    await open_session(limit=1000, limit_per_host=1000)
+    try:
+        for phase in PHASES:
+            await run_phase(server, phase)
+    finally:
+        await close_session()
+        await server.stop()
+
+
+async def main() -> None:
+    print("unlimited:")
+    await run(adaptive=False)
+    print("adaptive limiter and circuit breaker:")
+    await run(adaptive=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Measures what recording a metric costs, per observation, next to the cost of
+one instrumented call.
+
+Run from the repository root:
+    python -m benchmarks.bench_metrics
+"""
+import timeit
+
+import metrics
+from scanner import scan_links
+
+N = 1_000_000
+
+
+def per_call(stmt, number: int = N, **globals) -> float:
+    # best of 5, in nanoseconds per call, the loop itself included
+    timer = timeit.Timer(stmt, globals=globals)
+    return min(timer.repeat(5, number)) / number * 1e9
+
+
+async def noop() -> None:
+    pass
+
+
+@metrics.timed("bench_async")
+async def timed_noop() -> None:
+    pass
+
+
+def drive(coro_func, number: int) -> None:
+    # run coroutines without an event loop, so only the wrapper is measured
+    for _ in range(number):
+        try:
+            coro_func().send(None)
+        except StopIteration:
+            pass
+
+
+def main() -> None:
+    empty = per_call("pass")
+    results = {
+        "count": per_call("count('bench', 'hit')", count=metrics.count) - empty,
+        "observe": per_call(
+            "observe('bench', 'success', 0.0042)", observe=metrics.observe
+        )
+        - empty,
+        "timed (sync)": per_call("f()", f=metrics.timed("bench_sync")(lambda: None))
+        - per_call("f()", f=lambda: None),
+        "timed (async)": (
+            per_call("drive(f, 1000)", number=1000, drive=drive, f=timed_noop)
+            - per_call("drive(f, 1000)", number=1000, drive=drive, f=noop)
+        )
+        / 1000,
+        "track": (
+            per_call(
+                "drive(lambda: track('bench', noop()), 1000)",
+                number=1000,
+                drive=drive,
+                track=metrics.track,
+                noop=noop,
+            )
+            - per_call("drive(f, 1000)", number=1000, drive=drive, f=noop)
+        )
+        / 1000,
+    }
+    print(f"{'operation':>16} {'ns/op':>8}")
+    for name, ns in results.items():
+        print(f"{name:>16} {ns:8.0f}")
+
+    message = "look https://vm.tiktok.com/ZMLrJ8xyz/ and www.tiktok.com/@a/video/1"
+    metrics.reset()
+    scan = per_call("f(m)", f=scan_links, m=message) - empty
+    print(f"\nscan_links with links, recorded: {scan:.0f} ns")
+    metrics.reset()
+
+    for name in ("get_tiktok", "get_video_id", "create_short_url", "discord_send"):
+        for outcome in ("success", "error", "timeout"):
+            metrics.observe(name, outcome, 0.01)
+    render = per_call("render()", number=100, render=metrics.render)
+    print(f"render with {len(metrics._histograms)} histograms: {render / 1000:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
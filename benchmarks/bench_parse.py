@@ -0,0 +1,87 @@
+"""
+Measures decoding and parsing aweme_detail payloads into TikTokData.
+
+Run from the repository root:
+    python -m benchmarks.bench_parse
+"""
+import json
+import time
+import tracemalloc
+from typing import Callable, List
+
+from benchmarks.fakes import make_aweme_detail
+from tiktok import TikTokData, json_loads
+
+CORPUS_SIZE = 2_000
+
+
+def make_corpus(size: int = CORPUS_SIZE) -> List[bytes]:
+    return [
+        json.dumps(
+            {"aweme_detail": make_aweme_detail(7068971038273423621 + n), "status_code": 0}
+        ).encode()
+        for n in range(size)
+    ]
+
+
+def embed_path(body: bytes) -> None:
+    """What an auto embed reads."""
+    TikTokData.from_dict(json_loads(body)["aweme_detail"]).video.video_uri
+
+
+def info_path(body: bytes) -> None:
+    """What the Info button reads."""
+    tiktok = TikTokData.from_dict(json_loads(body)["aweme_detail"])
+    tiktok.video.cover_url, tiktok.author.nickname, tiktok.statistics.play_count
+    tiktok.description.cleaned, tiktok.description.tags, tiktok.created
+
+
+def throughput(func: Callable, corpus: List[bytes], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in corpus:
+            func(body)
+        best = min(best, time.perf_counter() - start)
+    return len(corpus) / best
+
+
+def allocated_per_object(func: Callable, corpus: List[bytes]) -> float:
+    """Peak bytes allocated while parsing one payload, averaged."""
+    tracemalloc.start()
+    total = 0
+    for body in corpus:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(body)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - base
+    tracemalloc.stop()
+    return total / len(corpus)
+
+
+def retained_per_object(corpus: List[bytes]) -> float:
+    """Bytes still held by each parsed TikTokData, as the cache holds them."""
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    kept = [TikTokData.from_dict(json_loads(body)["aweme_detail"]) for body in corpus]
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return (end - start) / len(corpus)
+
+
+def main() -> None:
+    corpus = make_corpus()
+    size = sum(map(len, corpus)) / len(corpus)
+    print(f"{len(corpus):,} payloads of {size:,.0f} bytes, {json_loads.__module__} decoder")
+    for name, func in (("embed", embed_path), ("info", info_path)):
+        print(
+            f"  {name:<6} {throughput(func, corpus):>10,.0f} objects/s"
+            f"  {allocated_per_object(func, corpus):>10,.0f} bytes allocated/object"
+        )
+    print(f"  retained {retained_per_object(corpus):>8,.0f} bytes/object")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Measures what prefetching does for the Info and Audio buttons: links are
+posted, people take a moment to look at the videos, then click. The same
+is run with prefetching off and on, each on its own videos, against the
+local fake TikTok API.
+
+Run from the repository root:
+    python -m benchmarks.bench_prefetch
+    python -m benchmarks.bench_prefetch --links 400 --think 0.5
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks import load_test  # first, it quiets the missing .env warnings
+import bot
+from database import Config
+
+GUILD_ID = 1
+
+
+async def timed_all(
+    calls: List[Callable[[], Awaitable]], concurrency: int
+) -> List[float]:
+    latencies = []
+    queue = iter(calls)
+
+    async def worker() -> None:
+        for call in queue:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return sorted(latencies)
+
+
+async def run(prefetch: bool, first_video: int, args, server, discord) -> Dict:
+    bot._guild_configs[GUILD_ID] = Config(guild_id=GUILD_ID, prefetch=prefetch)
+    channel = load_test.FakeChannel(discord, next(load_test._snowflakes))
+    guild = SimpleNamespace(id=GUILD_ID)
+    user = load_test._user(42)
+    videos = [first_video + n for n in range(args.links)]
+
+    def post(video_id: int) -> Callable[[], Awaitable]:
+        content = f"https://www.tiktok.com/@someone/video/{video_id}"
+        message = load_test.FakeMessage(discord, channel, user, guild, content)
+        return lambda: bot.on_message_create(SimpleNamespace(message=message))
+
+    def click(custom_id: str) -> Callable[[], Awaitable]:
+        ctx = load_test.FakeContext(discord, channel, user, guild, custom_id)
+        return lambda: bot.on_button_click(SimpleNamespace(context=ctx))
+
+    posted = await timed_all([post(video) for video in videos], args.concurrency)
+    await asyncio.sleep(args.think)
+    http_before = Counter(server.requests)
+    info = await timed_all([click(f"v_id{v}") for v in videos], args.concurrency)
+    audio = await timed_all([click(f"m_id{v}") for v in videos], args.concurrency)
+    return {
+        "posted": posted,
+        "info": info,
+        "audio": audio,
+        "http": sum((Counter(server.requests) - http_before).values()),
+    }
+
+
+def ms(latencies: List[float], q: float) -> float:
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+
+async def main(args: argparse.Namespace) -> None:
+    setup_args = load_test.build_parser().parse_args(
+        ["--api-latency", str(args.api_latency)]
+    )
+    server, _ = await load_test.setup(setup_args)
+    discord = load_test.FakeDiscord(setup_args.discord_latency)
+    print(
+        f"{args.links} links, {args.think}s before clicking, "
+        f"{args.api_latency * 1000:.0f} ms TikTok latency"
+    )
+    print(
+        f"{'prefetch':>8} {'post p50':>9} {'post p95':>9} {'info p50':>9} "
+        f"{'info p95':>9} {'audio p50':>10} {'audio p95':>10} {'click http':>11}"
+    )
+    try:
+        first_video = load_test.FIRST_VIDEO_ID + 10_000_000
+        for prefetch in (False, True):
+            result = await run(prefetch, first_video, args, server, discord)
+            first_video += args.links
+            columns = [f"{'on' if prefetch else 'off':>8}"]
+            for stage, width in (("posted", 9), ("info", 9), ("audio", 10)):
+                for q in (0.5, 0.95):
+                    columns.append(f"{ms(result[stage], q):>{width}.1f}")
+            print(" ".join(columns) + f" {result['http']:>11,}")
+    finally:
+        await bot.on_shutdown()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--links", type=int, default=200)
+    parser.add_argument("--think", type=float, default=2)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--api-latency", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
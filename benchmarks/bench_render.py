@@ -0,0 +1,182 @@
+"""
+Measures building what the bot sends: the buttons of a conversion, the Info
+card and the /help pages, as they were built before (dis_snek objects made
+and serialized on every response) and with render.py's prebuilt payloads.
+Each is run through the processing dis_snek does before sending.
+
+Run from the repository root:
+    python -m benchmarks.bench_render
+"""
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+import dis_snek as dis
+from dis_snek.models.discord.components import process_components
+from dis_snek.models.discord.embed import process_embeds
+
+import render
+from benchmarks.fakes import make_aweme_detail
+from tiktok import TikTokData
+
+VIDEOS = 1_000
+
+
+def old_conversion_components(
+    converted: List[Tuple[int, str]], author_id: int
+) -> List[dis.ActionRow]:
+    info_buttons = [
+        dis.Button(
+            dis.ButtonStyles.GRAY,
+            "Info" if len(converted) == 1 else f"Info {n}",
+            "🌐",
+            custom_id=f"v_id{video_id}",
+        )
+        for n, (video_id, _) in enumerate(converted, 1)
+    ]
+    delete_msg_btn = dis.Button(
+        dis.ButtonStyles.RED,
+        emoji="🗑️",
+        custom_id=f"delete{author_id}",
+    )
+    return dis.spread_to_rows(*info_buttons, delete_msg_btn)
+
+
+def old_info_card(tiktok: TikTokData) -> Tuple[dis.Embed, List[dis.Button]]:
+    video = tiktok.video
+    author = tiktok.author
+    stats = tiktok.statistics
+
+    embed = dis.Embed(
+        tiktok.description.cleaned[:256] if tiktok.description.cleaned != "" else None,
+        description=tiktok.share_url,
+    )
+
+    embed.set_author(name=author.nickname, icon_url=author.avatar, url=author.url)
+    embed.set_thumbnail(url=video.cover_url)
+    embed.add_field("Views 👁️", stats.play_count, True)
+    embed.add_field("Likes ❤️", stats.like_count, True)
+    embed.add_field("Comments 💬", stats.comment_count, True)
+    embed.add_field("Shares 🔃", stats.share_count, True)
+    embed.add_field("Downloads 📥", stats.download_count, True)
+    embed.add_field("Created", tiktok.created, True)
+    embed.add_field(
+        "Updated 🕑",
+        dis.Timestamp.fromtimestamp(tiktok.fetched_at).format(
+            dis.TimestampStyles.RelativeTime
+        ),
+        True,
+    )
+    download_btn = dis.Button(dis.ButtonStyles.URL, "Download", url=video.download_url)
+    if len(tiktok.description.tags) > 0:
+        embed.add_field(
+            "Tags 🔖",
+            ", ".join(
+                [
+                    f"[`#{tag}`](https://www.tiktok.com/tag/{tag})"
+                    for tag in tiktok.description.tags
+                ]
+            ),
+            True,
+        )
+
+    audio_btn = dis.Button(
+        dis.ButtonStyles.GRAY,
+        "Audio",
+        emoji="🎵",
+        custom_id=f"m_id{tiktok.id}",
+    )
+    return embed, [download_btn, audio_btn]
+
+
+def sent(embeds=None, components=None) -> None:
+    """What dis_snek does with them before sending."""
+    process_embeds(embeds)
+    process_components(components)
+
+
+def per_call(
+    func: Callable[[int], None], calls: int, reset: Callable[[], None] = lambda: None
+) -> Tuple[float, float]:
+    """Microseconds and peak bytes allocated per call, averaged."""
+    reset()
+    start = time.perf_counter()
+    for n in range(calls):
+        func(n)
+    elapsed = time.perf_counter() - start
+    reset()
+    tracemalloc.start()
+    total = 0
+    for n in range(calls):
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(n)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - base
+    tracemalloc.stop()
+    return elapsed / calls * 1e6, total / calls
+
+
+def main() -> None:
+    tiktoks = [
+        TikTokData.from_dict(make_aweme_detail(7068971038273423621 + n))
+        for n in range(VIDEOS)
+    ]
+    one = [(7068971038273423621, "https://tiktoker.win/a")]
+    three = [(7068971038273423621 + n, "https://tiktoker.win/a") for n in range(3)]
+
+    def old_info(n: int) -> None:
+        embed, components = old_info_card(tiktoks[n % VIDEOS])
+        sent(embed, components)
+
+    def new_info(n: int) -> None:
+        payload = render.info_payload(tiktoks[n % VIDEOS])
+        sent(payload["embed"], payload["components"])
+
+    def warm() -> None:
+        for n in range(VIDEOS):
+            new_info(n)
+
+    # name, old, new, calls, reset before measuring the new one
+    cases = [
+        (
+            "conversion, 1 link",
+            lambda n: sent(components=old_conversion_components(one, n)),
+            lambda n: sent(components=render.conversion_components(one, n)),
+            5 * VIDEOS,
+            lambda: None,
+        ),
+        (
+            "conversion, 3 links",
+            lambda n: sent(components=old_conversion_components(three, n)),
+            lambda n: sent(components=render.conversion_components(three, n)),
+            5 * VIDEOS,
+            lambda: None,
+        ),
+        # each video once, with nothing rendered yet
+        ("info, first click", old_info, new_info, VIDEOS, render._info_payloads.clear),
+        ("info, repeat click", old_info, new_info, 5 * VIDEOS, warm),
+        (
+            "help pages",
+            # what /help built on every use before
+            lambda n: [embed.to_dict() for embed in render._help_embeds()],
+            lambda n: [embed.to_dict() for embed in render.HELP_EMBEDS],
+            5 * VIDEOS,
+            lambda: None,
+        ),
+    ]
+    print(
+        f"{'response':<20} {'old us':>8} {'new us':>8} {'old bytes':>10} "
+        f"{'new bytes':>10}"
+    )
+    for name, old, new, calls, reset in cases:
+        old_us, old_bytes = per_call(old, calls)
+        new_us, new_bytes = per_call(new, calls, reset)
+        print(
+            f"{name:<20} {old_us:>8.1f} {new_us:>8.1f} {old_bytes:>10,.0f} "
+            f"{new_bytes:>10,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Checks the usage rollups: the HyperLogLog error at growing user counts, how
+fast batches fold into rollup updates, and how many documents /stats usage
+reads, and how many videos the largest one counts, as the raw usage
+collection grows.
+
+Run from the repository root:
+    python -m benchmarks.bench_rollup
+"""
+import asyncio
+import random
+import time
+from collections import Counter
+
+from beanie import init_beanie
+
+import rollup
+from benchmarks.fakes import FakeDatabase
+from database import GuildUsage, UsageData, UsageTotals
+
+
+def hll_error() -> None:
+    print(f"{'users':>10} {'estimate':>10} {'error':>8}")
+    rng = random.Random(0)
+    registers = {}
+    users = 0
+    for target in (100, 1_000, 10_000, 100_000, 1_000_000):
+        while users < target:
+            register, value = rollup.hll_register(rng.getrandbits(63))
+            if value > registers.get(register, 0):
+                registers[register] = value
+            users += 1
+        estimate = rollup.hll_estimate(registers)
+        print(f"{users:>10,} {estimate:>10,} {(estimate - users) / users:>8.2%}")
+
+
+def records(n: int, rng: random.Random, start: int) -> list:
+    return [
+        UsageData(
+            guild_id=rng.randrange(50),
+            user_id=rng.randrange(100_000) if rng.random() > 0.05 else None,
+            video_id=7_000_000_000_000_000_000 + int(rng.paretovariate(1.2)),
+            message_id=n,
+            timestamp=start + rng.randrange(60 * rollup.DAY),
+        )
+        for n in range(n)
+    ]
+
+
+def fold_speed() -> None:
+    batch = records(500, random.Random(1), int(time.time()) - 30 * rollup.DAY)
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+        rollup.rollup_updates(batch)
+    elapsed = time.perf_counter() - start
+    print(f"\nfolding batches of 500: {runs * 500 / elapsed:,.0f} records/s")
+
+
+async def query_cost(database: FakeDatabase) -> None:
+    rng = random.Random(2)
+    start = int(time.time()) - 60 * rollup.DAY
+    print(
+        f"\n{'raw records':>12} {'rollup docs':>12} {'docs read by /stats':>20} "
+        f"{'most videos in one':>19}"
+    )
+    written = 0
+    for total in (10_000, 50_000, 200_000):
+        while written < total:
+            batch = records(500, rng, start)
+            await UsageData.insert_many(batch)
+            await rollup.apply_rollups(batch)
+            written += len(batch)
+        guild_rollups = database["GuildUsage"]
+        today = int(time.time()) // rollup.DAY
+        # what guild_usage(7) and total_usage() fetch
+        read = 1 + sum(
+            1
+            for doc in guild_rollups.docs
+            if doc["guild_id"] == 7 and doc["day"] > today - 30
+        )
+        # trimmed back to rollup.TOP_VIDEOS whenever they count twice as many
+        videos = max(len(doc.get("videos", ())) for doc in guild_rollups.docs)
+        print(
+            f"{written:>12,} {len(guild_rollups.docs):>12,} {read:>20,} {videos:>19,}"
+        )
+
+    truth = len({doc["user_id"] for doc in database["UsageData"].docs} - {None})
+    totals = await rollup.total_usage()
+    print(f"\ndistinct users: {truth:,}, estimated {totals['users']:,}")
+
+
+async def busy_guild() -> None:
+    rng = random.Random(3)
+    now = int(time.time())
+    exact: Counter = Counter()
+    for n in range(40):
+        batch = [
+            UsageData(
+                guild_id=1_000,
+                user_id=rng.randrange(100_000),
+                video_id=7_000_000_000_000_000_000 + int(rng.paretovariate(0.3)),
+                message_id=n,
+                timestamp=now,
+            )
+            for _ in range(500)
+        ]
+        exact.update(record.video_id for record in batch)
+        await rollup.apply_rollups(batch)
+    counted = (await GuildUsage.find_one({"guild_id": 1_000})).videos
+    top = [video_id for video_id, _ in (await rollup.guild_usage(1_000))["top_videos"]]
+    print(
+        f"\nbusy guild, {sum(exact.values()):,} conversions of {len(exact):,} videos "
+        f"in a day: {len(counted)} videos counted, top 5 "
+        f"{'exact' if top == [v for v, _ in exact.most_common(5)] else 'wrong'}"
+    )
+
+
+async def main() -> None:
+    hll_error()
+    database = FakeDatabase()
+    await init_beanie(
+        database=database, document_models=[UsageData, GuildUsage, UsageTotals]
+    )
+    fold_speed()
+    await query_cost(database)
+    await busy_guild()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+"""
+Measures how many chat messages per second the link scanner gets through.
+
+Run from the repository root:
+    python -m benchmarks.bench_scanner
+"""
+import random
+import re
+import time
+from typing import Callable, List
+
+from scanner import check_for_link, scan_links
+
+_WORDS = (
+    "lol this is so true who else is watching in 2022 bro what did i just see "
+    "anyway im off to bed gm gn ngl tbh fr fr no cap thats crazy @everyone ping "
+    "<:kekw:948778200224370768> meeting at 5 check the pinned message"
+).split()
+_OTHER_LINKS = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://twitter.com/someone/status/1498330391429939206",
+    "https://cdn.discordapp.com/attachments/1/2/image.png",
+    "https://www.reddit.com/r/memes/comments/t2v8c1/",
+]
+_TIKTOK_LINKS = [
+    "https://www.tiktok.com/@placeholder/video/7068971038273423621?is_copy_url=1",
+    "https://vm.tiktok.com/ZMLRy4Ggd/",
+    "https://m.tiktok.com/v/7068971038273423621.html",
+    "check this vm.tiktok.com/ZMLPa9Hrk/ and www.tiktok.com/@a.b/video/7061234567890123456",
+]
+
+
+def make_corpus(size: int, link_ratio: float, seed: int = 0) -> List[str]:
+    """
+    Builds chat-like messages, a `link_ratio` share of them with a TikTok link.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = rng.choices(_WORDS, k=rng.randint(1, 30))
+        roll = rng.random()
+        if roll < link_ratio:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(_TIKTOK_LINKS))
+        elif roll < link_ratio + 0.05:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(_OTHER_LINKS))
+        corpus.append(" ".join(words))
+    return corpus
+
+
+def legacy_check_for_link(content: str):
+    """The three uncompiled searches check_for_link used to run."""
+    long_match = re.search(
+        r"(?P<http>http:|https:\/\/)?(www\.)?tiktok\.com\/(@.{1,24})\/video\/(?P<id>\d{15,30})",
+        content,
+    )
+    short_match = re.search(
+        r"(?P<http>http:|https:\/\/)?(\w{2})\.tiktok.com\/(?P<short_id>\w{5,15})",
+        content,
+    )
+    medium_match = re.search(
+        r"(?P<http>http:|https:\/\/)?m\.tiktok\.com\/v\/(?P<id>\d{15,30})", content
+    )
+    return long_match or short_match or medium_match
+
+
+def bench(func: Callable, corpus: List[str], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in corpus:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    return len(corpus) / best
+
+
+def main() -> None:
+    for link_ratio in (0.0, 0.01, 0.1, 1.0):
+        corpus = make_corpus(50_000, link_ratio)
+        print(f"link ratio {link_ratio:>4}:")
+        for name, func in (
+            ("legacy", legacy_check_for_link),
+            ("check_for_link", check_for_link),
+            ("scan_links", scan_links),
+        ):
+            print(f"  {name:<15} {bench(func, corpus):>12,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
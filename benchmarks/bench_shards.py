@@ -0,0 +1,170 @@
+"""
+Runs the load test workload split across shard processes, each with its
+own fakes, all connected to one invalidation relay, and reports the
+combined throughput as shards are added. Afterwards every shard opts some
+users out, and the run checks each process ends up with the same opted
+out users, and how long after the last opt out they all had it.
+
+Each process gets an equal share of the concurrent workers, so adding
+shards spreads the same load over more cores; it can't scale past the
+number of cores.
+
+Run from the repository root:
+    python -m benchmarks.bench_shards
+    python -m benchmarks.bench_shards --shards 1 2 4 8 --events 40000
+"""
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks import load_test  # first, it quiets the missing .env warnings
+import bot
+import coherence
+from coherence import Relay
+from supervisor import shard_for
+
+OPT_OUT_STRIDE = 7
+
+
+def opt_outs(shard_id: int, total_shards: int, users: int) -> List[int]:
+    # user ids this shard opts out, disjoint from the setup's multiples of 50
+    return [
+        user
+        for user in range(shard_id, users, total_shards * OPT_OUT_STRIDE)
+        if user % 50
+    ]
+
+
+async def run_shard(
+    shard_id: int, total_shards: int, relay_path: str, args, barrier
+) -> Dict[str, Any]:
+    server, database = await load_test.setup(args)
+    await coherence.open_channel(relay_path)
+    bot.register_invalidation()
+    # workload guild n stands for a guild created at snowflake tick n
+    events = [
+        event
+        for event in load_test.build_workload(args, server)
+        if shard_for(event[1] << 22, total_shards) == shard_id
+    ]
+    discord = load_test.FakeDiscord(args.discord_latency)
+    workers = max(1, args.workers // total_shards)
+    result: Dict[str, Any] = {"events": len(events)}
+    try:
+        for name in ("cold", "warm"):
+            barrier.wait()
+            start = time.time()
+            done = await load_test.run_pass(events, workers, server, database, discord)
+            result[name] = (start, time.time(), sum(done["errors"].values()))
+
+        barrier.wait()
+        start = time.time()
+        for user in opt_outs(shard_id, total_shards, args.users):
+            await bot.add_opted_out(user)
+        result["published"] = time.time()
+        expected = {
+            user
+            for shard in range(total_shards)
+            for user in opt_outs(shard, total_shards, args.users)
+        }
+        while not all(user in bot._opted_out for user in expected):
+            if time.time() - start > 30:
+                break
+            await asyncio.sleep(0.001)
+        result["seen"] = time.time()
+        result["opted_out"] = len(bot._opted_out)
+        result["received"] = coherence.get_channel().received
+    finally:
+        await bot.on_shutdown()
+        await server.stop()
+    return result
+
+
+def shard_process(shard_id, total_shards, relay_path, args, barrier, results) -> None:
+    results.put(
+        (
+            shard_id,
+            asyncio.run(run_shard(shard_id, total_shards, relay_path, args, barrier)),
+        )
+    )
+
+
+def run(total_shards: int, args) -> Dict[int, Dict[str, Any]]:
+    context = multiprocessing.get_context("spawn")
+    relay_path = os.path.join(tempfile.mkdtemp(), "relay.sock")
+    relay = Relay(relay_path)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(relay.start())
+    barrier = context.Barrier(total_shards)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=shard_process,
+            args=(shard, total_shards, relay_path, args, barrier, results),
+        )
+        for shard in range(total_shards)
+    ]
+    for process in processes:
+        process.start()
+
+    # the relay forwards while the shards run
+    async def collect() -> Dict[int, Dict[str, Any]]:
+        collected = {}
+        while len(collected) < total_shards:
+            shard, result = await loop.run_in_executor(None, results.get)
+            collected[shard] = result
+        return collected
+
+    try:
+        return loop.run_until_complete(collect())
+    finally:
+        for process in processes:
+            process.join()
+        loop.run_until_complete(relay.stop())
+        loop.close()
+
+
+def report(total_shards: int, results: Dict[int, Dict[str, Any]], baseline) -> float:
+    events = sum(result["events"] for result in results.values())
+    rates = []
+    for name in ("cold", "warm"):
+        start = min(result[name][0] for result in results.values())
+        end = max(result[name][1] for result in results.values())
+        rates.append(events / (end - start))
+    errors = sum(
+        result[name][2] for result in results.values() for name in ("cold", "warm")
+    )
+    opted_out = {result["opted_out"] for result in results.values()}
+    # from the last opt out written anywhere to every shard having seen it
+    lag = max(result["seen"] for result in results.values()) - max(
+        result["published"] for result in results.values()
+    )
+    speedup = f"{rates[1] / baseline:.2f}x" if baseline else "1.00x"
+    print(
+        f"{total_shards:>6} {rates[0]:>10,.0f} {rates[1]:>10,.0f} {speedup:>8} "
+        f"{errors:>6} {'yes' if len(opted_out) == 1 else 'NO':>8} "
+        f"{lag * 1000:>9.1f}"
+    )
+    return rates[1]
+
+
+def main() -> None:
+    parser = load_test.build_parser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    print(f"{os.cpu_count()} cores, {args.events:,} events, {args.workers} workers")
+    print(
+        f"{'shards':>6} {'cold ev/s':>10} {'warm ev/s':>10} {'speedup':>8} "
+        f"{'errors':>6} {'coherent':>8} {'lag ms':>9}"
+    )
+    baseline = None
+    for total_shards in args.shards:
+        rate = report(total_shards, run(total_shards, args), baseline)
+        baseline = baseline or rate
+
+
+if __name__ == "__main__":
+    main()
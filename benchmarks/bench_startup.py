@@ -0,0 +1,149 @@
+"""
+Measures how long a restart takes until the first message is handled.
+
+The old startup logged in and connected the gateway, then, on the Startup
+event, initialized the documents one after another with their indexes and
+loaded the caches; messages that came in meanwhile failed. The new one
+prepares the database and caches while logging in, and connects once it is
+done, leaving missing indexes to the background.
+
+Each runs against an in-memory database with the given round trip, a fake
+login and gateway connection, and the local fake TikTok API. The import
+time of bot.py is measured in a fresh interpreter.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --db-latency 0.02 --index-build 5
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+from benchmarks import load_test  # first, it quiets the missing .env warnings
+import aiohttp
+import bot
+import session
+from beanie import init_beanie
+from benchmarks.fake_api import FakeTikTok
+from benchmarks.fakes import FakeDatabase
+from database import DOCUMENTS, Config, OptedOut, create_indexes, init_database
+
+IMPORT_CHECK = """
+import time
+started = time.perf_counter()
+import bot
+elapsed = time.perf_counter() - started
+import sys
+lazy = ["aiohttp.web", "dis_snek.ext.paginators"]
+print(elapsed, *(name for name in lazy if name not in sys.modules))
+"""
+
+
+def import_time(runs: int = 3) -> None:
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_CHECK],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        results.append((float(output[0]), output[1:]))
+    elapsed, deferred = min(results)
+    print(f"import bot: {elapsed * 1000:.0f} ms, not imported: {', '.join(deferred)}")
+
+
+async def filled_database(args: argparse.Namespace, missing_index: bool):
+    database = FakeDatabase(latency=args.db_latency, index_build=args.index_build)
+    await init_database(database)
+    await Config.get_motor_collection().insert_many(
+        [{"guild_id": guild} for guild in range(args.guilds)]
+    )
+    await OptedOut.get_motor_collection().insert_many(
+        [{"user_id": user} for user in range(args.opted_out)]
+    )
+    if missing_index:  # added by the release being deployed
+        await database["UsageData"].drop_index("guild_id_1_user_id_1")
+    return database
+
+
+async def old_startup(database, login, connect) -> None:
+    await login()
+    await connect()
+    await init_beanie(database=database, document_models=DOCUMENTS)
+    await bot.load_guild_configs()
+    await bot.load_opted_out()
+    bot._usage_writer.start()
+
+
+async def new_startup(database, login, connect) -> None:
+    await asyncio.gather(bot.prepare(database), login())
+    await connect()
+
+
+async def run(name, flow, args, server, missing_index: bool) -> None:
+    database = await filled_database(args, missing_index)
+    bot._guild_configs.clear()
+    bot._opted_out.replace(())
+    session._session = server.session(timeout=aiohttp.ClientTimeout(total=5))
+
+    async def login() -> None:
+        await asyncio.sleep(args.login)
+
+    async def connect() -> None:
+        await asyncio.sleep(args.connect)
+
+    discord = load_test.FakeDiscord(0.03)
+    channel = load_test.FakeChannel(discord, next(load_test._snowflakes))
+    content = f"https://www.tiktok.com/@someone/video/{load_test.FIRST_VIDEO_ID}"
+    message = load_test.FakeMessage(
+        discord, channel, load_test._user(42), SimpleNamespace(id=1), content
+    )
+
+    started = time.perf_counter()
+    await flow(database, login, connect)
+    ready = time.perf_counter() - started
+    await bot.on_message_create(SimpleNamespace(message=message))
+    handled = time.perf_counter() - started
+    indexes = "in startup"
+    if flow is new_startup:
+        await create_indexes()  # what the first shard does in the background
+        indexes = f"{time.perf_counter() - started - handled:.2f}s after"
+    await bot.on_shutdown()
+    print(
+        f"  {name:<4} ready {ready:6.2f}s, first message {handled:6.2f}s, "
+        f"indexes {indexes}"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    import_time()
+    server = FakeTikTok(latency=lambda: 0.05)
+    await server.start()
+    bot.bot._user = SimpleNamespace(id=load_test.BOT_ID)
+    try:
+        for missing_index in (False, True):
+            print(
+                f"\n{'deploy adding an index' if missing_index else 'restart'}: "
+                f"{args.guilds:,} configs, {args.opted_out:,} opted out, "
+                f"{args.db_latency * 1000:.0f} ms database round trip"
+            )
+            # old first: its Startup ran after the gateway had connected
+            await run("old", old_startup, args, server, missing_index)
+            await run("new", new_startup, args, server, missing_index)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--guilds", type=int, default=20_000)
+    parser.add_argument("--opted-out", type=int, default=5_000)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--index-build", type=float, default=2)
+    parser.add_argument("--login", type=float, default=0.3)
+    parser.add_argument("--connect", type=float, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+"""
+Compares the request policies of get_tiktok against the local fake API with a
+heavy tailed latency: most answers in tens of milliseconds, a few in seconds.
+
+Run from the repository root:
+    python -m benchmarks.bench_tail
+"""
+import asyncio
+import itertools
+import random
+import time
+from typing import List
+
+import tiktok
+from benchmarks.bench_limiter import percentile
+from benchmarks.fake_api import FakeTikTok
+from latency import LatencyHistogram, RequestPolicy
+from limiter import AdaptiveLimiter, CircuitBreaker
+from session import close_session, open_session
+
+RATE = 200  # requests per second
+WARMUP = 300
+REQUESTS = 1_500
+POLICIES = {
+    "one attempt, 5s timeout": RequestPolicy(retries=0, hedge=False, min_samples=10**9),
+    "retries, derived timeout": RequestPolicy(hedge=False),
+    "hedging, 5s timeout": RequestPolicy(retries=0, min_timeout=5),
+    "hedging and retries": RequestPolicy(),
+}
+
+_ids = itertools.count(7068971038273423621)
+
+
+def heavy_tail(rng: random.Random):
+    def latency() -> float:
+        roll = rng.random()
+        if roll < 0.94:
+            return rng.uniform(0.02, 0.05)
+        if roll < 0.99:
+            return rng.uniform(0.2, 0.5)
+        return rng.uniform(3, 8)
+
+    return latency
+
+
+async def drive(count: int) -> List[float]:
+    latencies: List[float] = []
+
+    async def one() -> None:
+        start = time.perf_counter()
+        try:
+            await tiktok.get_tiktok(next(_ids))
+        except Exception:
+            latencies.append(float("inf"))
+        else:
+            latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for _ in range(count):
+        tasks.append(asyncio.create_task(one()))
+        await asyncio.sleep(1 / RATE)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def main() -> None:
+    server = FakeTikTok(latency=heavy_tail(random.Random(0)))
+    tiktok.AWEME_DETAIL_URL = await server.start() + "/aweme/v1/aweme/detail/"
+    await open_session(limit=1000, limit_per_host=1000)
+    try:
+        for name, policy in POLICIES.items():
+            tiktok.aweme_policy = policy
+            tiktok._aweme_latency = LatencyHistogram()
+            tiktok._aweme_limiter = AdaptiveLimiter(latency_target=60)
+            tiktok._aweme_breaker = CircuitBreaker()
+            await drive(WARMUP)
+            sent_before = server.requests["aweme_detail"]
+            latencies = await drive(REQUESTS)
+            sent = server.requests["aweme_detail"] - sent_before
+            failed = sum(latency == float("inf") for latency in latencies)
+            ms = [percentile(latencies, q) * 1000 for q in (0.5, 0.95, 0.99)]
+            print(
+                f"{name:<25} p50 {ms[0]:>5.0f}ms  p95 {ms[1]:>5.0f}ms"
+                f"  p99 {ms[2]:>5.0f}ms  failed {failed:>3}"
+                f"  {sent / REQUESTS:.2f} requests/call"
+            )
+    finally:
+        await close_session()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
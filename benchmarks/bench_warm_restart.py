@@ -0,0 +1,95 @@
+"""
+Measures what the TikTok store does for a restart: a workload runs, the
+process "restarts" and loses its memory caches, then a new workload over
+the same popular videos runs with the memory cache only, with the store
+read on misses, and with the most converted videos preloaded as well.
+
+Each restart starts from the store as the first workload left it, against
+the local fake TikTok API and an in-memory database.
+
+Run from the repository root:
+    python -m benchmarks.bench_warm_restart
+    python -m benchmarks.bench_warm_restart --events 10000 --preload 500
+"""
+import asyncio
+import time
+
+from benchmarks import load_test  # first, it quiets the missing .env warnings
+import bot
+import tiktok
+from database import StoredTikTok
+
+
+def restart() -> None:
+    # what a new process starts with
+    tiktok._tiktok_cache.clear()
+    bot._short_links.clear()
+    bot._music_data.clear()
+
+
+async def run(name: str, preload: int, events, args, server, database, discord):
+    restart()
+    started = time.perf_counter()
+    await bot.preload_popular_tiktoks(preload)
+    preloaded = time.perf_counter() - started
+    result = await load_test.run_pass(events, args.workers, server, database, discord)
+    links = result["latencies"]["message with links"]
+    buttons = result["latencies"]["button info"] + result["latencies"]["button audio"]
+    print(
+        f"{name:<18} {preloaded * 1000:>8.0f} {result['http']['aweme_detail']:>7,} "
+        f"{result['db']['StoredTikTok.find_one']:>8,} "
+        + " ".join(
+            f"{load_test.percentile(values, q) * 1000:>8.1f}"
+            for values in (links, buttons)
+            for q in (0.5, 0.95)
+        )
+    )
+
+
+async def main() -> None:
+    parser = load_test.build_parser()
+    parser.add_argument("--preload", type=int, default=300)
+    parser.set_defaults(api_latency=0.2)
+    args = parser.parse_args()
+    server, database = await load_test.setup(args)
+    store = bot._tiktok_store
+    store.start()
+    discord = load_test.FakeDiscord(args.discord_latency)
+    try:
+        tiktok.use_tiktok_store(store)
+        events = load_test.build_workload(args, server)
+        await load_test.run_pass(events, args.workers, server, database, discord)
+        await bot._usage_writer.stop()  # the conversions are what preloading ranks by
+        bot._usage_writer.start()
+        await store.stop()
+        store.start()
+        stored = [doc["_id"] for doc in database["StoredTikTok"].docs]
+        print(
+            f"{args.events:,} events before the restart, {len(stored):,} TikToks "
+            f"stored, {args.api_latency * 1000:.0f} ms TikTok latency\n"
+        )
+        print(
+            f"{'after restart':<18} {'load ms':>8} {'aweme':>7} {'store':>8} "
+            f"{'link p50':>8} {'link p95':>8} {'btn p50':>8} {'btn p95':>8}"
+        )
+        args.seed += 1  # new events, the same videos are popular
+        events = load_test.build_workload(args, server)
+        for name, use_store, preload in (
+            ("memory only", False, 0),
+            ("store", True, 0),
+            (f"store + top {args.preload}", True, args.preload),
+        ):
+            await StoredTikTok.get_motor_collection().delete_many(
+                {"_id": {"$nin": stored}}
+            )
+            tiktok.use_tiktok_store(store if use_store else None)
+            await run(name, preload, events, args, server, database, discord)
+            await store.stop()
+            store.start()
+    finally:
+        await bot.on_shutdown()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Asks a real MongoDB which index each usage data query uses, and fails if it
+isn't the expected one. The documents are written to a scratch database that
+is dropped afterwards.
+
+Run from the repository root, against a test server:
+    python -m benchmarks.check_indexes mongodb://localhost:27017
+"""
+import asyncio
+import sys
+from typing import Any, Dict, List
+
+import motor.motor_asyncio
+from beanie import init_beanie
+
+from database import UsageData
+
+SCRATCH_DATABASE = "tiktoker_index_check"
+
+# the filter, the index it must use
+QUERIES = [
+    ({"guild_id": 1, "user_id": 2}, "guild_id_1_user_id_1"),
+    ({"guild_id": 1}, "guild_id_1_user_id_1"),
+    ({"user_id": 2}, "user_id_1"),
+]
+
+
+def index_names(plan: Dict[str, Any]) -> List[str]:
+    """Collects the indexes an explain plan scans, through every stage."""
+    names = [plan["indexName"]] if "indexName" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            names += index_names(plan[key])
+    for stage in plan.get("inputStages", []):
+        names += index_names(stage)
+    return names
+
+
+async def main(url: str) -> int:
+    client = motor.motor_asyncio.AsyncIOMotorClient(url)
+    database = client[SCRATCH_DATABASE]
+    await init_beanie(database=database, document_models=[UsageData])
+    collection = UsageData.get_motor_collection()
+    failed = 0
+    try:
+        # enough documents that a collection scan is never the cheapest plan
+        await UsageData.insert_many(
+            [
+                UsageData(guild_id=g, user_id=u, video_id=g * u, message_id=g + u)
+                for g in range(20)
+                for u in range(200)
+            ]
+        )
+        for filter, expected in QUERIES:
+            # what delete_usage runs per chunk: the ids of up to 1000 matching
+            # records, then a delete of those ids
+            chunk = {"projection": {"_id": True}, "limit": 1000}
+            find = await collection.find(filter, **chunk).explain()
+            ids = [record["_id"] async for record in collection.find(filter, **chunk)]
+            delete = await database.command(
+                "explain",
+                {
+                    "delete": collection.name,
+                    "deletes": [{"q": {"_id": {"$in": ids}}, "limit": 0}],
+                },
+                verbosity="queryPlanner",
+            )
+            for name, explained, index in (
+                ("find", find, expected),
+                ("delete_many", delete, "_id_"),
+            ):
+                used = index_names(explained["queryPlanner"]["winningPlan"])
+                ok = index in used
+                failed += not ok
+                print(
+                    f"{'ok' if ok else 'FAIL':>4} {name:<12} {filter}: "
+                    f"{used or 'COLLSCAN'}"
+                )
+
+        indexes = await collection.index_information()
+        ttl = indexes.get("expires_at_ttl", {}).get("expireAfterSeconds")
+        failed += ttl != 0
+        print(f"{'ok' if ttl == 0 else 'FAIL':>4} expires_at TTL index: {ttl}")
+    finally:
+        await client.drop_database(SCRATCH_DATABASE)
+    return failed
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else "mongodb://localhost"
+    sys.exit(asyncio.run(main(url)))
@@ -0,0 +1,88 @@
+"""
+Checks how the interaction scheduler counts answers that fail: a response
+Discord rejects before the cutoff counts as failed, one that fails after it
+(the interaction expired, 10062) as late, and both lower the success rate
+and are raised to the caller. Also checks that the answer to a deferred
+interaction keeps the defer's visibility, which Discord would reject
+otherwise.
+
+Run from the repository root:
+    python -m benchmarks.check_interactions
+"""
+import asyncio
+import sys
+from types import SimpleNamespace
+from typing import Optional
+
+from benchmarks import load_test  # first, it quiets the missing .env warnings
+from interactions import InteractionScheduler
+
+
+class RejectedContext(load_test.FakeContext):
+    """Discord answers every response to it with an error, after `delay`."""
+
+    def __init__(self, discord: load_test.FakeDiscord, delay: float) -> None:
+        super().__init__(
+            discord,
+            load_test.FakeChannel(discord, next(load_test._snowflakes)),
+            load_test._user(7),
+            SimpleNamespace(id=1),
+        )
+        self.delay = delay
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        await asyncio.sleep(self.delay)
+        raise ConnectionResetError("Discord went away")
+
+
+async def failed_response(
+    name: str, cutoff: float, delay: float, expected: str
+) -> int:
+    discord = load_test.FakeDiscord(0)
+    scheduler = InteractionScheduler(cutoff=cutoff)
+    raised = False
+    try:
+        await scheduler.send(RejectedContext(discord, delay), "hello")
+    except ConnectionResetError:
+        raised = True
+    info = scheduler.info()
+    ok = raised and info.get(expected) == 1 and info["success_rate"] == 0
+    print(
+        f"{'ok' if ok else 'FAIL':>4} {name}: raised {raised}, "
+        f"{expected} {info.get(expected, 0)}, success rate {info['success_rate']}"
+    )
+    return not ok
+
+
+async def deferred_visibility() -> int:
+    discord = load_test.FakeDiscord(0)
+    ctx = load_test.FakeContext(
+        discord,
+        load_test.FakeChannel(discord, next(load_test._snowflakes)),
+        load_test._user(7),
+        SimpleNamespace(id=1),
+    )
+    scheduler = InteractionScheduler(mode="always")
+    await scheduler.run(ctx, "tiktok", asyncio.sleep(0))  # a public defer
+    try:
+        await scheduler.send(ctx, "Error: something broke", ephemeral=True)
+    except ValueError:
+        pass
+    ok = discord.calls["interaction_rejected"] == 0 and ctx.responded
+    print(
+        f"{'ok' if ok else 'FAIL':>4} ephemeral error after a public defer: "
+        f"{'sent' if ctx.responded else 'rejected'}"
+    )
+    return not ok
+
+
+async def main() -> int:
+    return (
+        await failed_response("rejected in time", 3, 0.01, "failed")
+        + await failed_response("expired interaction", 0.05, 0.1, "late")
+        + await deferred_visibility()
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,91 @@
+"""
+Checks that a shard stopped with SIGTERM, as the supervisor stops them, shuts
+down cleanly: the usage records and TikToks still queued when the signal
+arrives are written before the process exits.
+
+The shard is a child process running bot.main against an in-memory
+database, with a fake login and a gateway connection that never closes.
+
+Run from the repository root:
+    python -m benchmarks.check_shutdown
+"""
+import asyncio
+import signal
+import subprocess
+import sys
+
+from benchmarks import load_test  # first, it quiets the missing .env warnings
+import bot
+from benchmarks.fakes import FakeDatabase, make_aweme_detail
+from tiktok import TikTokData
+
+RECORDS = 50
+TIKTOKS = 20
+
+
+def shard() -> None:
+    database = FakeDatabase()
+    # long enough that nothing is written until shutdown
+    bot._usage_writer.flush_interval = 60
+    if bot._tiktok_store is not None:
+        bot._tiktok_store.flush_interval = 60
+
+    async def login(token) -> None:
+        pass
+
+    async def connect() -> None:
+        for n in range(RECORDS):
+            bot.insert_usage_data(1, 42, load_test.FIRST_VIDEO_ID + n, n)
+        for n in range(TIKTOKS):
+            tiktok = TikTokData.from_dict(
+                make_aweme_detail(load_test.FIRST_VIDEO_ID + n)
+            )
+            bot._tiktok_store.put(tiktok.id, tiktok.to_dict(), tiktok.fetched_at)
+        print("queued", flush=True)
+        await asyncio.Event().wait()
+
+    bot.bot.login = login
+    bot.bot._connection_state.start = connect
+    try:
+        bot.bot.loop.run_until_complete(bot.main(database))
+    except asyncio.CancelledError:
+        pass
+    print(len(database["UsageData"].docs), len(database["StoredTikTok"].docs))
+
+
+def main() -> int:
+    child = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.check_shutdown", "--shard"],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        while child.stdout.readline().strip() != "queued":
+            if child.poll() is not None:
+                print("FAIL the shard exited before queueing anything")
+                return 1
+        child.send_signal(signal.SIGTERM)
+        output, _ = child.communicate(timeout=30)
+    finally:
+        if child.poll() is None:
+            child.kill()
+    if child.returncode != 0:  # killed by the signal, before shutting down
+        print(f"FAIL the shard exited with {child.returncode}")
+        return 1
+    records, tiktoks = map(int, output.split()[-2:])
+    failed = 0
+    for name, written, queued in (
+        ("usage records", records, RECORDS),
+        ("TikToks", tiktoks, TIKTOKS),
+    ):
+        ok = written == queued
+        failed += not ok
+        print(f"{'ok' if ok else 'FAIL':>4} {name}: {written} of {queued} written")
+    return failed
+
+
+if __name__ == "__main__":
+    if "--shard" in sys.argv:
+        shard()
+    else:
+        sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+A local aiohttp server standing in for the TikTok endpoints the bot calls.
+"""
+import asyncio
+import json
+import random
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+from benchmarks.fakes import make_aweme_detail
+
+
+class FakeTikTok:
+    """
+    Serves aweme_detail for any id, music_detail for any music id, and
+    redirects the short links in `short_links` to their video.
+
+    Latency comes from `latency()`, plus `overload_latency` for every request
+    in flight beyond `capacity`. Past `reject_above` requests in flight, or
+    with probability `error_rate`, it answers `error_status` instead. With
+    probability `missing_music_rate` music_detail answers status 10218.
+    """
+
+    def __init__(
+        self,
+        latency: Callable[[], float] = lambda: 0.02,
+        capacity: int = 1_000_000,
+        overload_latency: float = 0.0,
+        reject_above: Optional[int] = None,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        missing_music_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.capacity = capacity
+        self.overload_latency = overload_latency
+        self.reject_above = reject_above
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.missing_music_rate = missing_music_rate
+        self.short_links: Dict[str, int] = {}
+        self.rng = random.Random(seed)
+        self.requests: Counter = Counter()
+        self.in_flight = 0
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/aweme/v1/aweme/detail/", self.aweme_detail)
+        app.router.add_get("/api/music/detail/", self.music_detail)
+        app.router.add_get(r"/{short_id:\w{5,15}}{slash:/?}", self.short_link)
+        return app
+
+    async def start(self) -> str:
+        """
+        Starts the server on a free local port.
+
+        returns:
+            The base url of the server.
+        """
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    def session(self, **kwargs) -> aiohttp.ClientSession:
+        """
+        Builds a session that sends every request to this server instead of
+        the host in the url, like pointing TikTok's hosts at it in DNS.
+        """
+        return _LocalSession(URL(self.url), **kwargs)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _delay(self) -> bool:
+        """Sleeps like the real thing would, returns whether to fail."""
+        if self.reject_above is not None and self.in_flight > self.reject_above:
+            return True
+        over = max(0, self.in_flight - self.capacity)
+        await asyncio.sleep(self.latency() + over * self.overload_latency)
+        return self.rng.random() < self.error_rate
+
+    async def aweme_detail(self, request: web.Request) -> web.Response:
+        self.requests["aweme_detail"] += 1
+        self.in_flight += 1
+        try:
+            if await self._delay():
+                self.requests[self.error_status] += 1
+                return web.Response(status=self.error_status)
+        finally:
+            self.in_flight -= 1
+        aweme_id = int(request.query["aweme_id"])
+        return web.Response(
+            body=json.dumps(
+                {"aweme_detail": make_aweme_detail(aweme_id), "status_code": 0}
+            ),
+            content_type="application/json",
+        )
+
+    async def music_detail(self, request: web.Request) -> web.Response:
+        self.requests["music_detail"] += 1
+        await asyncio.sleep(self.latency())
+        if self.rng.random() < self.missing_music_rate:
+            body = {"statusCode": 10218, "statusMsg": ""}
+        else:
+            music_id = int(request.query["musicId"])
+            body = {
+                "statusCode": 0,
+                "musicInfo": {
+                    "music": {"id": str(music_id), "title": "original sound"},
+                    "stats": {"videoCount": music_id % 100_000},
+                },
+            }
+        return web.Response(body=json.dumps(body), content_type="application/json")
+
+    async def short_link(self, request: web.Request) -> web.Response:
+        self.requests["short_link"] += 1
+        await asyncio.sleep(self.latency())
+        video_id = self.short_links.get(request.match_info["short_id"])
+        if video_id is None:
+            return web.Response(status=404)
+        raise web.HTTPMovedPermanently(
+            f"https://www.tiktok.com/@someone/video/{video_id}?_r=1"
+        )
+
+
+class _LocalSession(aiohttp.ClientSession):
+    def __init__(self, base: URL, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._base = base
+
+    def _request(self, method: str, str_or_url, **kwargs):
+        url = URL(str_or_url)
+        local = self._base.with_path(url.raw_path).with_query(url.raw_query_string)
+        return super()._request(method, local, **kwargs)
@@ -0,0 +1,636 @@
+"""
+In-memory stand-ins for the services the bot talks to.
+"""
+import asyncio
+import random
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+
+class FakeCollection:
+    """
+    Enough of a motor collection for the bot and Beanie, with unique indexes
+    enforced atomically like the server does. Each call sleeps `latency`
+    seconds on the way in and out, so concurrent callers interleave like
+    real ones. Building an index that doesn't exist yet takes `index_build`
+    seconds more, like building it over a full collection.
+    """
+
+    def __init__(
+        self,
+        unique: Iterable[str] = (),
+        latency: float = 0.0,
+        name: str = "",
+        index_build: float = 0.0,
+    ) -> None:
+        self.name = name
+        self.index_build = index_build
+        self.docs: List[Dict[str, Any]] = []
+        self.unique: Tuple[Tuple[str, ...], ...] = ()
+        self._by_unique: Dict[Tuple[str, ...], Dict[Tuple, Dict[str, Any]]] = {}
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._indexes: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", 1)]}}
+        self._add_unique(("_id",))
+        for key in unique:
+            self._add_unique((key,))
+
+    def _add_unique(self, keys: Tuple[str, ...]) -> None:
+        if keys in self._by_unique:
+            return
+        self.unique += (keys,)
+        self._by_unique[keys] = {}
+        for doc in self.docs:
+            if (value := _index_key(doc, keys)) is not None:
+                self._by_unique[keys][value] = doc
+
+    async def _request(self, name: str) -> None:
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency / 2)
+
+    async def _response(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency / 2)
+
+    def _find_all(self, filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if "$or" in filter:
+            # each branch on its own, so the ones on a unique index use it
+            rest = {key: value for key, value in filter.items() if key != "$or"}
+            found = {}
+            for part in filter["$or"]:
+                for doc in self._find_all({**part, **rest}):
+                    found[id(doc)] = doc
+            return list(found.values())
+        for keys, index in self._by_unique.items():
+            value = _index_key(filter, keys)
+            if value is not None and not any(isinstance(v, dict) for v in value):
+                doc = index.get(value)
+                return [doc] if doc is not None and _matches(doc, filter) else []
+        return [doc for doc in self.docs if _matches(doc, filter)]
+
+    def _find(self, filter: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        docs = self._find_all(filter)
+        return docs[0] if docs else None
+
+    def _insert(self, doc: Dict[str, Any]) -> None:
+        if doc.get("_id") is None:
+            doc["_id"] = ObjectId()
+        for keys, index in self._by_unique.items():
+            if (value := _index_key(doc, keys)) is not None and value in index:
+                raise DuplicateKeyError(f"E11000 duplicate key {keys}: {value}")
+        self._index(doc)
+        self.docs.append(doc)
+
+    def _index(self, doc: Dict[str, Any]) -> None:
+        for keys, index in self._by_unique.items():
+            if (value := _index_key(doc, keys)) is not None:
+                index[value] = doc
+
+    def _unindex(self, doc: Dict[str, Any]) -> None:
+        for keys, index in self._by_unique.items():
+            if (value := _index_key(doc, keys)) is not None:
+                index.pop(value, None)
+
+    def _remove(self, doc: Dict[str, Any]) -> None:
+        self._unindex(doc)
+        self.docs.remove(doc)
+
+    def _update(
+        self, doc: Dict[str, Any], update: Dict[str, Dict[str, Any]]
+    ) -> None:
+        self._unindex(doc)
+        for key, value in update.get("$set", {}).items():
+            _set_path(doc, key, value)
+        for key, value in update.get("$inc", {}).items():
+            _set_path(doc, key, _get_path(doc, key, 0) + value)
+        for key, value in update.get("$max", {}).items():
+            current = _get_path(doc, key, None)
+            if current is None or value > current:
+                _set_path(doc, key, value)
+        for key in update.get("$unset", {}):
+            _unset_path(doc, key)
+        self._index(doc)
+
+    def _upsert(
+        self, filter: Dict[str, Any], update: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        doc = {key: value for key, value in filter.items() if not key.startswith("$")}
+        for key, value in update.get("$setOnInsert", {}).items():
+            _set_path(doc, key, value)
+        self._insert(doc)
+        self._update(doc, update)
+        return doc
+
+    @staticmethod
+    def _project(doc: Dict[str, Any], projection: Optional[Dict[str, bool]]):
+        if not projection:
+            return dict(doc)
+        # like the server, _id is included unless it is excluded
+        projection = {"_id": True, **projection}
+        return {key: doc[key] for key, keep in projection.items() if keep and key in doc}
+
+    async def find_one(self, filter: Dict[str, Any], projection=None, **kwargs):
+        await self._request("find_one")
+        doc = self._find(filter)
+        await self._response()
+        return None if doc is None else self._project(doc, projection)
+
+    def find(
+        self,
+        filter: Optional[Dict[str, Any]] = None,
+        projection=None,
+        skip: int = 0,
+        limit: int = 0,
+        **kwargs,
+    ) -> "FakeCursor":
+        return FakeCursor(self, filter or {}, projection, skip, limit)
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        await self._request("count_documents")
+        count = len(self._find_all(filter))
+        await self._response()
+        return count
+
+    async def insert_one(self, doc: Dict[str, Any], **kwargs):
+        await self._request("insert_one")
+        doc = dict(doc)
+        self._insert(doc)
+        await self._response()
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(
+        self, docs: Iterable[Dict[str, Any]], ordered: bool = True, **kwargs
+    ):
+        await self._request("insert_many")
+        ids = []
+        for doc in docs:
+            doc = dict(doc)
+            self._insert(doc)
+            ids.append(doc["_id"])
+        await self._response()
+        return SimpleNamespace(inserted_ids=ids)
+
+    async def update_one(
+        self,
+        filter: Dict[str, Any],
+        update: Dict[str, Dict[str, Any]],
+        upsert: bool = False,
+        **kwargs,
+    ):
+        await self._request("update_one")
+        doc = self._find(filter)
+        if doc is not None:
+            self._update(doc, update)
+        elif upsert:
+            self._upsert(filter, update)
+        await self._response()
+        return SimpleNamespace(matched_count=int(doc is not None))
+
+    async def update_many(
+        self,
+        filter: Dict[str, Any],
+        update: Dict[str, Dict[str, Any]],
+        upsert: bool = False,
+        **kwargs,
+    ):
+        await self._request("update_many")
+        docs = self._find_all(filter)
+        for doc in docs:
+            self._update(doc, update)
+        if not docs and upsert:
+            self._upsert(filter, update)
+        await self._response()
+        return SimpleNamespace(matched_count=len(docs))
+
+    async def bulk_write(self, requests: Iterable[Any], ordered: bool = True, **kwargs):
+        await self._request("bulk_write")
+        for request in requests:
+            # pymongo's UpdateOne and UpdateMany keep their arguments privately
+            filter, update, upsert = request._filter, request._doc, request._upsert
+            docs = self._find_all(filter)
+            if isinstance(request, UpdateOne):
+                docs = docs[:1]
+            for doc in docs:
+                self._update(doc, update)
+            if not docs and upsert:
+                self._upsert(filter, update)
+        await self._response()
+
+    async def delete_one(self, filter: Dict[str, Any], **kwargs):
+        await self._request("delete_one")
+        docs = self._find_all(filter)[:1]
+        for doc in docs:
+            self._remove(doc)
+        await self._response()
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def delete_many(self, filter: Dict[str, Any], **kwargs):
+        await self._request("delete_many")
+        docs = self._find_all(filter)
+        for doc in docs:
+            self._remove(doc)
+        await self._response()
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def find_one_and_update(
+        self,
+        filter: Dict[str, Any],
+        update: Dict[str, Dict[str, Any]],
+        projection=None,
+        upsert: bool = False,
+        return_document=ReturnDocument.BEFORE,
+        **kwargs,
+    ):
+        await self._request("find_one_and_update")
+        doc = self._find(filter)
+        before = None if doc is None else dict(doc)
+        if doc is None:
+            if upsert:
+                doc = self._upsert(filter, update)
+        else:
+            self._update(doc, update)
+        await self._response()
+        result = doc if return_document == ReturnDocument.AFTER else before
+        return None if result is None else self._project(result, projection)
+
+    async def index_information(self) -> Dict[str, Dict[str, Any]]:
+        await self._request("index_information")
+        await self._response()
+        return dict(self._indexes)
+
+    async def create_indexes(
+        self, indexes: Iterable[IndexModel], **kwargs
+    ) -> List[str]:
+        await self._request("create_indexes")
+        indexes = list(indexes)
+        new = sum(index.document["name"] not in self._indexes for index in indexes)
+        if new and self.index_build:
+            await asyncio.sleep(new * self.index_build)
+        await self._response()
+        names = []
+        for index in indexes:
+            document = index.document
+            keys = list(document["key"].items())
+            self._indexes[document["name"]] = {"key": keys, **document}
+            if document.get("unique"):
+                self._add_unique(tuple(key for key, _ in keys))
+            names.append(document["name"])
+        return names
+
+    async def drop_index(self, name: str, **kwargs) -> None:
+        self._indexes.pop(name, None)
+
+    def aggregate(
+        self, pipeline: List[Dict[str, Any]], **kwargs
+    ) -> "FakeAggregation":
+        return FakeAggregation(self, pipeline)
+
+
+class FakeCursor:
+    """
+    The part of a motor cursor Beanie iterates over.
+    """
+
+    def __init__(
+        self,
+        collection: FakeCollection,
+        filter: Dict[str, Any],
+        projection: Optional[Dict[str, bool]],
+        skip: int,
+        limit: int,
+    ) -> None:
+        self.collection = collection
+        self.filter = filter
+        self.projection = projection
+        self.skip = skip
+        self.limit = limit
+        self._docs: Optional[Iterator[Dict[str, Any]]] = None
+
+    async def _fetch(self) -> Iterator[Dict[str, Any]]:
+        if self._docs is None:
+            await self.collection._request("find")
+            docs = self.collection._find_all(self.filter)[self.skip :]
+            if self.limit:
+                docs = docs[: self.limit]
+            self._docs = iter(
+                [self.collection._project(doc, self.projection) for doc in docs]
+            )
+            await self.collection._response()
+        return self._docs
+
+    def __aiter__(self) -> "FakeCursor":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        try:
+            return next(await self._fetch())
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        docs = list(await self._fetch())
+        return docs if length is None else docs[:length]
+
+
+class FakeAggregation(FakeCursor):
+    """
+    An aggregation cursor, with only the $match, $group (summing), $sort and
+    $limit stages.
+    """
+
+    def __init__(
+        self, collection: FakeCollection, pipeline: List[Dict[str, Any]]
+    ) -> None:
+        super().__init__(collection, {}, None, 0, 0)
+        self.pipeline = pipeline
+
+    async def _fetch(self) -> Iterator[Dict[str, Any]]:
+        if self._docs is None:
+            await self.collection._request("aggregate")
+            docs = [dict(doc) for doc in self.collection.docs]
+            for stage in self.pipeline:
+                op, spec = next(iter(stage.items()))
+                docs = getattr(self, f"_{op[1:]}")(docs, spec)
+            self._docs = iter(docs)
+            await self.collection._response()
+        return self._docs
+
+    @staticmethod
+    def _match(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict]:
+        return [doc for doc in docs if _matches(doc, spec)]
+
+    @staticmethod
+    def _group(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict]:
+        def value(doc: Dict[str, Any], expression: Any) -> Any:
+            if isinstance(expression, str) and expression.startswith("$"):
+                return _get_path(doc, expression[1:], None)
+            return expression
+
+        groups: Dict[Any, Dict[str, Any]] = {}
+        for doc in docs:
+            key = value(doc, spec["_id"])
+            group = groups.setdefault(key, {"_id": key})
+            for field, accumulator in spec.items():
+                if field != "_id":
+                    group[field] = group.get(field, 0) + value(doc, accumulator["$sum"])
+        return list(groups.values())
+
+    @staticmethod
+    def _sort(docs: List[Dict[str, Any]], spec: Dict[str, int]) -> List[Dict]:
+        for field, direction in reversed(list(spec.items())):
+            docs = sorted(docs, key=lambda doc: doc[field], reverse=direction < 0)
+        return docs
+
+    @staticmethod
+    def _limit(docs: List[Dict[str, Any]], limit: int) -> List[Dict]:
+        return docs[:limit]
+
+
+class FakeDatabase:
+    """
+    Enough of a motor database for init_beanie, handing out FakeCollections
+    that all share the same latency and index build time.
+    """
+
+    def __init__(self, latency: float = 0.0, index_build: float = 0.0) -> None:
+        self.latency = latency
+        self.index_build = index_build
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(
+                latency=self.latency, name=name, index_build=self.index_build
+            )
+        return self.collections[name]
+
+    async def command(self, command: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "buildInfo" in command:
+            return {"version": "6.0.0"}
+        raise NotImplementedError(command)
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return list(self.collections)
+
+    @property
+    def calls(self) -> Counter:
+        calls: Counter = Counter()
+        for name, collection in self.collections.items():
+            for call, count in collection.calls.items():
+                calls[f"{name}.{call}"] += count
+        return calls
+
+
+def _index_key(doc: Dict[str, Any], keys: Tuple[str, ...]) -> Optional[Tuple]:
+    if all(key in doc for key in keys):
+        return tuple(doc[key] for key in keys)
+    return None
+
+
+def _get_path(doc: Dict[str, Any], path: str, default: Any) -> Any:
+    for key in path.split("."):
+        if not isinstance(doc, dict) or key not in doc:
+            return default
+        doc = doc[key]
+    return doc
+
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any) -> None:
+    *parents, last = path.split(".")
+    for key in parents:
+        doc = doc.setdefault(key, {})
+    doc[last] = value
+
+
+def _unset_path(doc: Dict[str, Any], path: str) -> None:
+    *parents, last = path.split(".")
+    for key in parents:
+        if not isinstance(doc := doc.get(key), dict):
+            return
+    doc.pop(last, None)
+
+
+def _matches(doc: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(_matches(doc, part) for part in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches(doc, part) for part in condition):
+                return False
+            continue
+        if key == "$expr":
+            if not _evaluate(doc, condition):
+                return False
+            continue
+        value = _get_path(doc, key, None)
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if not _OPERATORS[op](value, operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+_OPERATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$exists": lambda value, operand: (value is not None) == operand,
+}
+
+
+def _evaluate(doc: Dict[str, Any], expression: Any) -> Any:
+    """An aggregation expression, with only the operators the bot uses."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get_path(doc, expression[1:], None)
+    if not isinstance(expression, dict) or not expression:
+        return expression
+    op, operand = next(iter(expression.items()))
+    if isinstance(operand, list):
+        args = [_evaluate(doc, arg) for arg in operand]
+    else:
+        args = [_evaluate(doc, operand)]
+    return _EXPRESSIONS[op](*args)
+
+
+_EXPRESSIONS = {
+    "$gt": lambda a, b: a > b,
+    "$size": len,
+    "$objectToArray": lambda value: [{"k": k, "v": v} for k, v in value.items()],
+    "$ifNull": lambda value, default: default if value is None else value,
+}
+
+
+def make_aweme_detail(aweme_id: int, tags: int = 4, seed: int = 0) -> Dict[str, Any]:
+    """
+    Builds an aweme_detail payload shaped like the ones api2.musical.ly returns,
+    including the bulk of fields the bot never reads.
+    """
+    rng = random.Random(seed + aweme_id)
+    names = [f"tag{rng.randrange(10**6)}" for _ in range(tags)]
+    text = "the moment you realise it is monday again 😭"
+    desc = text
+    text_extra = []
+    for name in names:
+        desc += " "
+        text_extra.append(
+            {
+                "start": len(desc),
+                "end": len(desc) + len(name) + 1,
+                "type": 1,
+                "hashtag_name": name,
+                "hashtag_id": str(rng.randrange(10**18)),
+                "is_commerce": False,
+            }
+        )
+        desc += f"#{name}"
+
+    def urls(kind: str, n: int = 3) -> Dict[str, Any]:
+        uri = f"tos-useast2a-{kind}-0037/{rng.getrandbits(128):032x}"
+        return {
+            "uri": uri,
+            "url_list": [
+                f"https://p{i}-sign-va.tiktokcdn.com/{uri}~tplv-dmt-logom:tos.image"
+                f"?x-expires=1646550000&x-signature=Abc{rng.getrandbits(64):x}%3D"
+                for i in range(n)
+            ],
+            "width": 720,
+            "height": 720,
+            "url_key": f"{uri}_h264_540p_{rng.randrange(10**6)}",
+            "data_size": rng.randrange(10**6, 10**7),
+        }
+
+    owner = f"user{rng.randrange(10**8)}"
+    return {
+        "aweme_id": str(aweme_id),
+        "desc": desc,
+        "create_time": 1645747200 + rng.randrange(10**6),
+        "author": {
+            "uid": str(rng.randrange(10**18)),
+            "short_id": "0",
+            "nickname": "Some Creator ✨",
+            "signature": "links below\nbusiness: someone@example.com",
+            "avatar_thumb": urls("avt", 2),
+            "avatar_medium": urls("avt", 2),
+            "avatar_larger": urls("avt", 2),
+            "follow_status": 0,
+            "unique_id": owner,
+            "region": "US",
+            "custom_verify": "",
+            "is_block": False,
+            "language": "en",
+        },
+        "music": {
+            "id": rng.randrange(10**18),
+            "id_str": str(rng.randrange(10**18)),
+            "title": "original sound",
+            "author": "Some Creator ✨",
+            "album": "",
+            "cover_large": urls("music", 2),
+            "cover_medium": urls("music", 2),
+            "cover_thumb": urls("music", 2),
+            "play_url": urls("music", 2),
+            "avatar_thumb": urls("avt", 2),
+            "owner_nickname": "Some Creator ✨",
+            "owner_handle": owner,
+            "duration": 15,
+            "is_original": True,
+        },
+        "video": {
+            "play_addr": urls("video", 3),
+            "cover": urls("cover", 3),
+            "dynamic_cover": urls("cover", 3),
+            "origin_cover": urls("cover", 3),
+            "download_addr": urls("video", 3),
+            "bit_rate": [
+                {
+                    "gear_name": f"normal_{q}_0",
+                    "quality_type": q,
+                    "bit_rate": rng.randrange(10**5, 10**6),
+                    "play_addr": urls("video", 3),
+                }
+                for q in (540, 720, 1080)
+            ],
+            "height": 1024,
+            "width": 576,
+            "duration": 15000,
+            "ratio": "540p",
+        },
+        "share_url": f"https://www.tiktok.com/@{owner}/video/{aweme_id}.html"
+        "?_d=secCgYIASAHKAESPgo8&checksum=abc&language=en&preview_pb=0",
+        "statistics": {
+            "aweme_id": str(aweme_id),
+            "comment_count": rng.randrange(10**5),
+            "digg_count": rng.randrange(10**7),
+            "download_count": rng.randrange(10**5),
+            "play_count": rng.randrange(10**8),
+            "share_count": rng.randrange(10**5),
+            "forward_count": 0,
+            "lose_count": 0,
+            "lose_comment_count": 0,
+        },
+        "text_extra": text_extra,
+        "region": "US",
+        "risk_infos": {"vote": False, "warn": False, "risk_sink": False, "type": 0},
+        "status": {"is_delete": False, "allow_share": True, "private_status": 0},
+        "cha_list": [
+            {"cid": str(rng.randrange(10**18)), "cha_name": name, "desc": "", "schema": ""}
+            for name in names
+        ],
+    }
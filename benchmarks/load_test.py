@@ -0,0 +1,373 @@
+"""
+Drives the bot's handlers end to end with synthetic Discord events, against
+the local fake TikTok API and an in-memory database, and reports throughput,
+latency and the calls made per message.
+
+The same workload runs twice, cold and then with warm caches.
+
+Run from the repository root:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --events 20000 --workers 200 --db-latency 0.002
+    python -m benchmarks.load_test --prefetch-min inf
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from itertools import accumulate
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+# bot.py reads its settings from .env, which a benchmark run doesn't have
+logging.getLogger("dotenv.main").setLevel(logging.ERROR)
+
+import aiohttp
+
+import bot
+import session
+from rollup import total_usage
+from benchmarks.fake_api import FakeTikTok
+from benchmarks.fakes import FakeDatabase
+from database import Config, OptedOut, init_database
+
+BOT_ID = 900_000_000_000_000_001
+FIRST_VIDEO_ID = 7_068_971_038_273_423_621
+
+_snowflakes = itertools.count(1_000_000_000_000_000_000)
+DISCORD_EPOCH_MS = 1_420_070_400_000
+INTERACTION_CUTOFF = 3
+
+
+class FakeDiscord:
+    """
+    Counts the REST calls the bot makes, each taking `latency` seconds.
+    """
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def call(self, name: str) -> None:
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeChannel:
+    def __init__(self, discord: FakeDiscord, id: int) -> None:
+        self.discord = discord
+        self.id = id
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> "FakeMessage":
+        await self.discord.call("create_message")
+        return FakeMessage(self.discord, self, _user(BOT_ID), None, content or "")
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        discord: FakeDiscord,
+        channel: FakeChannel,
+        author: SimpleNamespace,
+        guild: Optional[SimpleNamespace],
+        content: str,
+    ) -> None:
+        self.discord = discord
+        self.id = next(_snowflakes)
+        self.channel = channel
+        self._channel_id = channel.id
+        self.author = author
+        self.guild = guild
+        self.content = content
+        self.jump_url = f"https://discord.com/channels/0/{channel.id}/{self.id}"
+
+    async def delete(self) -> None:
+        await self.discord.call("delete_message")
+
+    async def suppress_embeds(self) -> "FakeMessage":
+        await self.discord.call("edit_message")
+        return self
+
+
+class FakeContext:
+    def __init__(
+        self,
+        discord: FakeDiscord,
+        channel: FakeChannel,
+        author: SimpleNamespace,
+        guild: SimpleNamespace,
+        custom_id: str = "",
+    ) -> None:
+        self.discord = discord
+        self.channel = channel
+        self.author = author
+        self.guild = guild
+        self.custom_id = custom_id
+        # created now, as far as the deadline of the first response goes
+        self.interaction_id = str(int(time.time() * 1000) - DISCORD_EPOCH_MS << 22)
+        self.created = time.monotonic()
+        self.first_response: Optional[float] = None
+        """ Seconds from creation to the first response """
+        self.deferred = False
+        self.responded = False
+        self.ephemeral = False
+
+    async def defer(self, ephemeral: bool = False) -> None:
+        await self.discord.call("interaction_defer")
+        self._first_response()
+        self.deferred = True
+        self.ephemeral = ephemeral
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        await self.discord.call("interaction_send")
+        if (
+            self.deferred
+            and not self.responded
+            and kwargs.get("ephemeral", False) != self.ephemeral
+        ):
+            # the answer edits the deferred response, which has its visibility
+            self.discord.calls["interaction_rejected"] += 1
+            raise ValueError("Cannot change the visibility of a deferred response")
+        self._first_response()
+        self.responded = True
+        return FakeMessage(
+            self.discord, self.channel, _user(BOT_ID), None, content or ""
+        )
+
+    def _first_response(self) -> None:
+        if self.deferred or self.responded:
+            return
+        self.first_response = time.monotonic() - self.created
+        if self.first_response > INTERACTION_CUTOFF:
+            # Discord would have dropped the interaction, the bot can't tell
+            self.discord.calls["interaction_late"] += 1
+
+
+def _user(id: int) -> SimpleNamespace:
+    return SimpleNamespace(id=id, mention=f"<@{id}>")
+
+
+def build_workload(args: argparse.Namespace, server: FakeTikTok) -> List[Tuple]:
+    """
+    Builds the events, videos picked with a Zipf-like popularity so some go
+    viral and most are seen once or twice. Button clicks are on recently
+    posted links.
+    """
+    rng = random.Random(args.seed)
+    videos = [FIRST_VIDEO_ID + n for n in range(args.videos)]
+    popularity = list(
+        accumulate(1 / rank**args.zipf for rank in range(1, len(videos) + 1))
+    )
+    short_ids = {}
+    for n, video_id in enumerate(videos):
+        if rng.random() < args.short_rate:
+            short_ids[video_id] = f"ZM{n:07d}"
+            server.short_links[short_ids[video_id]] = video_id
+
+    linked: List[int] = []
+
+    def link() -> str:
+        video_id = rng.choices(videos, cum_weights=popularity)[0]
+        linked.append(video_id)
+        if video_id in short_ids:
+            return f"https://vm.tiktok.com/{short_ids[video_id]}/"
+        return f"https://www.tiktok.com/@someone/video/{video_id}?lang=en"
+
+    events = []
+    for _ in range(args.events):
+        guild = rng.randrange(args.guilds)
+        user = rng.randrange(args.users)
+        roll = rng.random()
+        if roll < args.click_rate:
+            # people click the Info and Audio of links posted a little earlier
+            video_id = rng.choice(linked[-args.click_window :] or videos)
+            prefix = "m_id" if rng.random() < args.audio_share else "v_id"
+            events.append(("button", guild, user, f"{prefix}{video_id}"))
+        elif roll < args.click_rate + args.slash_rate:
+            events.append(("slash", guild, user, link()))
+        elif rng.random() < args.link_rate:
+            links = [link() for _ in range(1 if rng.random() > args.multi_rate else 3)]
+            events.append(("message", guild, user, "look at this " + " ".join(links)))
+        else:
+            events.append(("message", guild, user, "nothing to see here, chatting"))
+    return events
+
+
+async def setup(args: argparse.Namespace) -> Tuple[FakeTikTok, FakeDatabase]:
+    server = FakeTikTok(
+        latency=lambda: max(0.0, random.gauss(args.api_latency, args.api_latency / 4)),
+        missing_music_rate=0.1,
+        seed=args.seed,
+    )
+    await server.start()
+    database = FakeDatabase(latency=args.db_latency)
+    await init_database(database)
+
+    # a few guilds with every mode, the rest get the default config on first use
+    for guild in range(0, args.guilds, 10):
+        await Config(
+            guild_id=guild, delete_origin=guild % 20 == 0, suppress_origin_embed=True
+        ).insert()
+    for user in range(0, args.users, 50):
+        await OptedOut(user_id=user).insert()
+    await bot.load_guild_configs()
+    await bot.load_opted_out()
+    bot._usage_writer.start()
+    if args.prefetch_min is not None:
+        bot.PREFETCH_MIN_CONVERSIONS = args.prefetch_min
+    bot._prefetcher.start()
+    # the shared session, pointed at the fake server
+    session._session = server.session(timeout=aiohttp.ClientTimeout(total=5))
+    bot.bot._user = SimpleNamespace(id=BOT_ID)
+    for collection in database.collections.values():
+        collection.calls.clear()
+    return server, database
+
+
+async def run_pass(
+    events: List[Tuple],
+    workers: int,
+    server: FakeTikTok,
+    database: FakeDatabase,
+    discord: FakeDiscord,
+) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    queue = iter(events)
+    channel = FakeChannel(discord, next(_snowflakes))
+    http_before = Counter(server.requests)
+    db_before = database.calls
+    discord_before = Counter(discord.calls)
+
+    async def handle(kind: str, guild: int, user: int, payload: str) -> None:
+        guild_ns = SimpleNamespace(id=guild)
+        if kind == "message":
+            message = FakeMessage(discord, channel, _user(user), guild_ns, payload)
+            await bot.on_message_create(SimpleNamespace(message=message))
+        elif kind == "slash":
+            ctx = FakeContext(discord, channel, _user(user), guild_ns)
+            await bot.slash_tiktok.callback(ctx, payload)
+        else:
+            ctx = FakeContext(discord, channel, _user(user), guild_ns, payload)
+            await bot.on_button_click(SimpleNamespace(context=ctx))
+
+    async def worker() -> None:
+        for kind, guild, user, payload in queue:
+            if kind == "message" and "tiktok.com" in payload:
+                kind = "message with links"
+            elif kind == "button":
+                kind = "button audio" if payload.startswith("m_id") else "button info"
+            start = time.perf_counter()
+            try:
+                await handle(kind.split()[0], guild, user, payload)
+            except Exception as e:
+                errors[f"{kind}: {type(e).__name__}"] += 1
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    elapsed = time.perf_counter() - start
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "errors": errors,
+        "http": Counter(server.requests) - http_before,
+        "db": database.calls - db_before,
+        "discord": Counter(discord.calls) - discord_before,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(name: str, result: Dict[str, Any]) -> None:
+    latencies = result["latencies"]
+    events = sum(len(values) for values in latencies.values())
+    messages = sum(
+        len(values) for kind, values in latencies.items() if kind.startswith("message")
+    )
+    print(f"\n{name}: {events:,} events in {result['elapsed']:.2f}s")
+    print(
+        f"  {events / result['elapsed']:,.0f} events/s, "
+        f"{messages / result['elapsed']:,.0f} messages/s"
+    )
+    print(f"  {'event':<20} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind, values in sorted(latencies.items()):
+        quantiles = (percentile(values, q) * 1000 for q in (0.5, 0.95, 0.99))
+        print(
+            f"  {kind:<20} {len(values):>7,} "
+            + " ".join(f"{value:>8.2f}" for value in quantiles)
+        )
+    for label, calls in (
+        ("http", result["http"]),
+        ("db", result["db"]),
+        ("discord", result["discord"]),
+    ):
+        total = sum(calls.values())
+        detail = ", ".join(f"{call} {count:,}" for call, count in calls.most_common())
+        print(
+            f"  {label} calls: {total / events:.3f}/event, "
+            f"{total / messages:.3f}/message ({detail or 'none'})"
+        )
+    if result["errors"]:
+        errors = result["errors"].items()
+        print("  errors: " + ", ".join(f"{error} x{n}" for error, n in errors))
+
+
+async def main(args: argparse.Namespace) -> None:
+    server, database = await setup(args)
+    discord = FakeDiscord(args.discord_latency)
+    events = build_workload(args, server)
+    try:
+        for name in ("cold", "warm"):
+            result = await run_pass(events, args.workers, server, database, discord)
+            report(name, result)
+    finally:
+        await bot.on_shutdown()
+        await server.stop()
+    usage = database["UsageData"]
+    print(
+        f"\nusage records written: {len(usage.docs):,} "
+        f"in {usage.calls['insert_many']} batches"
+    )
+    totals = await total_usage()
+    print(
+        f"rolled up: {totals['conversions']:,} conversions, "
+        f"~{totals['users']:,} users"
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=100)
+    parser.add_argument("--videos", type=int, default=2000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--link-rate", type=float, default=0.3)
+    parser.add_argument("--short-rate", type=float, default=0.3)
+    parser.add_argument("--multi-rate", type=float, default=0.1)
+    parser.add_argument("--click-rate", type=float, default=0.1)
+    parser.add_argument("--click-window", type=int, default=200)
+    parser.add_argument("--audio-share", type=float, default=0.2)
+    parser.add_argument("--slash-rate", type=float, default=0.02)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--discord-latency", type=float, default=0.03)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--prefetch-min",
+        type=float,
+        help="conversions per guild in 10 minutes that turn on prefetching, "
+        "0 for always and inf for never",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    asyncio.run(main(build_parser().parse_args()))
@@ -0,0 +1,82 @@
+"""
+Hammers create_short_url with concurrent, overlapping requests against an
+in-memory Shortener collection and checks every video got exactly one slug.
+
+Run from the repository root:
+    python -m benchmarks.stress_short_url
+"""
+import asyncio
+import random
+import time
+from unittest import mock
+
+import shortener
+from benchmarks.fakes import FakeCollection
+
+
+def reset_process_caches() -> None:
+    """Forgets what this process knows, as if it were another worker."""
+    shortener._short_urls.clear()
+
+
+async def stress(
+    videos: int, requests: int, workers: int, latency: float, tiny_slugs: bool
+) -> None:
+    collection = FakeCollection(unique=("video_uri", "slug"), latency=latency)
+    uris = [f"v09044g40000c{n:012d}" for n in range(videos)]
+    rng = random.Random(0)
+    results = {}
+
+    make_slug = real_make_slug = shortener.make_slug
+    if tiny_slugs:
+        # squeeze slugs into 64 values so collisions between videos happen
+        def make_slug(video_uri, attempt=0):
+            return real_make_slug(video_uri, attempt)[:1]
+
+    async def worker(n: int) -> None:
+        for _ in range(requests // workers):
+            uri = rng.choice(uris)
+            if n % 2:
+                # half the workers behave like separate processes, with
+                # nothing cached and no shared single-flight
+                reset_process_caches()
+                url = await shortener._upsert_short_url(uri)
+            else:
+                url = await shortener.create_short_url(uri)
+            results.setdefault(uri, set()).add(url)
+
+    with mock.patch.object(
+        shortener.Shortener, "get_motor_collection", return_value=collection
+    ), mock.patch.object(shortener, "make_slug", make_slug):
+        reset_process_caches()
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(worker(n) for n in range(workers)))
+        except ValueError as e:
+            print(f"  gave up: {e}")
+        elapsed = time.perf_counter() - start
+
+    slugs = [doc["slug"] for doc in collection.docs]
+    assert all(len(urls) == 1 for urls in results.values()), "video got two urls"
+    assert len(slugs) == len(set(slugs)), "slug shared by two videos"
+    assert len(collection.docs) == len({doc["video_uri"] for doc in collection.docs})
+
+    calls = sum(collection.calls.values())
+    print(
+        f"  {requests:,} requests over {len(results):,} videos: "
+        f"{requests / elapsed:,.0f} req/s, "
+        f"{calls / requests:.2f} round trips/request"
+    )
+
+
+async def main() -> None:
+    print("hot set, 1ms database:")
+    await stress(50, 20_000, workers=200, latency=0.001, tiny_slugs=False)
+    print("mostly new videos, 1ms database:")
+    await stress(20_000, 20_000, workers=200, latency=0.001, tiny_slugs=False)
+    print("forced slug collisions:")
+    await stress(20, 2_000, workers=50, latency=0.001, tiny_slugs=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,85 +1,309 @@
-import re
-from typing import Optional
+import startup  # first, the startup timeline starts when it is imported
+
+import asyncio
+import os
+import signal
+from datetime import datetime, timedelta
+from time import monotonic, time
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple
 
 import aiohttp
 import dis_snek as dis
-from dis_snek.ext.paginators import Paginator
-from dotenv import get_key
+from dotenv import dotenv_values
 
 from models import *
-from tiktok import get_tiktok
+from tiktok import (
+    SCHEMA_VERSION,
+    STATISTICS_MAX_AGE,
+    TIKTOK_TTL,
+    TikTokData,
+    aweme_health,
+    aweme_load,
+    get_tiktok,
+    preload_tiktoks,
+    tiktok_cache_info,
+    update_cached_tiktok,
+    use_tiktok_store,
+)
+from scanner import check_for_link, scan_links
+from shortener import create_short_url
+from session import open_session, get_session, close_session
+from cache import MembershipIndex, SingleFlight, TTLCache
+from usage import UsageWriter, delete_usage, top_videos
+from store import TikTokStore
+from prefetch import Prefetcher, TrafficCounter
+from render import HELP_EMBEDS, conversion_components, info_payload
+from latency import LatencyHistogram
+from limiter import PrioritySemaphore
+from interactions import INTERACTIVE, PASSIVE, InteractionScheduler
+import coherence
+import metrics
 
 import motor
-from beanie import init_beanie
 
-from database import Config, UsageData, Shortener, OptedOut
+from database import (
+    Config,
+    UsageData,
+    OptedOut,
+    ResolvedLink,
+    create_indexes,
+    create_unique_indexes,
+    init_database,
+)
+from rollup import guild_usage, total_usage
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# read once, every get_key call would parse the file again
+_env = dotenv_values(".env")
+
+_guild_configs: Dict[int, Config] = {}
+_guild_config_inflight = SingleFlight()
+_opted_out = MembershipIndex()
+_short_links = TTLCache(maxsize=16_384, ttl=24 * 60 * 60)
+_short_link_inflight = SingleFlight()
+UNRESOLVED_LINK_TTL = 60
+_music_data = TTLCache(maxsize=8192, ttl=60 * 60)
+_music_data_inflight = SingleFlight()
+MISSING_MUSIC_TTL = 5 * 60
+MAX_LINKS = 10
+_link_semaphore = PrioritySemaphore(int(_env.get("LINK_CONCURRENCY") or 32))
+# auto defers interactions that might not be answered within Discord's 3
+# seconds, always and never are how the context menu and /tiktok used to be
+_interactions = InteractionScheduler(
+    mode=(_env.get("INTERACTION_DEFER") or "auto").lower()
+)
+_message_latency = {
+    stage: LatencyHistogram() for stage in ("config", "convert", "respond", "total")
+}
+# usage data is kept forever unless USAGE_RETENTION_DAYS is set
+_retention_days = _env.get("USAGE_RETENTION_DAYS")
+USAGE_RETENTION = timedelta(days=int(_retention_days)) if _retention_days else None
+_usage_writer = UsageWriter(
+    max_queue=int(_env.get("USAGE_QUEUE_SIZE") or 10_000),
+    batch_size=int(_env.get("USAGE_BATCH_SIZE") or 500),
+    flush_interval=float(_env.get("USAGE_FLUSH_INTERVAL") or 5),
+    opted_out=lambda user_id: get_opted_out(user_id),
+)
+# what the Info and Audio buttons show is warmed after a conversion, in guilds
+# that converted this many links in the last 10 minutes unless set per guild
+PREFETCH_MIN_CONVERSIONS = float(_env.get("PREFETCH_MIN_CONVERSIONS") or 20)
+_guild_traffic = TrafficCounter(window=10 * 60)
+_prefetcher = Prefetcher(
+    busy=lambda: _link_semaphore.locked() or aweme_load() >= 0.5,
+    max_queue=int(_env.get("PREFETCH_QUEUE_SIZE") or 1000),
+    concurrency=int(_env.get("PREFETCH_CONCURRENCY") or 8),
+)
+# fetched TikToks are also kept in MongoDB, so a restart reads them back
+_tiktok_store = (
+    TikTokStore(version=SCHEMA_VERSION, ttl=TIKTOK_TTL)
+    if (_env.get("TIKTOK_STORE") or "on").lower() != "off"
+    else None
+)
+# startup caches this many of the videos converted the most in the last day
+TIKTOK_PRELOAD = int(_env.get("TIKTOK_PRELOAD") or 0)
+PRELOAD_WINDOW = 24 * 60 * 60
+
+# set by supervisor.py for each shard process, one process runs unsharded
+SHARD_ID = int(os.environ.get("TIKTOKER_SHARD_ID") or 0)
+TOTAL_SHARDS = int(os.environ.get("TIKTOKER_TOTAL_SHARDS") or 1)
 
-from base64 import urlsafe_b64encode
-from os import urandom
+# startup builds every index, background builds missing unique ones at
+# startup and has the first shard build the rest once it is handling events,
+# never leaves them to whoever deploys
+CREATE_INDEXES = (_env.get("CREATE_INDEXES") or "background").lower()
+COMMANDS_HASH_FILE = _env.get("COMMANDS_HASH_FILE") or ".commands_hash"
+_background_tasks = set()
 
 bot = dis.Snake(
     intents=dis.Intents.MESSAGES | dis.Intents.DEFAULT,
-    sync_interactions=True,
+    shard_id=SHARD_ID,
+    total_shards=TOTAL_SHARDS,
+    sync_interactions=False,  # synced after startup, and only when they changed
     delete_unused_application_cmds=False,
 )
 
 
+async def prepare(database=None) -> None:
+    """
+    Connects the database and fills the caches. It runs before the gateway
+    connects, so the first events are handled instead of failing.
+
+    args:
+        database: The motor database, the one at MONGODB_URL by default.
+    """
+    if database is None:
+        client = motor.motor_asyncio.AsyncIOMotorClient(_env.get("MONGODB_URL"))
+        database = client.tiktoker
+    await init_database(database, create_indexes=CREATE_INDEXES == "startup")
+    if CREATE_INDEXES == "background":
+        # duplicates upserted before the unique indexes exist would stay
+        if built := await create_unique_indexes():
+            print(f"Built the unique indexes {', '.join(built)}")
+    startup.mark("database")
+    use_tiktok_store(_tiktok_store)
+    # subscribed before loading, so nothing changed in between is missed
+    await coherence.open_channel(os.environ.get("TIKTOKER_RELAY"))
+    register_invalidation()
+    await asyncio.gather(
+        load_guild_configs(),
+        load_opted_out(),
+        open_session(
+            limit=int(_env.get("HTTP_LIMIT") or 100),
+            limit_per_host=int(_env.get("HTTP_LIMIT_PER_HOST") or 30),
+            dns_ttl=int(_env.get("HTTP_DNS_TTL") or 300),
+            keepalive_timeout=float(_env.get("HTTP_KEEPALIVE_TIMEOUT") or 30),
+            timeout=float(_env.get("HTTP_TIMEOUT") or 5),
+        ),
+        preload_popular_tiktoks(TIKTOK_PRELOAD),
+    )
+    startup.mark("caches")
+    _usage_writer.start()
+    if _tiktok_store is not None:
+        _tiktok_store.start()
+    _prefetcher.start()
+    register_gauges()
+    if metrics_port := _env.get("METRICS_PORT"):
+        await metrics.start_server(
+            _env.get("METRICS_HOST") or "127.0.0.1",
+            int(metrics_port) + SHARD_ID,
+        )
+
+
 @dis.listen(dis.events.Startup)
 async def on_startup():
-    client = motor.motor_asyncio.AsyncIOMotorClient(get_key(".env", "MONGODB_URL"))
-    await init_beanie(
-        database=client.tiktoker,
-        document_models=[Config, UsageData, Shortener, OptedOut],
+    startup.mark("ready")
+    print(f"Ready: {startup.report()}")
+    if SHARD_ID != 0:
+        return
+    # the slow housekeeping waits until events are being handled
+    if CREATE_INDEXES == "background":
+        _run_in_background("indexes", create_indexes())
+    _run_in_background("commands", sync_commands())
+
+
+async def sync_commands() -> None:
+    """
+    Syncs the application commands when they changed, then has the other
+    shards fetch their ids again: they cached them when they became ready,
+    and wouldn't dispatch a command added or renamed since.
+    """
+    if await startup.sync_commands(bot, COMMANDS_HASH_FILE) is not None:
+        coherence.get_channel().publish("commands", None)
+
+
+async def cache_commands() -> None:
+    """
+    Fetches the ids of the application commands, as synced by the first shard.
+    """
+    if bot.is_ready:  # otherwise becoming ready fetches them
+        await bot._cache_interactions(warn_missing=False)
+
+
+def _run_in_background(phase: str, work: Awaitable[Any]) -> None:
+    async def run() -> None:
+        try:
+            await work
+        except Exception as e:
+            print(f"Error: {phase} failed: {e!r}")
+        else:
+            startup.mark(phase)
+
+    task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def on_shutdown():
+    await metrics.stop_server()
+    await _usage_writer.stop()
+    if _tiktok_store is not None:
+        await _tiktok_store.stop()
+    await _prefetcher.stop()
+    await coherence.close_channel()
+    await close_session()
+
+
+def register_invalidation() -> None:
+    """
+    Keeps the caches of this process in step with the other shard processes.
+    """
+    channel = coherence.get_channel()
+    channel.subscribe("config", lambda guild_id, _: _guild_configs.pop(guild_id, None))
+    channel.subscribe(
+        "opted_out",
+        lambda user_id, opted_out: (
+            _opted_out.add(user_id) if opted_out else _opted_out.discard(user_id)
+        ),
     )
+    channel.subscribe("tiktok", update_cached_tiktok)
+    channel.subscribe("commands", lambda *_: cache_commands())
+    channel.subscribe(coherence.RESYNC, lambda *_: resync_caches())
+
+
+def register_gauges() -> None:
+    """
+    Exposes the state of the caches, queues and the TikTok API as gauges.
+    """
+    metrics.register_gauge("tiktoker_aweme_limit", lambda: aweme_health()["limit"])
+    metrics.register_gauge(
+        "tiktoker_aweme_in_flight", lambda: aweme_health()["in_flight"]
+    )
+    metrics.register_gauge("tiktoker_aweme_healthy", lambda: aweme_health()["healthy"])
+    metrics.register_gauge(
+        "tiktoker_tiktok_cache_size", lambda: tiktok_cache_info()["tiktok"]["size"]
+    )
+    metrics.register_gauge("tiktoker_short_link_cache_size", lambda: len(_short_links))
+    metrics.register_gauge("tiktoker_music_cache_size", lambda: len(_music_data))
+    metrics.register_gauge("tiktoker_guild_configs", lambda: len(_guild_configs))
+    metrics.register_gauge("tiktoker_opted_out_users", lambda: len(_opted_out))
+    metrics.register_gauge("tiktoker_usage_written", lambda: _usage_writer.written)
+    metrics.register_gauge("tiktoker_usage_dropped", lambda: _usage_writer.dropped)
+    metrics.register_gauge("tiktoker_usage_queued", lambda: _usage_writer.queued)
+    metrics.register_gauge("tiktoker_prefetch_queued", lambda: _prefetcher.queued)
+
+    def interaction_success_rate() -> float:
+        # None until an interaction is answered, 0.0 is every answer failing
+        rate = _interactions.info()["success_rate"]
+        return rate if rate is not None else float("nan")
+
+    metrics.register_gauge(
+        "tiktoker_interaction_success_rate", interaction_success_rate
+    )
+    if _tiktok_store is not None:
+        metrics.register_gauge(
+            "tiktoker_tiktok_store_pending", lambda: _tiktok_store.pending
+        )
+        metrics.register_gauge(
+            "tiktoker_tiktok_store_written", lambda: _tiktok_store.written
+        )
+    metrics.register_gauge(
+        "tiktoker_invalidations_published", lambda: coherence.get_channel().published
+    )
+    metrics.register_gauge(
+        "tiktoker_invalidations_received", lambda: coherence.get_channel().received
+    )
+    for phase in (
+        "imports",
+        "database",
+        "caches",
+        "login",
+        "ready",
+        "first_message",
+        "indexes",
+        "commands",
+    ):
+        metrics.register_gauge(
+            f"tiktoker_startup_{phase}_seconds",
+            lambda phase=phase: startup.timeline().get(phase, float("nan")),
+        )
 
 
 @dis.slash_command("help", "All the help you need")
 async def help(ctx: dis.InteractionContext):
-    embeds = [
-        dis.Embed(
-            title="Tiktoker",
-            description="Tiktoker is a bot that allows you to send Tiktok videos to your discord server.",
-            color="#00FFF0",
-            fields=[
-                dis.EmbedField(
-                    "Help Menu",
-                    "Bellow is some buttons that will guide you through some features of the bot.",
-                ).to_dict(),
-            ],
-        ),
-        dis.Embed(
-            "Configuration",
-            "Here are some configuration options for the bot.\nThese can be changed by using the `/config <option> <vaulue>` command.\nExample: `/config delete_origin:True`\nTo view the current configuration, use `/config` without any arguments.",
-            color="#00FFF0",
-            fields=[
-                dis.EmbedField(
-                    "Auto Embed",
-                    "When enabled, the bot will automatically embed the Tiktok link that is sent.",
-                ).to_dict(),
-                dis.EmbedField(
-                    "Delete Origin",
-                    "When enabled and _Auto Embed_ is enabled, the bot will delete the message that sent the Tiktok link.",
-                ).to_dict(),
-                dis.EmbedField(
-                    "Suppress Origin Embed",
-                    "Toggles the suppress origin embed feature.",
-                ).to_dict(),
-            ],
-        ),
-        dis.Embed(
-            "Commands",
-            "Here are some commands that can be used to interact with the bot.",
-            color="#00FFF0",
-            fields=[
-                dis.EmbedField(
-                    "Convert 📸",
-                    "Right click a message then go to *`Apps > Convert 📸`*. \nMeant for when *Auto Embed* is disabled in the server's config.",
-                ).to_dict(),
-            ],
-        ),
-    ]
+    from dis_snek.ext.paginators import Paginator  # only ever needed here
 
-    paginator = Paginator.create_from_embeds(bot, *embeds, timeout=20)
+    paginator = Paginator.create_from_embeds(bot, *HELP_EMBEDS, timeout=20)
     paginator.default_button_color = dis.ButtonStyles.GRAY
     paginator.first_button_emoji = "<:first_arrow:948778200224370768>"
     paginator.last_button_emoji = "<:last_arrow:948778201264582806>"
@@ -115,6 +339,7 @@ async def privacy_policy(ctx: dis.InteractionContext):
         dis.SlashCommandChoice("yes", "yes"),
         dis.SlashCommandChoice("no", "no"),
         dis.SlashCommandChoice("delete", "delete"),
+        dis.SlashCommandChoice("delete everywhere", "delete_all"),
     ],
 )
 async def privacy_options(ctx: dis.InteractionContext, collect: str = None):
@@ -139,8 +364,65 @@ async def privacy_options(ctx: dis.InteractionContext, collect: str = None):
         await add_opted_out(ctx.author.id)
 
     elif collect == "delete":
-        await ctx.send("Your usage data for this server has been deleted.")
         await remove_usage_data(ctx.guild.id, ctx.author.id)
+        await ctx.send("Your usage data for this server has been deleted.")
+
+    elif collect == "delete_all":
+        await remove_all_usage_data(ctx.author.id)
+        await ctx.send("Your usage data for every server has been deleted.")
+
+
+@dis.slash_command(
+    name="stats",
+    description="Statistics about the bot.",
+    sub_cmd_name="bot",
+    sub_cmd_description="How fast the bot is and how often its caches hit. (Owner only)",
+)
+async def stats_bot(ctx: dis.InteractionContext):
+    if not await dis.is_owner()(ctx):
+        await ctx.send("Only the bot owner can use this command.", ephemeral=True)
+        return
+
+    embed = dis.Embed("Bot Stats", "Since the last restart.")
+    for name, entry in sorted(metrics.summary().items()):
+        outcomes = sorted(entry["outcomes"].items())
+        lines = [f"{outcome}: {count}" for outcome, count in outcomes]
+        if entry.get("p50") is not None:
+            lines.append(f"p50: {entry['p50'] * 1000:g}ms")
+            lines.append(f"p99: {entry['p99'] * 1000:g}ms")
+        embed.add_field(name, "\n".join(lines), inline=True)
+    await ctx.send(embed=embed, ephemeral=True)
+
+
+@dis.slash_command(
+    name="stats",
+    description="Statistics about the bot.",
+    sub_cmd_name="usage",
+    sub_cmd_description="How much the bot is used, here and everywhere.",
+)
+async def stats_usage(ctx: dis.InteractionContext):
+    await ctx.defer()
+    here, everywhere = await asyncio.gather(guild_usage(ctx.guild.id), total_usage())
+
+    embed = dis.Embed(
+        "Usage Stats", "Users are estimated, opted out users aren't counted."
+    )
+    embed.add_field("Videos Converted (30 days)", here["conversions"], inline=True)
+    embed.add_field("Users (30 days)", f"~{here['users']}", inline=True)
+    if here["top_videos"]:
+        embed.add_field(
+            "Top Videos (30 days)",
+            "\n".join(
+                f"[{video_id}](https://www.tiktok.com/@/video/{video_id}): {count}"
+                for video_id, count in here["top_videos"]
+            ),
+            inline=False,
+        )
+    embed.add_field(
+        "Videos Converted (all servers)", everywhere["conversions"], inline=True
+    )
+    embed.add_field("Users (all servers)", f"~{everywhere['users']}", inline=True)
+    await ctx.send(embed=embed)
 
 
 @dis.slash_command(
@@ -160,11 +442,30 @@ async def privacy_options(ctx: dis.InteractionContext, collect: str = None):
     "Toggles suppression of the origin message embed.",
     dis.OptionTypes.BOOLEAN,
 )
+@dis.slash_option(
+    "max_links",
+    "How many links in one message are converted.",
+    dis.OptionTypes.INTEGER,
+    min_value=1,
+    max_value=MAX_LINKS,
+)
+@dis.slash_option(
+    "prefetch",
+    "Loads Info and Audio before they are clicked.",
+    dis.OptionTypes.STRING,
+    choices=[
+        dis.SlashCommandChoice("on", "on"),
+        dis.SlashCommandChoice("off", "off"),
+        dis.SlashCommandChoice("auto (when busy)", "auto"),
+    ],
+)
 async def setup_config(
     ctx: dis.InteractionContext,
     auto_embed: bool = None,
     delete_origin: bool = None,
     suppress_origin_embed: bool = None,
+    max_links: int = None,
+    prefetch: str = None,
 ):
     """
     Sets up the config for the guild.
@@ -175,31 +476,20 @@ async def setup_config(
 
     guild_id = ctx.guild.id
     await ctx.defer()
-    config = await get_guild_config(guild_id)
-    if auto_embed is None and delete_origin is None and suppress_origin_embed is None:
-        embed = dis.Embed(
-            "Current Config", "To change a setting, use `/config <setting> <value>`"
-        )
-        embed.add_field("Auto Embed", "☑️" if config.auto_embed else "❌", inline=True)
-        embed.add_field(
-            "Delete Origin", "☑️" if config.delete_origin else "❌", inline=True
-        )
-        embed.add_field(
-            "Suppress Origin Embed",
-            "☑️" if config.suppress_origin_embed else "❌",
-            inline=True,
-        )
-        await ctx.send(embed=embed)
-        return
-
+    changes = {}
     if auto_embed is not None:
-        config.auto_embed = auto_embed
+        changes["auto_embed"] = auto_embed
     if delete_origin is not None:
-        config.delete_origin = delete_origin
+        changes["delete_origin"] = delete_origin
     if suppress_origin_embed is not None:
-        config.suppress_origin_embed = suppress_origin_embed
+        changes["suppress_origin_embed"] = suppress_origin_embed
+    if max_links is not None:
+        changes["max_links"] = max_links
+    if prefetch is not None:
+        changes["prefetch"] = {"on": True, "off": False}.get(prefetch)
 
-    await config.save()
+    # edit_guild_config doesn't write anything when there are no changes
+    config = await edit_guild_config(guild_id, **changes)
 
     embed = dis.Embed(
         "Current Config", "To change a setting, use `/config <setting> <value>`"
@@ -211,49 +501,50 @@ async def setup_config(
         "☑️" if config.suppress_origin_embed else "❌",
         inline=True,
     )
+    embed.add_field("Max Links", config.max_links, inline=True)
+    embed.add_field(
+        "Prefetch",
+        {True: "☑️", False: "❌"}.get(config.prefetch, "Auto"),
+        inline=True,
+    )
     await ctx.send(embed=embed)
 
 
 @dis.context_menu("Convert 📸", dis.CommandTypes.MESSAGE)
 async def menu_convert_video(ctx: dis.InteractionContext):
-    await ctx.defer()
-    link = check_for_link(ctx.target.content)
-    if not link:
-        await ctx.send("I don't see a link in that message.", ephemeral=True)
+    links = scan_links(ctx.target.content)
+    if not links:
+        await _interactions.send(
+            ctx, "I don't see a link in that message.", ephemeral=True
+        )
         return
-    config = await get_guild_config(ctx.guild.id)
 
-    if link.type == VideoIdType.SHORT:
-        video_id = await get_video_id(link.url)
-    else:
-        video_id = link.id
+    async def convert() -> Tuple[Config, List[Tuple[int, str]]]:
+        config = await get_guild_config(ctx.guild.id)
+        return config, await convert_links(links, config.max_links, INTERACTIVE)
 
-    try:
-        tiktok = await get_tiktok(video_id)
-    except Exception as e:
-        await ctx.send(f"Error: {e}", ephemeral=True)
+    config, converted = await _interactions.run(ctx, "menu", convert())
+    if not converted:
+        await _interactions.send(
+            ctx, "I couldn't convert the link in that message.", ephemeral=True
+        )
         return
 
-    short_url = await create_short_url(tiktok.video.video_uri)
-
-    more_info_btn = dis.Button(
-        dis.ButtonStyles.GRAY,
-        "Info",
-        "🌐",
-        custom_id=f"v_id{video_id}",
-    )
-    delete_msg_btn = dis.Button(
-        dis.ButtonStyles.RED,
-        emoji="🗑️",
-        custom_id=f"delete{ctx.author.id}",
+    sent_msg = await metrics.track(
+        "discord_send",
+        _interactions.send(
+            ctx,
+            "\n".join(short_url for _, short_url in converted)
+            + f" | [Origin]({ctx.target.jump_url})",
+            components=conversion_components(converted, ctx.author.id),
+        ),
     )
+    # after answering, the interaction is the one with a deadline
     if config.suppress_origin_embed:
         await ctx.target.suppress_embeds()
-    sent_msg = await ctx.send(
-        short_url + f" | [Origin]({ctx.target.jump_url})",
-        components=[more_info_btn, delete_msg_btn],
-    )
-    await insert_usage_data(ctx.guild.id, ctx.author.id, video_id, sent_msg.id)
+    for video_id, _ in converted:
+        insert_usage_data(ctx.guild.id, ctx.author.id, video_id, sent_msg.id)
+    prefetch_buttons(ctx.guild.id, [video_id for video_id, _ in converted])
 
 
 @dis.slash_command("tiktok", "Convert a tiktok link to a video.")
@@ -261,103 +552,273 @@ async def menu_convert_video(ctx: dis.InteractionContext):
 async def slash_tiktok(ctx: dis.InteractionContext, link: str):
     link = check_for_link(link)
     if not link:
-        await ctx.send("That doesn't seem to be a valid link.", ephemeral=True)
+        await _interactions.send(
+            ctx, "That doesn't seem to be a valid link.", ephemeral=True
+        )
         return
 
-    if link.type == VideoIdType.SHORT:
-        video_id = await get_video_id(link.url)
-    else:
-        video_id = link.id
-
     try:
-        tiktok = await get_tiktok(video_id)
+        converted = await _interactions.run(
+            ctx, "tiktok", convert_link(link, INTERACTIVE)
+        )
     except Exception as e:
-        await ctx.send(f"Error: {e}", ephemeral=True)
+        await _interactions.send(ctx, f"Error: {e}", ephemeral=True)
+        return
+    if converted is None:
+        await _interactions.send(ctx, "I couldn't resolve that link.", ephemeral=True)
         return
 
-    short_url = await create_short_url(tiktok.video.video_uri)
-    more_info_btn = dis.Button(
-        dis.ButtonStyles.GRAY,
-        "Info",
-        "🌐",
-        custom_id=f"v_id{video_id}",
-    )
-    delete_msg_btn = dis.Button(
-        dis.ButtonStyles.RED,
-        emoji="🗑️",
-        custom_id=f"delete{ctx.author.id}",
-    )
-    sent_msg = await ctx.send(
-        short_url,
-        components=[more_info_btn, delete_msg_btn],
+    video_id, short_url = converted
+    sent_msg = await metrics.track(
+        "discord_send",
+        _interactions.send(
+            ctx,
+            short_url,
+            components=conversion_components([converted], ctx.author.id),
+        ),
     )
-    await insert_usage_data(ctx.guild.id, ctx.author.id, video_id, sent_msg.id)
+    insert_usage_data(ctx.guild.id, ctx.author.id, video_id, sent_msg.id)
+    prefetch_buttons(ctx.guild.id, [video_id])
 
 
 @dis.listen(dis.events.MessageCreate)
 async def on_message_create(event: dis.events.MessageCreate):
-    if event.message.author.id == bot.user.id:
+    message = event.message
+    if message.author.id == bot.user.id:
         return
-    content = event.message.content
-    link = check_for_link(content)
-    if not link:
+    links = scan_links(message.content)
+    if not links:
         return
-
-    config = await get_guild_config(event.message.guild.id)
-
+    started = monotonic()
+
+    # the config is almost always in memory, when it isn't the TikToks are
+    # fetched while it loads; shortening writes to the database, so it waits
+    # until the guild is known to auto embed
+    config = _guild_configs.get(message.guild.id)
+    if config is None:
+        warm_tiktoks(links)
+        config = await _timed("config", get_guild_config(message.guild.id))
     if not config.auto_embed:
         return
 
-    if link.type == VideoIdType.SHORT:
-        video_id = await get_video_id(link.url)
-    else:
-        video_id = link.id
-
-    try:
-        tiktok = await get_tiktok(video_id)
-    except Exception as e:
-        print(f"Error: {e}")
+    converted = await _timed("convert", convert_links(links, config.max_links))
+    if not converted:
         return
 
-    short_url = await create_short_url(tiktok.video.video_uri)
+    content = "\n".join(short_url for _, short_url in converted)
+    components = conversion_components(converted, message.author.id)
+    sent_msg = await _timed("respond", _respond(message, config, content, components))
+
+    for video_id, _ in converted:
+        insert_usage_data(message.guild.id, message.author.id, video_id, sent_msg.id)
+    prefetch_buttons(message.guild.id, [video_id for video_id, _ in converted])
+    _message_latency["total"].record(monotonic() - started)
+    metrics.observe("message_total", "success", monotonic() - started)
+    if startup.mark("first_message"):
+        print(f"First message handled: {startup.report()}")
+
+
+async def _respond(
+    message: dis.Message,
+    config: "Config",
+    content: str,
+    components: List[Dict[str, Any]],
+) -> dis.Message:
+    """
+    Sends the converted links, then deletes the original message, or
+    suppresses its embeds while sending.
 
-    more_info_btn = dis.Button(
-        dis.ButtonStyles.GRAY,
-        "Info",
-        "🌐",
-        custom_id=f"v_id{video_id}",
-    )
-    delete_msg_btn = dis.Button(
-        dis.ButtonStyles.RED,
-        emoji="🗑️",
-        custom_id=f"delete{event.message.author.id}",
-    )
+    args:
+        message: The message with the links.
+        config: The guild config.
+        content: The short urls.
+        components: The buttons.
+
+    returns:
+        The sent message.
+    """
+    # the channel is cached from the gateway, it is only fetched when it isn't
+    channel = message.channel or await bot.fetch_channel(message._channel_id)
 
     if config.delete_origin:
-        sent_msg = await event.message.channel.send(
-            short_url + f" | From: {event.message.author.mention}",
-            components=[more_info_btn, delete_msg_btn],
-            allowed_mentions=dis.AllowedMentions.none(),
+        sent_msg = await metrics.track(
+            "discord_send",
+            channel.send(
+                content + f" | From: {message.author.mention}",
+                components=components,
+                allowed_mentions=dis.AllowedMentions.none(),
+            ),
         )
+        # only once the converted links are there to replace it
         try:
-            await event.message.delete()
+            await message.delete()
         except dis.errors.NotFound:
             pass
-    elif config.suppress_origin_embed:
-        await event.message.suppress_embeds()
-        await bot.fetch_channel(event.message._channel_id)
-        sent_msg = await event.message.reply(
-            short_url, components=[more_info_btn, delete_msg_btn]
-        )
-    else:
-        await bot.fetch_channel(event.message._channel_id)
-        sent_msg = await event.message.reply(
-            short_url, components=[more_info_btn, delete_msg_btn]
-        )
+        except Exception as e:
+            print(f"Error: {e}")
+        return sent_msg
 
-    await insert_usage_data(
-        event.message.guild.id, event.message.author.id, video_id, sent_msg.id
+    send = metrics.track(
+        "discord_send", channel.send(content, components=components, reply_to=message)
+    )
+    if not config.suppress_origin_embed:
+        return await send
+    sent_msg, result = await asyncio.gather(
+        send, message.suppress_embeds(), return_exceptions=True
     )
+    if isinstance(sent_msg, BaseException):
+        raise sent_msg
+    if isinstance(result, Exception) and not isinstance(result, dis.errors.NotFound):
+        print(f"Error: {result}")
+    return sent_msg
+
+
+async def _timed(stage: str, awaitable: Awaitable[Any]) -> Any:
+    """
+    Awaits a stage of handling a message, recording how long it took.
+
+    args:
+        stage: The name of the stage.
+        awaitable: The work of the stage.
+
+    returns:
+        The result of the stage.
+    """
+    started = monotonic()
+    outcome = "success"
+    try:
+        return await awaitable
+    except BaseException as e:
+        outcome = metrics.outcome_of(e)
+        raise
+    finally:
+        latency = monotonic() - started
+        _message_latency[stage].record(latency)
+        metrics.observe(f"message_{stage}", outcome, latency)
+
+
+def message_latency() -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Gets the recent latencies of each stage of handling a message.
+
+    returns:
+        The samples, p50 and p99 of each stage, in seconds.
+    """
+    return {
+        stage: {
+            "samples": len(histogram),
+            "p50": histogram.percentile(0.5),
+            "p99": histogram.percentile(0.99),
+        }
+        for stage, histogram in _message_latency.items()
+    }
+
+
+async def convert_link(
+    link: "LinkData", priority: int = PASSIVE
+) -> Optional[Tuple[int, str]]:
+    """
+    Resolves a link, fetches the TikTok and shortens its video url.
+
+    args:
+        link: The link to convert.
+        priority: INTERACTIVE when someone is waiting on an interaction,
+            those are converted before auto embeds.
+
+    returns:
+        The video id and short url, or None if the link doesn't resolve.
+    """
+    async with _link_semaphore.slot(priority):
+        video_id = await get_video_id(link)
+        if video_id is None:
+            return None
+        tiktok = await get_tiktok(video_id)
+        return video_id, await create_short_url(tiktok.video.video_uri)
+
+
+async def convert_links(
+    links: List["LinkData"], max_links: int, priority: int = PASSIVE
+) -> List[Tuple[int, str]]:
+    """
+    Converts the links of a message concurrently.
+
+    args:
+        links: The links in the message.
+        max_links: How many distinct links to convert.
+        priority: Passed on to `convert_link`.
+
+    returns:
+        The video id and short url of each link that converted, in order.
+    """
+    distinct = list({(link.type, link.id): link for link in links}.values())
+    results = await asyncio.gather(
+        *(convert_link(link, priority) for link in distinct[:max_links]),
+        return_exceptions=True,
+    )
+    converted = []
+    seen = set()
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Error: {result}")
+            continue
+        # a short link and a long link can point at the same video
+        if result is None or result[0] in seen:
+            continue
+        seen.add(result[0])
+        converted.append(result)
+    return converted
+
+
+def warm_tiktoks(links: List["LinkData"]) -> None:
+    """
+    Starts fetching the TikToks of links without converting them, for the
+    links whose video id is known without resolving a short link.
+
+    args:
+        links: The links in a message.
+    """
+    for link in links[:MAX_LINKS]:
+        if link.type != VideoIdType.SHORT:
+            video_id = int(link.id)
+        elif (video_id := _short_links.get(link.id)) is None:
+            continue
+        task = asyncio.ensure_future(get_tiktok(video_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_warmed)
+
+
+def _warmed(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled():
+        task.exception()  # converting the link reports it, if it still fails
+
+
+def prefetch_buttons(guild_id: int, video_ids: Sequence[int]) -> None:
+    """
+    Queues warming what the Info and Audio buttons of converted videos show,
+    when the guild prefetches.
+
+    args:
+        guild_id: The guild id.
+        video_ids: The converted videos.
+    """
+    traffic = _guild_traffic.add(guild_id, len(video_ids))
+    config = _guild_configs.get(guild_id)
+    if config is not None and config.prefetch is not None:
+        enabled = config.prefetch
+    else:
+        enabled = traffic >= PREFETCH_MIN_CONVERSIONS
+    if enabled:
+        for video_id in video_ids:
+            _prefetcher.put(video_id, _prefetch_buttons, video_id)
+
+
+async def _prefetch_buttons(video_id: int) -> None:
+    # the TikTok was just fetched to convert it, old statistics are refreshed
+    # and the music page, the slow part of Audio, is scraped
+    tiktok = await get_tiktok(video_id, revalidate_after=STATISTICS_MAX_AGE)
+    if tiktok.music.id not in _music_data:
+        await get_music_data(tiktok.music.id)
 
 
 @dis.listen(dis.events.Button)
@@ -375,252 +836,246 @@ async def on_button_click(event: dis.events.Button):
                 "You don't have the permissions to delete this message.", ephemeral=True
             )
     elif ctx.custom_id.startswith("v_id"):
-        await ctx.defer(ephemeral=True)
-        tiktok = await get_tiktok(int(ctx.custom_id[4:]))
+        await info_button(ctx)
+    elif ctx.custom_id.startswith("m_id"):
+        await audio_button(ctx)
+
+
+@metrics.timed("button_info")
+async def info_button(ctx: dis.ComponentContext) -> None:
+    # answer with the statistics we have, newer ones show up on the next click
+    tiktok = await _interactions.run(
+        ctx,
+        "info",
+        get_tiktok(int(ctx.custom_id[4:]), revalidate_after=STATISTICS_MAX_AGE),
+        ephemeral=True,
+    )
 
-        video = tiktok.video
-        author = tiktok.author
-        stats = tiktok.statistics
+    await metrics.track(
+        "discord_send",
+        _interactions.send(ctx, ephemeral=True, **info_payload(tiktok)),
+    )
 
-        embed = dis.Embed(
-            tiktok.description.cleaned[:256]
-            if tiktok.description.cleaned != ""
-            else None,
-            description=tiktok.share_url,
-        )
 
-        embed.set_author(name=author.nickname, icon_url=author.avatar, url=author.url)
-        embed.set_thumbnail(url=video.cover_url)
-        embed.add_field("Views 👁️", stats.play_count, True)
-        embed.add_field("Likes ❤️", stats.like_count, True)
-        embed.add_field("Comments 💬", stats.comment_count, True)
-        embed.add_field("Shares 🔃", stats.share_count, True)
-        embed.add_field("Downloads 📥", stats.download_count, True)
-        embed.add_field("Created", tiktok.created, True)
-        download_btn = dis.Button(
-            dis.ButtonStyles.URL, "Download", url=video.download_url
-        )
-        if len(tiktok.description.tags) > 0:
-            embed.add_field(
-                "Tags 🔖",
-                ", ".join(
-                    [
-                        f"[`#{tag}`](https://www.tiktok.com/tag/{tag})"
-                        for tag in tiktok.description.tags
-                    ]
-                ),
-                True,
-            )
+@metrics.timed("button_audio")
+async def audio_button(ctx: dis.ComponentContext) -> None:
+    async def load() -> Tuple[TikTokData, Optional[dict]]:
+        # the aweme was fetched to build the buttons, so its music is cached
+        tiktok = await get_tiktok(int(ctx.custom_id[4:]))
+        music_id = tiktok.music.id
+        metrics.count("button_audio", "warm" if music_id in _music_data else "cold")
+        return tiktok, await get_music_data(music_id)
 
-        audio_btn = dis.Button(
-            dis.ButtonStyles.GRAY,
-            "Audio",
-            emoji="🎵",
-            custom_id=f"m_id{tiktok.id}",
+    try:
+        tiktok, music_data = await _interactions.run(
+            ctx, "audio", load(), ephemeral=True
         )
-
-        await ctx.send(embed=embed, components=[download_btn, audio_btn])
+    except Exception as e:
+        await _interactions.send(
+            ctx, "Seems this audio has been deleted/taken down.", ephemeral=True
+        )
+        print(f"Error: {e}")
         return
 
-    elif ctx.custom_id.startswith("m_id"):  # TODO: Use aweme instead of music
-        await ctx.defer(ephemeral=True)
-
-        try:
-            tiktok = await get_tiktok(int(ctx.custom_id[4:]))
-        except Exception as e:
-            await ctx.send("Seems this audio has been deleted/taken down.")
-            print(f"Error: {e}")
-            return
+    music = tiktok.music
+    embed = dis.Embed(
+        title=music.title,
+        url="https://www.tiktok.com/music/id-" + str(music.id),
+    )
 
-        music = tiktok.music
-        embed = dis.Embed(
-            title=music.title,
-            url="https://www.tiktok.com/music/id-" + str(music.id),
+    if music_data:
+        embed.add_field(
+            name="Video Count 📱", value=music_data["video_count"], inline=False
         )
 
-        if extra_music_data := await get_music_data(music.id):
-            video_count = extra_music_data["musicInfo"]["stats"]["videoCount"]
-            embed.add_field(name="Video Count 📱", value=video_count, inline=False)
-
-        embed.set_author(
-            name=music.owner_nickname, url=music.owner_url, icon_url=music.avatar_url
-        )
-        embed.set_thumbnail(url=music.cover_url)
+    embed.set_author(
+        name=music.owner_nickname, url=music.owner_url, icon_url=music.avatar_url
+    )
+    embed.set_thumbnail(url=music.cover_url)
 
-        await ctx.send(
+    await metrics.track(
+        "discord_send",
+        _interactions.send(
+            ctx,
             embed=embed,
             components=dis.Button(
                 dis.ButtonStyles.URL, url=music.play_url, label="Download"
             ),
-        )
+            ephemeral=True,
+        ),
+    )
 
 
-async def create_short_url(video_uri: str) -> str:
+@metrics.timed("get_video_id")
+async def get_video_id(link: "LinkData") -> Optional[int]:
     """
-    Shortens a url if not in cache.
+    Gets the video id of a link, resolving short links.
 
     args:
-        video_uri: The uri of the video.
+        link: The link to get the id from.
 
     returns:
-        The shortened url.
+        The video id, or None if a short link doesn't resolve.
     """
-
-    if existing_entry := await Shortener.find_one({"video_uri": video_uri}):
-        return existing_entry.shortened_url
-
-    slug = urlsafe_b64encode(urandom(6)).decode()
-    while len(await Shortener.find({"slug": slug}).to_list()) > 0:
-        print("Note: slug collision, regenerating")
-        slug = urlsafe_b64encode(urandom(6)).decode()
-
-    shortener = Shortener(
-        video_uri=video_uri,
-        slug=slug,
-        shortened_url=f"https://m.tiktoker.win/{slug}",
-    )
-    await shortener.insert()
-    return shortener.shortened_url
+    if link.type != VideoIdType.SHORT:
+        metrics.count("get_video_id", "direct")
+        return int(link.id)
+    video_id = _short_links.get(link.id, False)
+    if video_id is not False:  # None is a cached failure
+        metrics.count("get_video_id", "hit")
+        return video_id
+    metrics.count("get_video_id", "miss")
+    return await _short_link_inflight.do(link.id, _resolve_short_link, link)
+
+
+async def _resolve_short_link(link: "LinkData") -> Optional[int]:
+    if resolved := await ResolvedLink.find_one({"short_id": link.id}):
+        _short_links.set(link.id, resolved.video_id)
+        return resolved.video_id
+
+    video_id = None
+    try:
+        async with get_session().get(link.url, allow_redirects=False) as response:
+            if response.status in (301, 302, 303, 307, 308) and (
+                location := response.headers.get("Location")
+            ):
+                target = check_for_link(location)
+                if target and target.type != VideoIdType.SHORT:
+                    video_id = int(target.id)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error: unable to resolve {link.url}: {e!r}")
+        return None  # not cached, the failure may be ours
+
+    if video_id is None:
+        _short_links.set(link.id, None, ttl=UNRESOLVED_LINK_TTL)
+        return None
+
+    _short_links.set(link.id, video_id)
+    try:
+        await ResolvedLink(short_id=link.id, video_id=video_id).insert()
+    except DuplicateKeyError:
+        pass
+    return video_id
 
 
-async def get_video_id(url: str) -> int:
+@metrics.timed("get_music_data")
+async def get_music_data(music_id: int) -> Optional[dict]:
     """
-    Gets the video id from short url.
+    Gets the music details shown on the audio embed, cached by music id.
 
     args:
-        url: The url to get the id from.
+        music_id: The music id.
 
     returns:
-        The video id.
+        The music details, None if TikTok has none for it.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, allow_redirects=False) as response:
-            if location := response.headers.get("Location"):
-                if link := check_for_link(location):
-                    return link.id
+    music_data = _music_data.get(music_id, False)
+    if music_data is not False:
+        metrics.count("get_music_data", "hit")
+        return music_data
+    metrics.count("get_music_data", "miss")
+    return await _music_data_inflight.do(music_id, _fetch_music_data, music_id)
+
+
+async def _fetch_music_data(music_id: int) -> Optional[dict]:
+    async with get_session().get(
+        f"https://tiktok.com/api/music/detail/?language=en&musicId={music_id}",
+        headers={
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:97.0) Gecko/20100101 Firefox/97.0"
+        },
+    ) as response:
+        data = None
+        if response.status == 200:
+            try:
+                data = await response.json(content_type=None)
+            except ValueError:
+                pass
+
+    # keep only what is rendered, and remember missing music (status 10218 or an
+    # error page) for a little while
+    try:
+        video_count = data["musicInfo"]["stats"]["videoCount"]
+    except (KeyError, TypeError):
+        _music_data.set(music_id, None, ttl=MISSING_MUSIC_TTL)
+        return None
+
+    music_data = {"video_count": video_count}
+    _music_data.set(music_id, music_data)
+    return music_data
 
 
-async def get_music_data(music_id: int = None) -> Optional[dict]:
+@metrics.timed("get_guild_config")
+async def get_guild_config(guild_id: int) -> "Config":
     """
-    Gets the music data.
+    Gets the guild config, from memory once it has been loaded.
 
     args:
-        music_id: The music id.
+        guild_id: The guild id.
 
     returns:
-        The music data.
+        The guild config.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"https://tiktok.com/api/music/detail/?language=en&musicId={music_id}",
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:97.0) Gecko/20100101 Firefox/97.0"
-            },
-        ) as response:
-            if response.status == 200:
-                if data := await response.json():
-                    if data.get("statusCode") == 10218:
-                        return None
-                    return data
-                return data
-            else:
-                return None
+    if (config := _guild_configs.get(guild_id)) is not None:
+        metrics.count("get_guild_config", "hit")
+        return config
+    metrics.count("get_guild_config", "miss")
+    return await _guild_config_inflight.do(guild_id, _load_guild_config, guild_id)
 
 
-def check_for_link(content: str) -> Optional["LinkData"]:
-    """
-    Checks if the content has a TikTok video.
+async def _load_guild_config(guild_id: int) -> "Config":
+    if not (config := await Config.find_one({"guild_id": guild_id})):
+        config = Config(guild_id=guild_id)
+        await config.insert()
+    _guild_configs[guild_id] = config
+    return config
 
-    args:
-        content: The content to check.
 
-    returns:
-        LinkData
+async def load_guild_configs() -> None:
     """
-    try:
-        long_match = re.search(
-            r"(?P<http>http:|https:\/\/)?(www\.)?tiktok\.com\/(@.{1,24})\/video\/(?P<id>\d{15,30})",
-            content,
-        )
-        short_match = re.search(
-            r"(?P<http>http:|https:\/\/)?(\w{2})\.tiktok.com\/(?P<short_id>\w{5,15})",
-            content,
-        )
-        medium_match = re.search(
-            r"(?P<http>http:|https:\/\/)?m\.tiktok\.com\/v\/(?P<id>\d{15,30})", content
-        )
-    except TypeError as e:
-        print(f"{content} is not a string")
-        print(type(content))
-    if long_match:
-        if not long_match.group("http"):
-            return LinkData.from_list(
-                [
-                    VideoIdType.LONG,
-                    long_match.group("id"),
-                    f"https://{long_match.group(0)}",
-                ]
-            )
-        return LinkData.from_list(
-            [VideoIdType.LONG, long_match.group("id"), long_match.group(0)]
-        )
-    if short_match:
-        if not short_match.group("http"):
-            return LinkData.from_list(
-                [
-                    VideoIdType.SHORT,
-                    short_match.group("short_id"),
-                    f"https://{short_match.group(0)}",
-                ]
-            )
-        return LinkData.from_list(
-            [VideoIdType.SHORT, short_match.group("short_id"), short_match.group(0)]
-        )
-    if medium_match:
-        if not medium_match.group("http"):
-            return LinkData.from_list(
-                [
-                    VideoIdType.MEDIUM,
-                    medium_match.group("id"),
-                    f"https://{medium_match.group(0)}",
-                ]
-            )
-        return LinkData.from_list(
-            [VideoIdType.MEDIUM, medium_match.group("id"), medium_match.group(0)]
-        )
-    return None
+    Loads every guild config into memory.
+    """
+    async for config in Config.find_all():
+        _guild_configs[config.guild_id] = config
 
 
-async def get_guild_config(guild_id: int) -> "Config":
+async def edit_guild_config(guild_id: int, **kwargs) -> "Config":
     """
-    Gets the guild config.
+    Edits the guild config with a single write, then caches the config as
+    the write left it.
 
     args:
         guild_id: The guild id.
+        **kwargs: The settings to change.
 
     returns:
-        The guild config.
+        The updated guild config.
     """
-    if config := await Config.find_one({"guild_id": guild_id}):
-        return config
-    else:
-        new_config = Config(guild_id=guild_id)
-        await new_config.insert()
-        return new_config
-
-
-async def edit_guild_config(guild_id: int, **kwargs) -> "Config":
     config = await get_guild_config(guild_id)
-    for key, value in kwargs.items():
-        await config.update({key: value})
-    return await get_guild_config(guild_id)
+    if not kwargs:
+        return config
+    # what the database returns includes edits made meanwhile, copying the
+    # config read before the write would undo them
+    document = await Config.get_motor_collection().find_one_and_update(
+        {"guild_id": guild_id},
+        {"$set": kwargs},
+        return_document=ReturnDocument.AFTER,
+    )
+    config = (
+        Config.parse_obj(document)
+        if document is not None
+        else config.copy(update=kwargs)
+    )
+    _guild_configs[guild_id] = config
+    coherence.get_channel().publish("config", guild_id)
+    return config
 
 
-async def insert_usage_data(
+@metrics.timed("insert_usage_data")
+def insert_usage_data(
     guild_id: int, user_id: int, video_id: int, message_id: int
 ) -> None:
     """
-    Inserts usage data.
+    Queues usage data for the background writer.
 
     args:
         guild_id: The guild id.
@@ -629,33 +1084,150 @@ async def insert_usage_data(
         message_id: The message id with the video.
     """
 
-    if await get_opted_out(user_id):  # weirdos
+    if get_opted_out(user_id):  # weirdos
         user_id = None
         message_id = None
 
-    await UsageData(
-        guild_id=guild_id, user_id=user_id, video_id=video_id, message_id=message_id
-    ).insert()
+    queued = _usage_writer.put(
+        UsageData(
+            guild_id=guild_id,
+            user_id=user_id,
+            video_id=video_id,
+            message_id=message_id,
+            expires_at=datetime.utcnow() + USAGE_RETENTION if USAGE_RETENTION else None,
+        )
+    )
+    metrics.count("insert_usage_data", "queued" if queued else "dropped")
 
 
 async def add_opted_out(user_id: int) -> None:
-    await OptedOut({user_id: True}).insert()
+    if user_id in _opted_out:
+        return
+    _opted_out.add(user_id)  # stop collecting before the write lands
+    coherence.get_channel().publish("opted_out", user_id, True)
+    try:
+        await OptedOut(user_id=user_id).insert()
+    except DuplicateKeyError:
+        pass
 
 
 async def remove_opted_out(user_id: int) -> None:
-    await OptedOut.delete({user_id: True})
+    await OptedOut.find({"user_id": user_id}).delete()
+    _opted_out.discard(user_id)
+    coherence.get_channel().publish("opted_out", user_id, False)
 
 
-async def remove_usage_data(guild_id: int, user_id: int) -> None:
-    return  # TODO: remove usage data
-    data = UsageData.find_all({guild_id: guild_id, user_id: user_id})
+async def remove_usage_data(guild_id: int, user_id: int) -> int:
+    """
+    Deletes the usage data of a user in a guild.
 
+    args:
+        guild_id: The guild id.
+        user_id: The user id.
 
-async def get_opted_out(user_id: int) -> bool:
-    if opted_out := await OptedOut.find_one({"user_id": user_id}):
-        return True
-    else:
-        return False
+    returns:
+        How many records were deleted.
+    """
+    # queued records would otherwise be written after the delete
+    await _usage_writer.flush()
+    return await delete_usage({"guild_id": guild_id, "user_id": user_id})
 
 
-bot.start(get_key(".env", "TOKEN"))
+async def remove_all_usage_data(user_id: int) -> int:
+    """
+    Deletes the usage data of a user in every guild.
+
+    args:
+        user_id: The user id.
+
+    returns:
+        How many records were deleted.
+    """
+    await _usage_writer.flush()
+    return await delete_usage({"user_id": user_id})
+
+
+def get_opted_out(user_id: int) -> bool:
+    return user_id in _opted_out
+
+
+async def load_opted_out() -> None:
+    """
+    Loads every opted out user into memory.
+    """
+    async for opted_out in OptedOut.find_all():
+        _opted_out.add(opted_out.user_id)
+
+
+async def preload_popular_tiktoks(limit: int) -> None:
+    """
+    Caches the TikToks converted the most in the last day from the store,
+    so they aren't fetched again after a restart.
+
+    args:
+        limit: How many TikToks to preload, none when 0.
+    """
+    if not limit or _tiktok_store is None:
+        return
+    try:
+        video_ids = await top_videos(limit, int(time()) - PRELOAD_WINDOW)
+        preloaded = await preload_tiktoks(video_ids)
+    except Exception as e:
+        print(f"Error: unable to preload TikToks: {e!r}")
+        return
+    print(f"Preloaded {preloaded} of the {len(video_ids)} most converted TikToks")
+
+
+async def resync_caches() -> None:
+    """
+    Reloads the guild configs, opted out users and command ids, after
+    invalidations may have been missed.
+    """
+    configs = {config.guild_id: config async for config in Config.find_all()}
+    _guild_configs.clear()
+    _guild_configs.update(configs)
+    _opted_out.replace([opted_out.user_id async for opted_out in OptedOut.find_all()])
+    await cache_commands()
+
+
+async def main(database=None):
+    """
+    Runs the bot until the gateway closes or the process is interrupted,
+    then shuts down.
+
+    args:
+        database: Passed on to `prepare`.
+    """
+
+    async def login() -> None:
+        await bot.login(_env.get("TOKEN"))
+        startup.mark("login")
+
+    # ^C, and SIGTERM from the supervisor or a redeploy, cancel the bot
+    # rather than killing it, so shutdown still writes what is queued
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, asyncio.current_task().cancel)
+    try:
+        await asyncio.gather(prepare(database), login())
+        # what Snake.start does once logged in, the gateway only connects when
+        # everything the handlers need is ready
+        await bot._connection_state.start()
+    finally:
+        # stop fails on a gateway that never connected, it is MISSING
+        if bot._connection_state.gateway:
+            try:
+                await bot.stop()
+            except asyncio.CancelledError:
+                pass  # the gateway task was cancelled along with this one
+        await on_shutdown()
+
+
+startup.mark("imports")
+
+if __name__ == "__main__":
+    try:
+        # the Snake was made on this loop, its timeouts and waits run on it
+        bot.loop.run_until_complete(main())
+    except asyncio.CancelledError:
+        pass
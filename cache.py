@@ -0,0 +1,184 @@
+import asyncio
+import sys
+from collections import OrderedDict
+from time import monotonic
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Optional,
+    Set,
+    Tuple,
+)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A bounded mapping whose entries expire after a time to live.
+    When full the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Gets a value, counting a hit or a miss.
+
+        args:
+            key: The key to look up.
+            default: Returned when the key is missing or expired.
+
+        returns:
+            The cached value.
+        """
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires, value = entry
+        if expires < monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Sets a value, evicting the least recently used entry when full.
+
+        args:
+            key: The key to store under.
+            value: The value to store.
+            ttl: Overrides the cache's time to live for this entry.
+        """
+        self._data[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Gets a value without counting it or making it recently used.
+
+        args:
+            key: The key to look up.
+            default: Returned when the key is missing or expired.
+
+        returns:
+            The cached value.
+        """
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < monotonic():
+            return default
+        return entry[1]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        return entry[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def info(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key, _MISSING)
+        return entry is not _MISSING and entry[0] >= monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one in-flight call.
+    """
+
+    def __init__(self) -> None:
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(
+        self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """
+        Awaits `func(*args, **kwargs)`, or the call already running for `key`.
+
+        args:
+            key: The key identifying the call.
+            func: The coroutine function to call.
+
+        returns:
+            The result of the shared call.
+        """
+        if (future := self._calls.get(key)) is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        # a cancelled waiter must not cancel the call the others are waiting on
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            future.exception()  # retrieved, even if every waiter went away
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+
+class MembershipIndex:
+    """
+    An in-memory set of ids with O(1) membership checks.
+
+    Snowflakes are 32 byte ints and the set keeps a 16 byte slot per entry
+    at most 60% full, so a million ids cost about 62 MiB.
+    """
+
+    def __init__(self, ids: Iterable[int] = ()) -> None:
+        self._ids: Set[int] = set(ids)
+
+    def add(self, id: int) -> None:
+        self._ids.add(id)
+
+    def discard(self, id: int) -> None:
+        self._ids.discard(id)
+
+    def update(self, ids: Iterable[int]) -> None:
+        self._ids.update(ids)
+
+    def replace(self, ids: Iterable[int]) -> None:
+        self._ids = set(ids)
+
+    def memory_usage(self) -> int:
+        """
+        Gets the approximate memory used by the index.
+
+        returns:
+            The size in bytes.
+        """
+        return sys.getsizeof(self._ids) + sum(sys.getsizeof(id) for id in self._ids)
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
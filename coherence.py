@@ -0,0 +1,265 @@
+import asyncio
+import os
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import dumps, loads as json_loads
+
+    def json_dumps(value: Any) -> bytes:
+        return dumps(value, separators=(",", ":")).encode()
+
+
+# delivered locally after the channel reconnects, messages may have been missed
+RESYNC = "resync"
+RECONNECT_DELAY = 1
+
+Handler = Callable[[Hashable, Any], Any]
+
+
+class InvalidationChannel:
+    """
+    Tells the other bot processes which cached entries changed, and hands
+    what they publish to the handlers subscribed here.
+
+    On its own it has nobody to tell, which is what a single process needs.
+    """
+
+    def __init__(self) -> None:
+        self.published = 0
+        self.received = 0
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        """
+        Calls `handler(key, value)` for every message published on a topic
+        by another process.
+
+        args:
+            topic: The topic, usually the cache.
+            handler: The function to call, a coroutine function is scheduled.
+        """
+        self._handlers[topic].append(handler)
+
+    def publish(self, topic: str, key: Hashable, value: Any = None) -> None:
+        """
+        Tells the other processes, without waiting, that an entry changed.
+
+        args:
+            topic: The topic, usually the cache.
+            key: The entry that changed.
+            value: The new value, when receivers can use it instead of refetching.
+        """
+        self.published += 1
+        self._send(topic, key, value)
+
+    def _send(self, topic: str, key: Hashable, value: Any) -> None:
+        pass
+
+    def _deliver(self, topic: str, key: Hashable, value: Any) -> None:
+        self.received += 1
+        for handler in self._handlers.get(topic, ()):
+            try:
+                result = handler(key, value)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception as e:
+                print(f"Error: unable to handle {topic} {key}: {e!r}")
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class LocalHub:
+    """
+    Connects channels in one process, standing in for the relay in tests
+    and benchmarks.
+    """
+
+    def __init__(self) -> None:
+        self.channels: Set["LocalChannel"] = set()
+
+    def channel(self) -> "LocalChannel":
+        return LocalChannel(self)
+
+
+class LocalChannel(InvalidationChannel):
+    def __init__(self, hub: LocalHub) -> None:
+        super().__init__()
+        self.hub = hub
+        hub.channels.add(self)
+
+    def _send(self, topic: str, key: Hashable, value: Any) -> None:
+        # delivered on a later loop iteration, like a message over the socket
+        loop = asyncio.get_running_loop()
+        for channel in self.hub.channels:
+            if channel is not self:
+                loop.call_soon(channel._deliver, topic, key, value)
+
+    async def stop(self) -> None:
+        self.hub.channels.discard(self)
+
+
+class SocketChannel(InvalidationChannel):
+    """
+    A channel to the relay on a Unix socket, one JSON message per line.
+    It reconnects when the relay goes away, and delivers RESYNC once it is
+    back since whatever was published in between is lost.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        self.dropped = 0
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+    def _send(self, topic: str, key: Hashable, value: Any) -> None:
+        if self._writer is None or self._writer.is_closing():
+            self.dropped += 1
+            return
+        self._writer.write(json_dumps([topic, key, value]) + b"\n")
+
+    async def start(self, timeout: float = 5) -> None:
+        """
+        Connects to the relay, waiting at most `timeout` seconds before
+        carrying on and connecting in the background.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Error: unable to reach the invalidation relay at {self.path}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self) -> None:
+        reconnecting = False
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(
+                    self.path, limit=2**22
+                )
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                reconnecting = True
+                continue
+            self._connected.set()
+            if reconnecting:
+                self._deliver(RESYNC, None, None)
+            try:
+                async for line in reader:
+                    topic, key, value = json_loads(line)
+                    self._deliver(topic, key, value)
+            except (OSError, ValueError) as e:
+                print(f"Error: invalidation relay connection lost: {e!r}")
+            finally:
+                self._writer.close()
+                self._writer = None
+                self._connected.clear()
+            reconnecting = True
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+class Relay:
+    """
+    Forwards every line one process sends to every other process connected
+    to the Unix socket. Run by the supervisor.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.forwarded = 0
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left over from a process that didn't stop
+        self._server = await asyncio.start_unix_server(
+            self._handle, self.path, limit=2**22
+        )
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in self._writers:
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            async for line in reader:
+                for other in self._writers:
+                    if other is not writer and not other.is_closing():
+                        other.write(line)
+                self.forwarded += 1
+        except (OSError, ValueError):
+            pass  # the process went away, it reconnects and resyncs
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+_channel: InvalidationChannel = InvalidationChannel()
+
+
+async def open_channel(
+    path: Optional[str] = None, channel: Optional[InvalidationChannel] = None
+) -> InvalidationChannel:
+    """
+    Opens the invalidation channel shared by the caches of this process.
+
+    args:
+        path: The relay's Unix socket, no path means this is the only process.
+        channel: A channel to use instead, such as one from a LocalHub.
+
+    returns:
+        The shared channel.
+    """
+    global _channel
+    if channel is None:
+        channel = SocketChannel(path) if path else InvalidationChannel()
+    _channel = channel
+    await _channel.start()
+    return _channel
+
+
+def get_channel() -> InvalidationChannel:
+    """
+    Gets the shared invalidation channel.
+
+    returns:
+        The shared channel, one that tells nobody until a channel is opened.
+    """
+    return _channel
+
+
+async def close_channel() -> None:
+    """
+    Closes the shared invalidation channel.
+    """
+    global _channel
+    channel, _channel = _channel, InvalidationChannel()
+    await channel.stop()
@@ -1,6 +1,11 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Type
 from beanie import Document, Indexed, init_beanie
+from beanie.odm.utils.init import Initializer
 import motor
 from datetime import datetime
+from pydantic import Field
+from pymongo import ASCENDING, IndexModel
 import dis_snek as dis
 
 
@@ -9,14 +14,31 @@ class Config(Document, dis.DictSerializationMixin):
     auto_embed: bool = True
     delete_origin: bool = False
     suppress_origin_embed: bool = True
+    max_links: int = 5
+    prefetch: Optional[bool] = None  # None prefetches when the guild is busy
 
 
 class UsageData(Document):
-    guild_id: Indexed(int)
-    user_id: Indexed(int)
+    guild_id: int  # indexed with user_id
+    user_id: Optional[Indexed(int)]  # None when opted out
     video_id: Indexed(int)
-    message_id: Indexed(int)
-    timestamp: Indexed(int) = datetime.now().timestamp()
+    message_id: Optional[Indexed(int)]
+    timestamp: Indexed(int) = Field(
+        default_factory=lambda: int(datetime.now().timestamp())
+    )
+    expires_at: Optional[datetime] = None  # removed by MongoDB after this, if set
+
+    class Settings:
+        indexes = [
+            # per guild queries and per user deletes in a guild
+            IndexModel(
+                [("guild_id", ASCENDING), ("user_id", ASCENDING)],
+                name="guild_id_1_user_id_1",
+            ),
+            IndexModel(
+                [("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0
+            ),
+        ]
 
 
 class Shortener(Document, dis.DictSerializationMixin):
@@ -27,3 +49,138 @@ class Shortener(Document, dis.DictSerializationMixin):
 
 class OptedOut(Document):
     user_id: Indexed(int, unique=True)
+
+
+class ResolvedLink(Document):
+    short_id: Indexed(str, unique=True)  # vm.tiktok.com/<short_id>
+    video_id: int
+
+
+class GuildUsage(Document):
+    """
+    Usage of one guild on one day, kept up to date by the usage writer.
+    """
+
+    guild_id: int
+    day: int  # days since the epoch, UTC
+    conversions: int = 0
+    videos: Dict[str, int] = {}  # video id -> conversions, the top ones only
+    users: Dict[str, int] = {}  # HyperLogLog registers, only the ones set
+
+    class Settings:
+        indexes = [
+            IndexModel([("guild_id", ASCENDING), ("day", ASCENDING)], unique=True)
+        ]
+
+
+class UsageTotals(Document):
+    """
+    Usage across every guild since the rollups started.
+    """
+
+    name: Indexed(str, unique=True)  # "global"
+    conversions: int = 0
+    users: Dict[str, int] = {}  # HyperLogLog registers, only the ones set
+
+
+class StoredTikTok(Document):
+    """
+    TikTok data kept across restarts, written by the TikTok store.
+    """
+
+    id: int  # the aweme id, so the collection can be sharded on _id
+    version: int  # the schema version of data, other versions are ignored
+    data: Dict[str, Any]  # the compact data TikTokData is built from
+    fetched_at: float
+    expires_at: datetime  # removed by MongoDB after this
+
+    class Settings:
+        indexes = [
+            IndexModel(
+                [("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0
+            ),
+        ]
+
+
+DOCUMENTS: List[Type[Document]] = [
+    Config,
+    UsageData,
+    Shortener,
+    OptedOut,
+    ResolvedLink,
+    GuildUsage,
+    UsageTotals,
+    StoredTikTok,
+]
+
+
+class _WithoutIndexes(Initializer):
+    """
+    Beanie's initializer, minus building the indexes.
+    """
+
+    @staticmethod
+    async def init_indexes(cls, allow_index_dropping: bool = False) -> None:
+        pass
+
+
+async def init_database(database, create_indexes: bool = True) -> None:
+    """
+    Initializes every document concurrently, instead of one after another.
+
+    args:
+        database: The motor database.
+        create_indexes: Whether to build the indexes now, otherwise they are
+            left to `create_indexes()`.
+    """
+    initializer = Initializer if create_indexes else _WithoutIndexes
+    # no document inherits from another, so each can be initialized on its own
+    await asyncio.gather(
+        *(
+            initializer(database=database, document_models=[document])
+            for document in DOCUMENTS
+        )
+    )
+
+
+async def create_indexes() -> None:
+    """
+    Builds the indexes of every document, leaving the ones that exist alone.
+    """
+    await asyncio.gather(
+        *(Initializer.init_indexes(document) for document in DOCUMENTS)
+    )
+
+
+def _index_models(document: Type[Document]) -> List[IndexModel]:
+    """The indexes of a document, found the way Beanie's initializer does."""
+    indexes = [
+        IndexModel([(field.alias, field.type_._indexed[0])], **field.type_._indexed[1])
+        for field in document.__fields__.values()
+        if getattr(field.type_, "_indexed", None)
+    ]
+    return indexes + list(document.get_settings().indexes or [])
+
+
+async def create_unique_indexes() -> List[str]:
+    """
+    Builds the unique indexes that don't exist yet. Upserts and inserts
+    rely on them, without them concurrent ones can insert duplicates, and
+    the duplicates then fail the build.
+
+    returns:
+        The names of the indexes that were built.
+    """
+
+    async def create(document: Type[Document]) -> List[str]:
+        collection = document.get_motor_collection()
+        existing = await collection.index_information()
+        missing = [
+            index
+            for index in _index_models(document)
+            if index.document.get("unique") and index.document["name"] not in existing
+        ]
+        return await collection.create_indexes(missing) if missing else []
+
+    built = await asyncio.gather(*(create(document) for document in DOCUMENTS))
+    return [name for names in built for name in names]
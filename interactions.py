@@ -0,0 +1,177 @@
+import asyncio
+from collections import Counter
+from time import monotonic, time
+from typing import Any, Awaitable, Dict, Optional, TypeVar
+
+from latency import LatencyHistogram
+import metrics
+
+T = TypeVar("T")
+
+DISCORD_EPOCH = 1_420_070_400  # seconds, snowflakes count from here
+# link conversion slots go to interactions first, auto embeds wait
+INTERACTIVE = 0
+PASSIVE = 1
+
+
+class InteractionScheduler:
+    """
+    Answers interactions before Discord's cutoff, deferring only when needed.
+
+    The work starts right away. The interaction is deferred up front when
+    the recent latency of that kind of work says it won't finish in time,
+    otherwise only if it is still running at the last moment a defer lands
+    before the cutoff. A defer costs a round trip, and is wasted when the
+    work finishes early enough to have answered directly.
+
+    `mode` "always" defers every interaction and "never" none, as the bot
+    used to for the context menu and /tiktok.
+    """
+
+    def __init__(
+        self,
+        mode: str = "auto",
+        cutoff: float = 3,
+        margin: float = 0.25,
+        quantile: float = 0.9,
+        response_latency: float = 0.3,
+    ) -> None:
+        self.mode = mode
+        self.cutoff = cutoff
+        self.margin = margin
+        self.quantile = quantile
+        self.response_latency = response_latency
+        """ Assumed for responses until some have been timed """
+        self.outcomes: Counter = Counter()
+        self._work: Dict[str, LatencyHistogram] = {}
+        self._responses = LatencyHistogram()
+
+    def deadline(self, ctx: Any) -> float:
+        """
+        Gets when Discord stops accepting the first response to an
+        interaction, by when its id says it was created.
+
+        args:
+            ctx: The interaction context.
+
+        returns:
+            The deadline, on the monotonic clock.
+        """
+        created = (int(ctx.interaction_id) >> 22) / 1000 + DISCORD_EPOCH
+        # a clock behind Discord's would make the interaction look newer
+        age = max(0.0, time() - created)
+        return monotonic() - age + self.cutoff
+
+    async def run(
+        self, ctx: Any, kind: str, work: Awaitable[T], ephemeral: bool = False
+    ) -> T:
+        """
+        Does the work of an interaction, deferring it when it might not
+        finish in time to answer directly.
+
+        args:
+            ctx: The interaction context.
+            kind: What the work is, each kind has its own latency estimate.
+            work: The work.
+            ephemeral: Whether a defer hides the answer.
+
+        returns:
+            The result of the work, answer it with `send`.
+        """
+        deadline = self.deadline(ctx)
+        started = monotonic()
+        # the last moment a defer still lands before the cutoff
+        defer_by = deadline - self.margin - self._response_estimate()
+        task = asyncio.ensure_future(work)
+        finished = []
+        task.add_done_callback(lambda _: finished.append(monotonic()))
+        deferred = False
+        try:
+            if self.mode != "never" and not await self._finishes_by(
+                task, kind, started, defer_by
+            ):
+                deferred = True
+                await self._respond(
+                    ctx.defer(ephemeral=ephemeral), deadline, "deferred"
+                )
+            return await task
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            if finished:
+                self._work.setdefault(kind, LatencyHistogram()).record(
+                    finished[0] - started
+                )
+                if deferred and finished[0] <= defer_by:
+                    self._count("wasted_defer")
+
+    async def _finishes_by(
+        self, task: asyncio.Future, kind: str, started: float, defer_by: float
+    ) -> bool:
+        if self.mode == "always":
+            return False
+        estimate = self._work_estimate(kind)
+        if estimate is not None and started + estimate > defer_by:
+            return False  # defer now rather than at the last moment
+        done, _ = await asyncio.wait({task}, timeout=max(0.0, defer_by - monotonic()))
+        return bool(done)
+
+    async def send(self, ctx: Any, *args: Any, **kwargs: Any) -> Any:
+        """
+        Answers an interaction, timing the answer when it is the first
+        response. The answer to a deferred interaction is as visible as the
+        defer was, whatever `ephemeral` says.
+
+        returns:
+            The sent message.
+        """
+        if ctx.deferred and not ctx.responded:
+            # the first answer after a defer edits it, and Discord rejects
+            # one asking for another visibility than the defer's
+            kwargs["ephemeral"] = ctx.ephemeral
+        if ctx.deferred or ctx.responded:
+            return await ctx.send(*args, **kwargs)
+        return await self._respond(
+            ctx.send(*args, **kwargs), self.deadline(ctx), "direct"
+        )
+
+    def info(self) -> Dict[str, Any]:
+        """
+        Gets how interactions were answered.
+
+        returns:
+            The count of each outcome, and the share answered in time.
+        """
+        in_time = self.outcomes["direct"] + self.outcomes["deferred"]
+        answered = in_time + self.outcomes["late"] + self.outcomes["failed"]
+        return {
+            **self.outcomes,
+            "success_rate": in_time / answered if answered else None,
+        }
+
+    async def _respond(
+        self, response: Awaitable[Any], deadline: float, outcome: str
+    ) -> Any:
+        started = monotonic()
+        try:
+            result = await response
+        except BaseException:
+            # an expired interaction (10062) fails like a late one
+            self._count("late" if monotonic() > deadline else "failed")
+            raise
+        now = monotonic()
+        self._responses.record(now - started)
+        self._count("late" if now > deadline else outcome)
+        return result
+
+    def _count(self, outcome: str) -> None:
+        self.outcomes[outcome] += 1
+        metrics.count("interaction", outcome)
+
+    def _response_estimate(self) -> float:
+        return self._responses.percentile(self.quantile) or self.response_latency
+
+    def _work_estimate(self, kind: str) -> Optional[float]:
+        histogram = self._work.get(kind)
+        return histogram.percentile(self.quantile) if histogram else None
@@ -0,0 +1,164 @@
+import asyncio
+import random
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional
+
+import attr
+from attr import define
+
+
+def _bucket_bounds(low: float, high: float, factor: float) -> List[float]:
+    bounds = [low]
+    while bounds[-1] < high:
+        bounds.append(bounds[-1] * factor)
+    return bounds
+
+
+class LatencyHistogram:
+    """
+    A histogram of the last `size` latencies, in log spaced buckets, so
+    percentiles are answered in O(buckets) without sorting.
+    """
+
+    BOUNDS = _bucket_bounds(0.001, 60, 1.2)
+
+    def __init__(self, size: int = 1024) -> None:
+        self._window: Deque[int] = deque(maxlen=size)
+        self._counts = [0] * (len(self.BOUNDS) + 1)
+
+    def record(self, latency: float) -> None:
+        """
+        Records a latency, forgetting the oldest once the window is full.
+
+        args:
+            latency: The latency in seconds.
+        """
+        if len(self._window) == self._window.maxlen:
+            self._counts[self._window[0]] -= 1
+        bucket = bisect_left(self.BOUNDS, latency)
+        self._window.append(bucket)
+        self._counts[bucket] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Gets the upper bound of the bucket holding the q-th percentile.
+
+        args:
+            q: The percentile, between 0 and 1.
+
+        returns:
+            The latency in seconds, or None without samples.
+        """
+        if not self._window:
+            return None
+        rank = q * len(self._window)
+        seen = 0
+        for bucket, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank and count:
+                return self.BOUNDS[min(bucket, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+    def __len__(self) -> int:
+        return len(self._window)
+
+
+@define
+class RequestPolicy:
+    """
+    How a request is timed out, retried and hedged.
+    """
+
+    retries: int = attr.ib(default=2)
+    """ Attempts after the first one, on timeouts and overloaded answers """
+    backoff: float = attr.ib(default=0.1)
+    """ Base delay before a retry, doubled for each retry and jittered """
+    hedge: bool = attr.ib(default=True)
+    """ Send a second request when the first takes longer than usual """
+    hedge_quantile: float = attr.ib(default=0.95)
+    timeout: float = attr.ib(default=5)
+    """ Used until there are `min_samples` latencies, and as the upper bound after """
+    timeout_quantile: float = attr.ib(default=0.99)
+    timeout_multiplier: float = attr.ib(default=2)
+    min_timeout: float = attr.ib(default=0.5)
+    min_samples: int = attr.ib(default=50)
+
+    def attempt_timeout(self, histogram: LatencyHistogram) -> float:
+        """
+        Gets the timeout of one attempt from the recent latencies.
+
+        args:
+            histogram: The recent latencies.
+
+        returns:
+            The timeout in seconds.
+        """
+        if len(histogram) < self.min_samples:
+            return self.timeout
+        slow = histogram.percentile(self.timeout_quantile)
+        return min(self.timeout, max(self.min_timeout, slow * self.timeout_multiplier))
+
+    def hedge_delay(self, histogram: LatencyHistogram) -> Optional[float]:
+        """
+        Gets how long to wait before hedging.
+
+        args:
+            histogram: The recent latencies.
+
+        returns:
+            The delay in seconds, or None to not hedge.
+        """
+        if not self.hedge or len(histogram) < self.min_samples:
+            return None
+        return histogram.percentile(self.hedge_quantile)
+
+    def retry_delay(self, retry: int) -> float:
+        """
+        Gets the jittered delay before a retry.
+
+        args:
+            retry: The number of the retry, from 0.
+
+        returns:
+            The delay in seconds.
+        """
+        return self.backoff * 2**retry * random.uniform(0.5, 1.5)
+
+
+async def hedged(
+    attempt: Callable[[], Awaitable[Any]], delay: Optional[float]
+) -> Any:
+    """
+    Runs an attempt, and a second one if the first isn't done after `delay`.
+    The first to succeed wins and the other is cancelled.
+
+    args:
+        attempt: Starts an attempt.
+        delay: How long to wait before the second attempt, None to not hedge.
+
+    returns:
+        The result of the winning attempt.
+    """
+    first = asyncio.ensure_future(attempt())
+    if delay is None:
+        return await first
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+        pending.add(asyncio.ensure_future(attempt()))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+from collections import deque
+from itertools import count
+from time import monotonic
+from typing import Deque, List, Optional, Tuple, Type
+
+
+class UpstreamError(ValueError):
+    """
+    Base class for an upstream API that is struggling.
+    """
+
+
+class UpstreamOverloaded(UpstreamError):
+    """
+    The upstream answered with a rate limit or a server error.
+    """
+
+
+class UpstreamUnavailable(UpstreamError):
+    """
+    The request was not sent, because the upstream is known to be unhealthy
+    or too many requests are already waiting on it.
+    """
+
+
+class AdaptiveLimiter:
+    """
+    Limits concurrent requests to an upstream, adjusting the limit with AIMD:
+    every fast success raises it by 1/limit, so by about one per round trip,
+    and a slow or overloaded response cuts it by `backoff`.
+    """
+
+    def __init__(
+        self,
+        initial_limit: float = 16,
+        min_limit: float = 1,
+        max_limit: float = 256,
+        latency_target: float = 1,
+        backoff: float = 0.5,
+        queue_timeout: float = 5,
+        overload_errors: Tuple[Type[BaseException], ...] = (
+            asyncio.TimeoutError,
+            UpstreamOverloaded,
+        ),
+    ) -> None:
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.overload_errors = overload_errors
+        self.in_flight = 0
+        self.rejected = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def slot(self) -> "_Slot":
+        """
+        Waits for a free slot, for use with `async with`.
+        Raises UpstreamUnavailable if none frees up within the queue timeout.
+        """
+        return _Slot(self)
+
+    async def _acquire(self) -> None:
+        if self.in_flight < max(1, int(self.limit)) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # the slot is handed over by _release_slot, in_flight already counts us
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()  # handed over just as we gave up
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise UpstreamUnavailable(
+                    "Too many requests waiting on the upstream"
+                ) from None
+            raise
+
+    def _release(
+        self, started: float, latency: float, exc: Optional[BaseException]
+    ) -> None:
+        if isinstance(exc, self.overload_errors) or latency > self.latency_target:
+            # requests sent before the last decrease saw the old limit, one
+            # burst of failures should only back off once
+            if started > self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = monotonic()
+        elif exc is None:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < max(1, int(self.limit)):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.in_flight += 1
+
+
+class _Slot:
+    __slots__ = ("limiter", "started")
+
+    def __init__(self, limiter: AdaptiveLimiter) -> None:
+        self.limiter = limiter
+        self.started = 0.0
+
+    async def __aenter__(self) -> "_Slot":
+        await self.limiter._acquire()
+        self.started = monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.limiter._release(self.started, monotonic() - self.started, exc)
+
+
+class PrioritySemaphore:
+    """
+    A semaphore that hands a freed slot to the waiter with the lowest
+    priority first, and to the one that waited longest within a priority.
+    """
+
+    def __init__(self, value: int) -> None:
+        self.value = value
+        self._free = value
+        self._order = count()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+
+    def locked(self) -> bool:
+        return self._free == 0
+
+    def slot(self, priority: int = 0) -> "_PrioritySlot":
+        """
+        Waits for a free slot, for use with `async with`.
+
+        args:
+            priority: Lower goes first.
+        """
+        return _PrioritySlot(self, priority)
+
+    async def _acquire(self, priority: int) -> None:
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        try:
+            # the slot is handed over by _release, _free already counts us
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release()  # handed over just as we gave up
+            else:
+                waiter.cancel()  # skipped by _release
+            raise
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+
+class _PrioritySlot:
+    __slots__ = ("semaphore", "priority")
+
+    def __init__(self, semaphore: PrioritySemaphore, priority: int) -> None:
+        self.semaphore = semaphore
+        self.priority = priority
+
+    async def __aenter__(self) -> "_PrioritySlot":
+        await self.semaphore._acquire(self.priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.semaphore._release()
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests after `failure_threshold` failures in a row.
+    After `reset_timeout` seconds one probe request is let through, and its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def healthy(self) -> bool:
+        return self.opened_at is None
+
+    def allow(self) -> bool:
+        """
+        Checks if a request may be sent, claiming the probe when half open.
+
+        returns:
+            Whether to send the request.
+        """
+        if self.opened_at is None:
+            return True
+        if self._probing or monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = monotonic()
+
+    def record_abandoned(self) -> None:
+        """A request that was allowed never got an answer, e.g. it was cancelled."""
+        self._probing = False
@@ -0,0 +1,314 @@
+import asyncio
+import functools
+from bisect import bisect_left
+from collections import defaultdict
+from time import perf_counter
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    DefaultDict,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+BOUNDS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+_counters: DefaultDict[Tuple[str, str], int] = defaultdict(int)
+_histograms: Dict[Tuple[str, str], "Histogram"] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+_runner: Optional["web.AppRunner"] = None
+
+
+class Histogram:
+    """
+    A cumulative latency histogram with fixed buckets, as Prometheus expects.
+    """
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Gets the upper bound of the bucket holding the q-th percentile.
+
+        args:
+            q: The percentile, between 0 and 1.
+
+        returns:
+            The latency in seconds, or None without observations.
+        """
+        total = self.count
+        if not total:
+            return None
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * total and count:
+                return BOUNDS[min(bucket, len(BOUNDS) - 1)]
+        return BOUNDS[-1]
+
+    def merge(self, other: "Histogram") -> None:
+        for bucket, count in enumerate(other.counts):
+            self.counts[bucket] += count
+        self.sum += other.sum
+
+
+def count(name: str, outcome: str) -> None:
+    """
+    Counts an event, such as a cache hit.
+
+    args:
+        name: What happened, e.g. the function name.
+        outcome: How it went, e.g. hit or miss.
+    """
+    _counters[name, outcome] += 1
+
+
+def observe(name: str, outcome: str, seconds: float) -> None:
+    """
+    Records how long a call took.
+
+    args:
+        name: The call, e.g. the function name.
+        outcome: How it ended, e.g. success, error or timeout.
+        seconds: How long it took.
+    """
+    try:
+        histogram = _histograms[name, outcome]
+    except KeyError:
+        histogram = _histograms[name, outcome] = Histogram()
+    # inlined rather than a method call, this runs on every hot path
+    histogram.counts[bisect_left(BOUNDS, seconds)] += 1
+    histogram.sum += seconds
+
+
+def outcome_of(error: BaseException) -> str:
+    """
+    Gets the outcome tag of a call that raised.
+
+    args:
+        error: The exception raised.
+
+    returns:
+        timeout, cancelled or error.
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    return "error"
+
+
+def timed(name: str) -> Callable:
+    """
+    Records the latency and outcome of every call of a function or coroutine
+    function.
+
+    args:
+        name: The name of the call.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = perf_counter()
+                outcome = "success"
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException as e:
+                    outcome = outcome_of(e)
+                    raise
+                finally:
+                    observe(name, outcome, perf_counter() - started)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = perf_counter()
+                outcome = "success"
+                try:
+                    return func(*args, **kwargs)
+                except BaseException as e:
+                    outcome = outcome_of(e)
+                    raise
+                finally:
+                    observe(name, outcome, perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+async def track(name: str, awaitable: Awaitable[Any]) -> Any:
+    """
+    Awaits something, recording its latency and outcome.
+
+    args:
+        name: The name of the call.
+        awaitable: The call.
+
+    returns:
+        The result of the call.
+    """
+    started = perf_counter()
+    outcome = "success"
+    try:
+        return await awaitable
+    except BaseException as e:
+        outcome = outcome_of(e)
+        raise
+    finally:
+        observe(name, outcome, perf_counter() - started)
+
+
+def register_gauge(name: str, func: Callable[[], float]) -> None:
+    """
+    Adds a value that is read every time the metrics are rendered.
+
+    args:
+        name: The Prometheus metric name.
+        func: Returns the current value.
+    """
+    _gauges[name] = func
+
+
+def summary() -> Dict[str, Dict[str, Any]]:
+    """
+    Summarizes every call and event recorded so far.
+
+    returns:
+        For each name, the count of each outcome, and for calls the p50 and
+        p99 latency over all outcomes.
+    """
+    names: Dict[str, Dict[str, Any]] = {}
+    merged: Dict[str, Histogram] = {}
+    for (name, outcome), histogram in _histograms.items():
+        entry = names.setdefault(name, {"outcomes": {}})
+        entry["outcomes"][outcome] = histogram.count
+        merged.setdefault(name, Histogram()).merge(histogram)
+    for name, histogram in merged.items():
+        names[name]["p50"] = histogram.percentile(0.5)
+        names[name]["p99"] = histogram.percentile(0.99)
+    for (name, outcome), value in _counters.items():
+        names.setdefault(name, {"outcomes": {}})["outcomes"][outcome] = value
+    return names
+
+
+def render() -> str:
+    """
+    Renders every metric in the Prometheus text format.
+
+    returns:
+        The metrics.
+    """
+    lines: List[str] = [
+        "# HELP tiktoker_events_total Events, such as cache hits and misses.",
+        "# TYPE tiktoker_events_total counter",
+    ]
+    for (name, outcome), value in sorted(_counters.items()):
+        lines.append(
+            f'tiktoker_events_total{{name="{name}",outcome="{outcome}"}} {value}'
+        )
+
+    lines.append("# HELP tiktoker_call_seconds How long calls took, by outcome.")
+    lines.append("# TYPE tiktoker_call_seconds histogram")
+    for (name, outcome), histogram in sorted(_histograms.items()):
+        labels = f'name="{name}",outcome="{outcome}"'
+        seen = 0
+        for bound, value in zip(BOUNDS + ("+Inf",), histogram.counts):
+            seen += value
+            lines.append(
+                f'tiktoker_call_seconds_bucket{{{labels},le="{bound}"}} {seen}'
+            )
+        lines.append(f"tiktoker_call_seconds_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"tiktoker_call_seconds_count{{{labels}}} {seen}")
+
+    for name, func in sorted(_gauges.items()):
+        try:
+            value = float(func())
+        except Exception as e:
+            print(f"Error: unable to read {name}: {e!r}")
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    return web.Response(
+        body=render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def start_server(host: str = "127.0.0.1", port: int = 9100) -> None:
+    """
+    Serves the metrics on http://host:port/metrics for Prometheus to scrape.
+
+    args:
+        host: The address to listen on, keep it local.
+        port: The port to listen on.
+    """
+    global _runner
+    if _runner is not None:
+        return
+    from aiohttp import web  # only imported when metrics are served
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _runner = runner
+
+
+async def stop_server() -> None:
+    """
+    Stops serving the metrics.
+    """
+    global _runner
+    if _runner is None:
+        return
+    runner, _runner = _runner, None
+    await runner.cleanup()
+
+
+def reset() -> None:
+    """
+    Forgets every counter and histogram, gauges are kept.
+    """
+    _counters.clear()
+    _histograms.clear()
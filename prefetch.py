@@ -0,0 +1,149 @@
+import asyncio
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set
+
+import metrics
+
+
+class Prefetcher:
+    """
+    Warms caches from a background queue, so what a button shows is ready
+    before anyone clicks it.
+
+    Jobs only start while `busy()` is false, so prefetching never competes
+    with foreground requests, and a job already queued under the same key
+    isn't queued twice. Jobs are dropped, and counted, when the queue is full.
+    """
+
+    def __init__(
+        self,
+        busy: Callable[[], bool] = lambda: False,
+        max_queue: int = 1000,
+        concurrency: int = 2,
+        idle_delay: float = 0.05,
+    ) -> None:
+        self.busy = busy
+        self.concurrency = concurrency
+        self.idle_delay = idle_delay
+        self.done = 0
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._queued: Set[Hashable] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """
+        Starts the background workers.
+        """
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run()) for _ in range(self.concurrency)
+            ]
+
+    def put(
+        self, key: Hashable, func: Callable[..., Awaitable[Any]], *args: Any
+    ) -> bool:
+        """
+        Queues `func(*args)` without waiting.
+
+        args:
+            key: Identifies the job, a key already queued is skipped.
+            func: The coroutine function that warms the caches.
+
+        returns:
+            Whether the job was queued.
+        """
+        if key in self._queued:
+            metrics.count("prefetch", "duplicate")
+            return False
+        if not self._tasks:
+            return False
+        try:
+            self._queue.put_nowait((key, func, args))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.count("prefetch", "dropped")
+            return False
+        self._queued.add(key)
+        metrics.count("prefetch", "queued")
+        return True
+
+    async def stop(self) -> None:
+        """
+        Stops the workers, dropping the jobs still queued.
+        """
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queued.clear()
+
+    async def _run(self) -> None:
+        while True:
+            key, func, args = await self._queue.get()
+            try:
+                while self.busy():
+                    await asyncio.sleep(self.idle_delay)
+                await func(*args)
+                self.done += 1
+                metrics.count("prefetch", "done")
+            except Exception as e:
+                metrics.count("prefetch", "error")
+                print(f"Error: unable to prefetch {key}: {e!r}")
+            finally:
+                self._queued.discard(key)
+
+
+class TrafficCounter:
+    """
+    Counts events per key over a sliding window, weighing the previous
+    window by how much of it still overlaps.
+    """
+
+    def __init__(self, window: float = 600) -> None:
+        self.window = window
+        self._start = monotonic()
+        self._counts: Dict[Hashable, int] = {}
+        self._previous: Dict[Hashable, int] = {}
+
+    def add(self, key: Hashable, n: int = 1) -> float:
+        """
+        Counts events for a key.
+
+        args:
+            key: The key, such as a guild id.
+            n: How many events.
+
+        returns:
+            The number of events for the key over the last window.
+        """
+        self._roll()
+        current = self._counts.get(key, 0) + n
+        self._counts[key] = current
+        return self._rate(key, current)
+
+    def get(self, key: Hashable) -> float:
+        self._roll()
+        return self._rate(key, self._counts.get(key, 0))
+
+    def _rate(self, key: Hashable, current: int) -> float:
+        overlap = 1 - (monotonic() - self._start) / self.window
+        return current + self._previous.get(key, 0) * overlap
+
+    def _roll(self) -> None:
+        elapsed = monotonic() - self._start
+        if elapsed < self.window:
+            return
+        # keys that went quiet fall out after two windows
+        self._previous = self._counts if elapsed < 2 * self.window else {}
+        self._counts = {}
+        self._start += elapsed - elapsed % self.window
+
+    def __len__(self) -> int:
+        return len(self._counts) + len(self._previous)
@@ -0,0 +1,184 @@
+from typing import Any, Dict, List, Sequence, Tuple
+
+import dis_snek as dis
+
+from cache import TTLCache
+from tiktok import TikTokData
+import metrics
+
+HELP_COLOR = "#00FFF0"
+ROW_SIZE = 5
+
+# the buttons only differ in their custom id or url, so they are rendered
+# once and copied with it filled in
+_INFO_BUTTON = dis.Button(dis.ButtonStyles.GRAY, "Info", "🌐").to_dict()
+_NUMBERED_INFO_BUTTONS = [{**_INFO_BUTTON, "label": f"Info {n}"} for n in range(1, 25)]
+_DELETE_BUTTON = dis.Button(dis.ButtonStyles.RED, emoji="🗑️").to_dict()
+_AUDIO_BUTTON = dis.Button(dis.ButtonStyles.GRAY, "Audio", emoji="🎵").to_dict()
+_DOWNLOAD_BUTTON = dis.Button(
+    dis.ButtonStyles.URL, "Download", url="https://www.tiktok.com"
+).to_dict()
+
+# the statistics in an Info card only change when the TikTok is refetched
+_info_payloads = TTLCache(maxsize=2048, ttl=60 * 60)
+
+
+def _rows(buttons: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    row = dis.ComponentTypes.ACTION_ROW
+    return [
+        {"type": row, "components": buttons[i : i + ROW_SIZE]}
+        for i in range(0, len(buttons), ROW_SIZE)
+    ]
+
+
+def conversion_components(
+    converted: Sequence[Tuple[int, str]], author_id: int
+) -> List[Dict[str, Any]]:
+    """
+    Renders an Info button for each converted link, and the delete button.
+
+    args:
+        converted: The video ids and short urls.
+        author_id: The id of who may delete the message.
+
+    returns:
+        The action rows, as Discord takes them.
+    """
+    if len(converted) == 1:
+        buttons = [{**_INFO_BUTTON, "custom_id": f"v_id{converted[0][0]}"}]
+    else:
+        buttons = [
+            {**template, "custom_id": f"v_id{video_id}"}
+            for template, (video_id, _) in zip(_NUMBERED_INFO_BUTTONS, converted)
+        ]
+    buttons.append({**_DELETE_BUTTON, "custom_id": f"delete{author_id}"})
+    return _rows(buttons)
+
+
+def info_payload(tiktok: TikTokData) -> Dict[str, Any]:
+    """
+    Gets the Info card of a TikTok, rendered once each time it is fetched.
+
+    args:
+        tiktok: The TikTok.
+
+    returns:
+        The embed and components to send, shared between calls so they must
+        not be changed.
+    """
+    key = (tiktok.id, tiktok.fetched_at)
+    if (payload := _info_payloads.get(key)) is not None:
+        metrics.count("info_payload", "hit")
+        return payload
+    metrics.count("info_payload", "miss")
+    payload = _render_info(tiktok)
+    _info_payloads.set(key, payload)
+    return payload
+
+
+def _render_info(tiktok: TikTokData) -> Dict[str, Any]:
+    video = tiktok.video
+    author = tiktok.author
+    stats = tiktok.statistics
+
+    embed = dis.Embed(
+        tiktok.description.cleaned[:256] if tiktok.description.cleaned != "" else None,
+        description=tiktok.share_url,
+    )
+
+    embed.set_author(name=author.nickname, icon_url=author.avatar, url=author.url)
+    embed.set_thumbnail(url=video.cover_url)
+    embed.add_field("Views 👁️", stats.play_count, True)
+    embed.add_field("Likes ❤️", stats.like_count, True)
+    embed.add_field("Comments 💬", stats.comment_count, True)
+    embed.add_field("Shares 🔃", stats.share_count, True)
+    embed.add_field("Downloads 📥", stats.download_count, True)
+    embed.add_field("Created", tiktok.created, True)
+    embed.add_field(
+        "Updated 🕑",
+        dis.Timestamp.fromtimestamp(tiktok.fetched_at).format(
+            dis.TimestampStyles.RelativeTime
+        ),
+        True,
+    )
+    if len(tiktok.description.tags) > 0:
+        embed.add_field(
+            "Tags 🔖",
+            ", ".join(
+                f"[`#{tag}`](https://www.tiktok.com/tag/{tag})"
+                for tag in tiktok.description.tags
+            ),
+            True,
+        )
+
+    return {
+        "embed": embed.to_dict(),
+        "components": _rows(
+            [
+                {**_DOWNLOAD_BUTTON, "url": video.download_url},
+                {**_AUDIO_BUTTON, "custom_id": f"m_id{tiktok.id}"},
+            ]
+        ),
+    }
+
+
+def _help_embeds() -> List[dis.Embed]:
+    embeds = [
+        dis.Embed(
+            title="Tiktoker",
+            description="Tiktoker is a bot that allows you to send Tiktok videos to your discord server.",
+            color=HELP_COLOR,
+            fields=[
+                dis.EmbedField(
+                    "Help Menu",
+                    "Bellow is some buttons that will guide you through some features of the bot.",
+                ).to_dict(),
+            ],
+        ),
+        dis.Embed(
+            "Configuration",
+            "Here are some configuration options for the bot.\nThese can be changed by using the `/config <option> <vaulue>` command.\nExample: `/config delete_origin:True`\nTo view the current configuration, use `/config` without any arguments.",
+            color=HELP_COLOR,
+            fields=[
+                dis.EmbedField(
+                    "Auto Embed",
+                    "When enabled, the bot will automatically embed the Tiktok link that is sent.",
+                ).to_dict(),
+                dis.EmbedField(
+                    "Delete Origin",
+                    "When enabled and _Auto Embed_ is enabled, the bot will delete the message that sent the Tiktok link.",
+                ).to_dict(),
+                dis.EmbedField(
+                    "Suppress Origin Embed",
+                    "Toggles the suppress origin embed feature.",
+                ).to_dict(),
+                dis.EmbedField(
+                    "Max Links",
+                    "How many Tiktok links in a single message are converted.",
+                ).to_dict(),
+                dis.EmbedField(
+                    "Prefetch",
+                    "Loads what the Info and Audio buttons show before they are clicked. Auto turns it on while the server is busy.",
+                ).to_dict(),
+            ],
+        ),
+        dis.Embed(
+            "Commands",
+            "Here are some commands that can be used to interact with the bot.",
+            color=HELP_COLOR,
+            fields=[
+                dis.EmbedField(
+                    "Convert 📸",
+                    "Right click a message then go to *`Apps > Convert 📸`*. \nMeant for when *Auto Embed* is disabled in the server's config.",
+                ).to_dict(),
+            ],
+        ),
+    ]
+    # what the paginator would set on each page the first time it is shown
+    for n, embed in enumerate(embeds, 1):
+        embed.set_footer(f"Page {n}/{len(embeds)}")
+    return embeds
+
+
+# the pages of /help never change, the paginator only reads them
+HELP_EMBEDS = _help_embeds()
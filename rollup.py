@@ -0,0 +1,271 @@
+import asyncio
+import math
+from collections import Counter, defaultdict
+from hashlib import blake2b
+from heapq import nlargest
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import GuildUsage, UsageData, UsageTotals
+
+DAY = 24 * 60 * 60
+GLOBAL = "global"
+HLL_PRECISION = 12  # 4096 registers, about 1.6% error
+_HLL_REGISTERS = 1 << HLL_PRECISION
+_HLL_REST_BITS = 64 - HLL_PRECISION
+# videos counted per guild and day, plenty to rank the top of a month; the
+# counts are trimmed back once twice as many videos were converted
+TOP_VIDEOS = 100
+_TRIM_VIDEOS_AT = 2 * TOP_VIDEOS
+
+
+def hll_register(user_id: int) -> Tuple[str, int]:
+    """
+    Gets the HyperLogLog register a user falls in, and the value they set it to.
+
+    args:
+        user_id: The user id.
+
+    returns:
+        The register, as a subdocument key, and its value.
+    """
+    digest = blake2b(user_id.to_bytes(8, "big"), digest_size=8).digest()
+    hashed = int.from_bytes(digest, "big")
+    rest = hashed & ((1 << _HLL_REST_BITS) - 1)
+    return str(hashed >> _HLL_REST_BITS), _HLL_REST_BITS - rest.bit_length() + 1
+
+
+def hll_merge(*register_sets: Dict[str, int]) -> Dict[str, int]:
+    """
+    Merges HyperLogLog registers, as if every user was added to one.
+
+    returns:
+        The merged registers.
+    """
+    merged: Dict[str, int] = {}
+    for registers in register_sets:
+        for register, value in registers.items():
+            if value > merged.get(register, 0):
+                merged[register] = value
+    return merged
+
+
+def hll_estimate(registers: Dict[str, int]) -> int:
+    """
+    Estimates how many distinct users set the registers.
+
+    args:
+        registers: The registers that are set.
+
+    returns:
+        The estimated number of users.
+    """
+    m = _HLL_REGISTERS
+    zeros = m - len(registers)
+    inverse_sum = zeros + sum(2.0**-value for value in registers.values())
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / inverse_sum
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)  # linear counting, exact-ish when small
+    return round(estimate)
+
+
+def rollup_updates(
+    records: Iterable[UsageData],
+) -> Tuple[List[UpdateOne], Optional[UpdateOne]]:
+    """
+    Folds usage records into one upsert per guild and day, and one for the
+    totals.
+
+    args:
+        records: The usage records.
+
+    returns:
+        The guild and day updates, and the totals update.
+    """
+    conversions: Counter = Counter()
+    videos: Dict[Tuple[int, int], Counter] = defaultdict(Counter)
+    users: Dict[Tuple[int, int], Dict[str, int]] = defaultdict(dict)
+    total_users: Dict[str, int] = {}
+    for record in records:
+        key = (record.guild_id, record.timestamp // DAY)
+        conversions[key] += 1
+        videos[key][str(record.video_id)] += 1
+        if record.user_id is not None:  # opted out users are only counted
+            register, value = hll_register(record.user_id)
+            if value > users[key].get(register, 0):
+                users[key][register] = value
+            if value > total_users.get(register, 0):
+                total_users[register] = value
+
+    guild_updates = []
+    for (guild_id, day), count in conversions.items():
+        update = {
+            "$inc": {
+                "conversions": count,
+                **{f"videos.{video}": n for video, n in videos[guild_id, day].items()},
+            }
+        }
+        if registers := users.get((guild_id, day)):
+            update["$max"] = {f"users.{r}": value for r, value in registers.items()}
+        guild_updates.append(
+            UpdateOne({"guild_id": guild_id, "day": day}, update, upsert=True)
+        )
+
+    if not conversions:
+        return guild_updates, None
+    update = {"$inc": {"conversions": sum(conversions.values())}}
+    if total_users:
+        update["$max"] = {f"users.{r}": value for r, value in total_users.items()}
+    return guild_updates, UpdateOne({"name": GLOBAL}, update, upsert=True)
+
+
+async def apply_rollups(records: List[UsageData]) -> None:
+    """
+    Adds usage records to the rollups, in one round trip per collection,
+    then trims the video counts of the guild rollups that outgrew them.
+
+    args:
+        records: The usage records.
+    """
+    guild_updates, totals_update = rollup_updates(records)
+    writes = []
+    if guild_updates:
+        writes.append(
+            GuildUsage.get_motor_collection().bulk_write(guild_updates, ordered=False)
+        )
+    if totals_update is not None:
+        writes.append(UsageTotals.get_motor_collection().bulk_write([totals_update]))
+    await asyncio.gather(*writes)
+    if guild_updates:
+        await trim_videos(
+            {(record.guild_id, record.timestamp // DAY) for record in records}
+        )
+
+
+async def trim_videos(keys: Iterable[Tuple[int, int]]) -> int:
+    """
+    Keeps only the TOP_VIDEOS most converted videos of guild rollups that
+    count more than twice that many, so a busy guild's rollup stays small.
+
+    args:
+        keys: The guild ids and days of the rollups to check.
+
+    returns:
+        How many rollups were trimmed.
+    """
+    keys = list(keys)
+    if not keys:
+        return 0
+    collection = GuildUsage.get_motor_collection()
+    # only the oversized ones are read, the server counts the videos
+    oversized = collection.find(
+        {
+            "$or": [{"guild_id": guild_id, "day": day} for guild_id, day in keys],
+            "$expr": {
+                "$gt": [
+                    {"$size": {"$objectToArray": {"$ifNull": ["$videos", {}]}}},
+                    _TRIM_VIDEOS_AT,
+                ]
+            },
+        },
+        projection={"videos": True},
+    )
+    updates = []
+    async for rollup in oversized:
+        videos = rollup["videos"]
+        kept = set(nlargest(TOP_VIDEOS, videos, key=videos.get))
+        # unset, not set, so conversions added meanwhile to kept videos stay
+        dropped = {f"videos.{video}": "" for video in videos if video not in kept}
+        updates.append(UpdateOne({"_id": rollup["_id"]}, {"$unset": dropped}))
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+async def guild_usage(guild_id: int, days: int = 30, top: int = 5) -> Dict:
+    """
+    Gets the usage of a guild over the last days, reading at most one rollup
+    per day.
+
+    args:
+        guild_id: The guild id.
+        days: How many days back, today included.
+        top: How many of the most converted videos to return.
+
+    returns:
+        The conversions, estimated distinct users and top videos.
+    """
+    today = int(time()) // DAY
+    rollups = await GuildUsage.find(
+        {"guild_id": guild_id, "day": {"$gt": today - days}}
+    ).to_list()
+    videos: Counter = Counter()
+    for rollup in rollups:
+        videos.update(rollup.videos)
+    return {
+        "conversions": sum(rollup.conversions for rollup in rollups),
+        "users": hll_estimate(hll_merge(*(rollup.users for rollup in rollups))),
+        "top_videos": [
+            (int(video_id), count)
+            for video_id, count in nlargest(top, videos.items(), key=lambda i: i[1])
+        ],
+    }
+
+
+async def total_usage() -> Dict:
+    """
+    Gets the usage across every guild.
+
+    returns:
+        The conversions and estimated distinct users.
+    """
+    totals = await UsageTotals.find_one({"name": GLOBAL})
+    if totals is None:
+        return {"conversions": 0, "users": 0}
+    return {"conversions": totals.conversions, "users": hll_estimate(totals.users)}
+
+
+async def backfill_rollups(before: int, batch_size: int = 5000) -> int:
+    """
+    Adds the usage records written before the rollups existed. Records from
+    `before` on were already added by the usage writer.
+
+    args:
+        before: When the usage writer started updating the rollups, a timestamp.
+        batch_size: How many records to add per round trip.
+
+    returns:
+        How many records were added.
+    """
+    added = 0
+    batch = []
+    async for record in UsageData.find({"timestamp": {"$lt": before}}):
+        batch.append(record)
+        if len(batch) == batch_size:
+            await apply_rollups(batch)
+            added += len(batch)
+            batch = []
+    if batch:
+        await apply_rollups(batch)
+        added += len(batch)
+    return added
+
+
+if __name__ == "__main__":
+    import sys
+
+    import motor.motor_asyncio
+    from beanie import init_beanie
+    from dotenv import get_key
+
+    async def main() -> None:
+        client = motor.motor_asyncio.AsyncIOMotorClient(get_key(".env", "MONGODB_URL"))
+        await init_beanie(
+            database=client.tiktoker,
+            document_models=[UsageData, GuildUsage, UsageTotals],
+        )
+        print(f"Added {await backfill_rollups(int(sys.argv[1]))} usage records")
+
+    asyncio.run(main())
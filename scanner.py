@@ -0,0 +1,61 @@
+import re
+from time import perf_counter
+from typing import List, Optional
+
+import metrics
+from models import LinkData, VideoIdType
+
+_LINK_RE = re.compile(
+    r"(?P<http>https?://)?"
+    r"(?:"
+    r"(?:www\.)?tiktok\.com/@[^\s/]{1,24}/video/(?P<long_id>\d{15,30})"
+    r"|m\.tiktok\.com/v/(?P<medium_id>\d{15,30})"
+    r"|\w{2}\.tiktok\.com/(?P<short_id>\w{5,15})"
+    r")"
+)
+
+
+def scan_links(content: str) -> List[LinkData]:
+    """
+    Finds every TikTok video link in the content.
+
+    args:
+        content: The content to scan.
+
+    returns:
+        The links, in the order they appear.
+    """
+    # almost no message has a link, so skip the regex unless it can match, and
+    # don't record those either, that would cost more than the check itself
+    if not isinstance(content, str) or "tiktok.com" not in content:
+        return []
+
+    started = perf_counter()
+    links = []
+    for match in _LINK_RE.finditer(content):
+        url = match.group(0)
+        if not match.group("http"):
+            url = f"https://{url}"
+        if id := match.group("long_id"):
+            links.append(LinkData(VideoIdType.LONG, id, url))
+        elif id := match.group("short_id"):
+            links.append(LinkData(VideoIdType.SHORT, id, url))
+        else:
+            links.append(LinkData(VideoIdType.MEDIUM, match.group("medium_id"), url))
+    metrics.observe("scan_links", "link" if links else "none", perf_counter() - started)
+    return links
+
+
+def check_for_link(content: str) -> Optional[LinkData]:
+    """
+    Checks if the content has a TikTok video.
+
+    args:
+        content: The content to check.
+
+    returns:
+        The first LinkData found.
+    """
+    if links := scan_links(content):
+        return links[0]
+    return None
@@ -0,0 +1,66 @@
+from typing import Optional
+
+import aiohttp
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def open_session(
+    limit: int = 100,
+    limit_per_host: int = 30,
+    dns_ttl: int = 300,
+    keepalive_timeout: float = 30,
+    timeout: float = 5,
+) -> aiohttp.ClientSession:
+    """
+    Opens the shared http session used for all outbound requests.
+
+    args:
+        limit: The total number of simultaneous connections.
+        limit_per_host: The number of simultaneous connections to a single host.
+        dns_ttl: How long resolved hosts are cached, in seconds.
+        keepalive_timeout: How long idle connections are kept in the pool, in seconds.
+        timeout: The default total timeout of a request, in seconds.
+
+    returns:
+        The shared session.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=dns_ttl,
+        use_dns_cache=True,
+        keepalive_timeout=keepalive_timeout,
+    )
+    _session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    )
+    return _session
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Gets the shared http session.
+
+    returns:
+        The shared session.
+    """
+    if _session is None or _session.closed:
+        raise RuntimeError("HTTP session is not open, call open_session() first")
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Closes the shared http session and its connection pool.
+    """
+    global _session
+    if _session is None:
+        return
+    session, _session = _session, None
+    await session.close()
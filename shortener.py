@@ -0,0 +1,75 @@
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from cache import SingleFlight, TTLCache
+from database import Shortener
+import metrics
+
+SHORT_URL_BASE = "https://m.tiktoker.win/"
+SLUG_ATTEMPTS = 5
+
+_short_urls = TTLCache(maxsize=16_384, ttl=24 * 60 * 60)
+_short_url_inflight = SingleFlight()
+
+
+def make_slug(video_uri: str, attempt: int = 0) -> str:
+    """
+    Derives the slug for a video, the same every time.
+
+    args:
+        video_uri: The uri of the video.
+        attempt: Bumped to derive another slug after a collision.
+
+    returns:
+        An 8 character url safe slug.
+    """
+    key = video_uri if attempt == 0 else f"{video_uri}#{attempt}"
+    return urlsafe_b64encode(sha256(key.encode()).digest()[:6]).decode()
+
+
+@metrics.timed("create_short_url")
+async def create_short_url(video_uri: str) -> str:
+    """
+    Shortens a url if not in cache.
+
+    args:
+        video_uri: The uri of the video.
+
+    returns:
+        The shortened url.
+    """
+    if (shortened_url := _short_urls.get(video_uri)) is not None:
+        metrics.count("create_short_url", "hit")
+        return shortened_url
+    metrics.count("create_short_url", "miss")
+    return await _short_url_inflight.do(video_uri, _upsert_short_url, video_uri)
+
+
+async def _upsert_short_url(video_uri: str) -> str:
+    collection = Shortener.get_motor_collection()
+    for attempt in range(SLUG_ATTEMPTS):
+        slug = make_slug(video_uri, attempt)
+        try:
+            # returns the existing entry, or inserts ours, in one round trip
+            entry = await collection.find_one_and_update(
+                {"video_uri": video_uri},
+                {
+                    "$setOnInsert": {
+                        "slug": slug,
+                        "shortened_url": SHORT_URL_BASE + slug,
+                    }
+                },
+                projection={"_id": False, "shortened_url": True},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # another process inserted this video first, or the slug is taken
+            # by another video; either way the next attempt sorts it out
+            continue
+        _short_urls.set(video_uri, entry["shortened_url"])
+        return entry["shortened_url"]
+    raise ValueError("Unable to create a short url")
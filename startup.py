@@ -0,0 +1,96 @@
+from time import perf_counter
+from typing import Any, Dict, Optional
+
+_started = perf_counter()  # bot.py imports this first
+_marks: Dict[str, float] = {}
+
+
+def mark(phase: str) -> bool:
+    """
+    Records that a phase of startup finished, the first time only.
+
+    args:
+        phase: The name of the phase.
+
+    returns:
+        Whether this was the first time.
+    """
+    if phase in _marks:
+        return False
+    _marks[phase] = perf_counter() - _started
+    return True
+
+
+def timeline() -> Dict[str, float]:
+    """
+    Gets when each phase finished.
+
+    returns:
+        The seconds since the process started, in the order they finished.
+    """
+    return dict(_marks)
+
+
+def report() -> str:
+    """
+    Formats the timeline, each phase with how long it took after the one
+    before it.
+
+    returns:
+        One line, such as "imports 0.91s, database 1.10s (+0.19s)".
+    """
+    parts = []
+    previous = 0.0
+    for phase, at in _marks.items():
+        step = f" (+{at - previous:.2f}s)" if parts else ""
+        parts.append(f"{phase} {at:.2f}s{step}")
+        previous = at
+    return ", ".join(parts)
+
+
+def commands_hash(bot: Any) -> str:
+    """
+    Hashes the application commands as they would be sent to Discord.
+
+    args:
+        bot: The Snake the commands are registered on.
+
+    returns:
+        The hex digest.
+    """
+    import hashlib
+    import json
+
+    from dis_snek.models.snek.application_commands import (
+        application_commands_to_dict,
+    )
+
+    commands = application_commands_to_dict(bot.interactions)
+    return hashlib.sha256(
+        json.dumps(commands, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+async def sync_commands(bot: Any, hash_file: str) -> Optional[str]:
+    """
+    Syncs the application commands with Discord, unless they are the same
+    as the last time they were synced.
+
+    args:
+        bot: The Snake the commands are registered on.
+        hash_file: Where the hash of the last synced commands is kept.
+
+    returns:
+        The new hash when the commands were synced, None when they weren't.
+    """
+    digest = commands_hash(bot)
+    try:
+        with open(hash_file) as file:
+            if file.read().strip() == digest:
+                return None
+    except OSError:
+        pass  # never synced from here
+    await bot.synchronise_interactions()
+    with open(hash_file, "w") as file:
+        file.write(digest)
+    return digest
@@ -0,0 +1,181 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import StoredTikTok
+import metrics
+
+
+class TikTokStore:
+    """
+    Keeps fetched TikToks in MongoDB, so a restarted process reads them back
+    instead of asking TikTok again.
+
+    Writes are buffered and sent in batches from a background task, the
+    latest write for a video replacing any still buffered. Reads give up
+    after `read_timeout`, a slow database shouldn't hold up a fetch. Entries
+    are tagged with `version`, entries of any other version are treated as
+    missing and replaced on the next write.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        ttl: float = 6 * 60 * 60,
+        read_timeout: float = 0.25,
+        max_pending: int = 10_000,
+        flush_interval: float = 1,
+    ) -> None:
+        self.version = version
+        self.ttl = ttl
+        self.read_timeout = read_timeout
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._pending: Dict[int, Tuple[Dict[str, Any], float]] = {}
+        self._wake = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        """
+        Starts the background writer.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the writer after flushing everything still buffered.
+        """
+        if self._task is None:
+            return
+        # not cancelled, that would lose a batch the writer is in the middle of
+        self._closing.set()
+        self._wake.set()
+        await self._task
+        self._task = None
+        await self._flush()  # anything buffered while the last batch was written
+
+    def put(self, video_id: int, data: Dict[str, Any], fetched_at: float) -> bool:
+        """
+        Buffers a TikTok without waiting.
+
+        args:
+            video_id: The aweme id of the video.
+            data: The compact data of the TikTok.
+            fetched_at: Unix time the data was fetched from TikTok.
+
+        returns:
+            Whether the TikTok was buffered.
+        """
+        if len(self._pending) >= self.max_pending and video_id not in self._pending:
+            self.dropped += 1
+            metrics.count("tiktok_store", "dropped")
+            return False
+        self._pending[video_id] = (data, fetched_at)
+        self._wake.set()
+        return True
+
+    async def get(self, video_id: int) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Reads a TikTok, when there is one of this version that hasn't expired.
+
+        args:
+            video_id: The aweme id of the video.
+
+        returns:
+            The compact data and when it was fetched, or None.
+        """
+        try:
+            doc = await asyncio.wait_for(
+                StoredTikTok.get_motor_collection().find_one(
+                    self._filter(video_id),
+                    projection={"data": True, "fetched_at": True},
+                ),
+                self.read_timeout,
+            )
+        except asyncio.TimeoutError:
+            metrics.count("tiktok_store", "timeout")
+            return None
+        except Exception as e:
+            metrics.count("tiktok_store", "error")
+            print(f"Error: unable to read {video_id} from the TikTok store: {e!r}")
+            return None
+        metrics.count("tiktok_store", "miss" if doc is None else "hit")
+        return None if doc is None else (doc["data"], doc["fetched_at"])
+
+    async def get_many(
+        self, video_ids: Iterable[int]
+    ) -> Dict[int, Tuple[Dict[str, Any], float]]:
+        """
+        Reads the TikToks of this version that haven't expired, in one query.
+
+        args:
+            video_ids: The aweme ids of the videos.
+
+        returns:
+            The compact data and when it was fetched, by aweme id.
+        """
+        cursor = StoredTikTok.get_motor_collection().find(
+            self._filter({"$in": list(video_ids)}),
+            projection={"data": True, "fetched_at": True},
+        )
+        return {doc["_id"]: (doc["data"], doc["fetched_at"]) async for doc in cursor}
+
+    def _filter(self, video_id: Any) -> Dict[str, Any]:
+        # MongoDB removes expired entries about once a minute, not right away
+        return {
+            "_id": video_id,
+            "version": self.version,
+            "expires_at": {"$gt": datetime.utcnow()},
+        }
+
+    async def _run(self) -> None:
+        while not self._closing.is_set():
+            await self._wake.wait()
+            # let a batch gather before writing it, unless stopping
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        requests = [
+            UpdateOne(
+                {"_id": video_id},
+                {
+                    "$set": {
+                        "version": self.version,
+                        "data": data,
+                        "fetched_at": fetched_at,
+                        "expires_at": datetime.utcfromtimestamp(fetched_at + self.ttl),
+                    }
+                },
+                upsert=True,
+            )
+            for video_id, (data, fetched_at) in batch.items()
+        ]
+        try:
+            await StoredTikTok.get_motor_collection().bulk_write(
+                requests, ordered=False
+            )
+        except Exception as e:
+            metrics.count("tiktok_store", "error")
+            print(f"Error: failed to store {len(batch)} TikToks: {e!r}")
+            return
+        self.written += len(batch)
+        metrics.count("tiktok_store", "written")
+
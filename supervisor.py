@@ -0,0 +1,142 @@
+"""
+Runs the bot sharded: one process per gateway shard, all connected to an
+invalidation relay so their caches stay coherent.
+
+    python supervisor.py              # as many shards as Discord recommends
+    python supervisor.py --shards 4
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from dotenv import get_key
+
+from coherence import Relay
+
+GATEWAY_BOT_URL = "https://discord.com/api/v9/gateway/bot"
+IDENTIFY_INTERVAL = 5  # Discord allows max_concurrency identifies per 5 seconds
+MAX_RESTART_DELAY = 60
+
+
+def shard_for(guild_id: int, total_shards: int) -> int:
+    """
+    Gets the shard Discord sends a guild's events to.
+
+    args:
+        guild_id: The guild id.
+        total_shards: The number of shards.
+
+    returns:
+        The shard id.
+    """
+    return (guild_id >> 22) % total_shards
+
+
+async def recommended_shards(token: str) -> Tuple[int, int]:
+    """
+    Asks Discord how many shards to run, and how many may identify at once.
+
+    args:
+        token: The bot token.
+
+    returns:
+        The number of shards, and how many can start together.
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+class Supervisor:
+    """
+    Starts a bot process per shard, restarting any that exit, with a delay
+    that doubles each time a shard exits again.
+    """
+
+    def __init__(self, total_shards: int, max_concurrency: int, relay_path: str):
+        self.total_shards = total_shards
+        self.max_concurrency = max_concurrency
+        self.relay = Relay(relay_path)
+        self.processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._stopping = asyncio.Event()
+
+    async def run(self) -> None:
+        await self.relay.start()
+        try:
+            await asyncio.gather(
+                *(self._keep_running(shard) for shard in range(self.total_shards))
+            )
+        finally:
+            await self.relay.stop()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
+
+    async def _keep_running(self, shard_id: int) -> None:
+        # shards identify in buckets of max_concurrency, one bucket at a time
+        if await self._wait(shard_id // self.max_concurrency * IDENTIFY_INTERVAL):
+            return
+        delay = 1
+        while not self._stopping.is_set():
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "bot.py",
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env={
+                    **os.environ,
+                    "TIKTOKER_SHARD_ID": str(shard_id),
+                    "TIKTOKER_TOTAL_SHARDS": str(self.total_shards),
+                    "TIKTOKER_RELAY": self.relay.path,
+                },
+            )
+            self.processes[shard_id] = process
+            print(f"Shard {shard_id} started, pid {process.pid}")
+            code = await process.wait()
+            if self._stopping.is_set():
+                return
+            print(f"Error: shard {shard_id} exited with {code}, restarting in {delay}s")
+            if await self._wait(delay):
+                return
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def _wait(self, seconds: float) -> bool:
+        """Sleeps, returning early with True if the supervisor is stopping."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+async def main(shards: Optional[int], relay_path: str) -> None:
+    max_concurrency = 1
+    if shards is None:
+        shards, max_concurrency = await recommended_shards(get_key(".env", "TOKEN"))
+    supervisor = Supervisor(shards, max_concurrency, relay_path)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, supervisor.stop)
+    print(f"Running {shards} shards")
+    await supervisor.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--shards", type=int)
+    parser.add_argument(
+        "--relay",
+        default=get_key(".env", "RELAY_PATH") or "/tmp/tiktoker-relay.sock",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.shards, args.relay))
@@ -1,10 +1,48 @@
-from typing import Any, Dict, List, Optional
+import asyncio
+from time import monotonic, time
+from typing import Any, Callable, Dict, List, Optional, Sequence
 import aiohttp
 from attr import define
 import attr
 import dis_snek as dis
 from dis_snek.client.utils.converters import timestamp_converter
 
+from cache import SingleFlight, TTLCache
+from latency import LatencyHistogram, RequestPolicy, hedged
+from limiter import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    UpstreamOverloaded,
+    UpstreamUnavailable,
+)
+from session import get_session
+from store import TikTokStore
+import coherence
+import metrics
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# video, music and author never change once posted, statistics are
+# revalidated in the background by whoever shows them
+TIKTOK_TTL = 6 * 60 * 60
+_tiktok_cache = TTLCache(maxsize=4096, ttl=TIKTOK_TTL)
+_tiktok_inflight = SingleFlight()
+_background_tasks = set()
+STATISTICS_MAX_AGE = 60
+# bump when the compact data TikTokData is built from changes shape, stored
+# TikToks of other versions are then refetched instead of migrated
+SCHEMA_VERSION = 1
+_tiktok_store: Optional[TikTokStore] = None
+
+AWEME_DETAIL_URL = "https://api2.musical.ly/aweme/v1/aweme/detail/"
+_aweme_limiter = AdaptiveLimiter(initial_limit=16, max_limit=256, latency_target=1)
+_aweme_breaker = CircuitBreaker(failure_threshold=5, reset_timeout=10)
+_aweme_latency = LatencyHistogram()
+aweme_policy = RequestPolicy()
+
 
 @attr.s()
 class TikTokObject(dis.DictSerializationMixin):
@@ -14,10 +52,14 @@ class TikTokObject(dis.DictSerializationMixin):
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]):
-        data = cls._process_dict(
-            data,
-        )
-        return cls(**cls._filter_kwargs(data, cls._get_init_keys()))
+        return cls(*cls._compact(data))
+
+    @classmethod
+    def _compact(cls, data: Dict[str, Any]) -> tuple:
+        """The processed field values, in the order the class takes them."""
+        # _process_dict assigns into the dict, the caller's raw data is left as is
+        data = cls._process_dict(dict(data))
+        return tuple(data.get(field.name) for field in attr.fields(cls))
 
     @classmethod
     def from_list(cls, datas: List[Dict[str, Any]]):
@@ -62,16 +104,12 @@ class Statistics(TikTokObject):
 
     @classmethod
     def _process_dict(cls, data: dict) -> dict:
-        if like_count := data.get("digg_count"):
-            data["like_count"] = like_count
-        if comment_count := data.get("comment_count"):
-            data["comment_count"] = comment_count
-        if share_count := data.get("share_count"):
-            data["share_count"] = share_count
-        if download_count := data.get("download_count"):
-            data["download_count"] = download_count
-        if play_count := data.get("play_count"):
-            data["play_count"] = play_count
+        # counts of 0 are real counts, so don't test them for truthiness
+        data["like_count"] = data.get("digg_count", 0)
+        data["comment_count"] = data.get("comment_count", 0)
+        data["share_count"] = data.get("share_count", 0)
+        data["download_count"] = data.get("download_count", 0)
+        data["play_count"] = data.get("play_count", 0)
         return data
 
 
@@ -139,68 +177,368 @@ class Description(TikTokObject):
 
     @classmethod
     def _process_dict(cls, data: dict) -> dict:
-        if raw := data.get("desc"):
-            data["raw"] = raw
-        data["cleaned"] = clean_desc(data.get("text_extra"), raw)
+        raw = data.get("desc") or ""
+        text_extra = data.get("text_extra") or []
+        data["raw"] = raw
+        data["cleaned"] = clean_desc(text_extra, raw)
         data["tags"] = [
-            f"{tag['hashtag_name']}"
-            for tag in data.get("text_extra")
-            if tag.get("type") == 1
+            f"{tag['hashtag_name']}" for tag in text_extra if tag.get("type") == 1
         ]
         return data
 
 
+def _build_description(data: list) -> "Description":
+    desc, hashtags = data
+    return Description.from_dict(
+        {
+            "desc": desc,
+            "text_extra": [
+                {"type": 1, "hashtag_name": name, "start": start, "end": end}
+                for name, start, end in hashtags
+            ],
+        }
+    )
+
+
 def clean_desc(text_extra, desc) -> str:
-    for tag in text_extra:
-        desc: str
+    """
+    Removes the hashtags from a description.
+
+    args:
+        text_extra: The text_extra entries of the aweme.
+        desc: The description.
+
+    returns:
+        The description without hashtags.
+    """
+    hashtags = sorted(
+        (tag for tag in text_extra if tag.get("type") == 1),
+        key=lambda tag: tag.get("start") or 0,
+    )
+    pieces = []
+    last = 0
+    for tag in hashtags:
+        start, end = tag.get("start"), tag.get("end")
+        # offsets are sometimes counted in utf-16, only trust them if they line up
+        if start is None or start < last or desc[start:end] != f"#{tag['hashtag_name']}":
+            return _clean_desc_by_name(hashtags, desc)
+        pieces.append(desc[last:start])
+        last = end
+    pieces.append(desc[last:])
+    return "".join(pieces).strip()
+
+
+def _clean_desc_by_name(hashtags, desc) -> str:
+    for tag in hashtags:
         desc = desc.replace(f"#{tag.get('hashtag_name')}", "", 1)
     return desc.strip()
 
 
-@define
-class TikTokData(TikTokObject):
-    id: str = attr.ib()
-    video: "Video" = attr.ib()
-    created: "dis.Timestamp" = attr.ib(converter=timestamp_converter)
-    statistics: "Statistics" = attr.ib()
-    share_url: str = attr.ib()
-    description: "Description" = attr.ib()
-    music: "Music" = attr.ib()
-    author: "Author" = attr.ib()
+class _Part:
+    """
+    Builds a part of a TikTokData from its compact data the first time it is read.
+    """
+
+    def __init__(self, build: Callable[[Any], Any]) -> None:
+        self.build = build
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+        self.slot = f"_{name}"
+
+    def __get__(self, instance: Optional["TikTokData"], owner: type = None) -> Any:
+        if instance is None:
+            return self
+        value = getattr(instance, self.slot)
+        if value is None:
+            value = self.build(instance._data[self.name])
+            setattr(instance, self.slot, value)
+        return value
+
+
+class TikTokData:
+    """
+    A TikTok.
+
+    Only the fields the bot uses are kept, and each part is built when first read;
+    the auto embed only ever reads `video`.
+    """
+
+    __slots__ = (
+        "id",
+        "share_url",
+        "fetched_at",
+        "_data",
+        "_created",
+        "_video",
+        "_statistics",
+        "_description",
+        "_music",
+        "_author",
+    )
+
+    created: "dis.Timestamp" = _Part(timestamp_converter)
+    video: "Video" = _Part(lambda data: Video(*data))
+    statistics: "Statistics" = _Part(lambda data: Statistics(*data))
+    description: "Description" = _Part(_build_description)
+    music: "Music" = _Part(lambda data: Music(*data))
+    author: "Author" = _Part(lambda data: Author(*data))
+
+    def __init__(self, data: Dict[str, Any], fetched_at: float = None) -> None:
+        self.id: int = data["id"]
+        self.share_url: str = data["share_url"]
+        self.fetched_at: float = time() if fetched_at is None else fetched_at
+        """ Unix time the data was fetched from TikTok """
+        self._data = data
+        self._created = None
+        self._video = None
+        self._statistics = None
+        self._description = None
+        self._music = None
+        self._author = None
 
     @classmethod
-    def _process_dict(cls, data: dict) -> "TikTokData":
-        """data is the aweme_details dict"""
-
-        if id := data.get("aweme_id"):
-            data["id"] = int(id)
-        if video := data.get("video"):
-            data["video"] = Video.from_dict(video)
-        if created := data.get("create_time"):
-            data["created"] = created
-        if statistics := data.get("statistics"):
-            data["statistics"] = Statistics.from_dict(statistics)
-        if share_url := data.get("share_url"):
-            data["share_url"] = share_url.split(".html")[
-                0
-            ]  # remove unnesesary query params
-        data["description"] = Description.from_dict(data)
-        if music := data.get("music"):
-            data["music"] = Music.from_dict(music)
-
-        if author := data.get("author"):
-            data["author"] = Author.from_dict(author)
+    def from_dict(cls, data: Dict[str, Any]) -> "TikTokData":
+        """
+        Creates a TikTokData from an aweme_detail dict.
 
-        return data
+        args:
+            data: The aweme_detail dict.
 
+        returns:
+            A TikTokData object.
+        """
+        return cls(cls._process_dict(data))
 
-async def get_tiktok(video_id: int) -> Optional["TikTokData"]:
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(5)) as session:
-        async with session.get(
-            f"https://api2.musical.ly/aweme/v1/aweme/detail/?aweme_id={video_id}",
-            allow_redirects=False,
-        ) as response:
-            data = await response.json()
-            if data.get("aweme_detail") and data.get("status_code") == 0:
-                return TikTokData.from_dict(data["aweme_detail"])
-            raise ValueError("Unable to get TikTok data")
+    @classmethod
+    def _process_dict(cls, data: dict) -> Dict[str, Any]:
+        """data is the aweme_details dict"""
+        return {
+            "id": int(data["aweme_id"]),
+            "created": data.get("create_time"),
+            # remove unnesesary query params
+            "share_url": (data.get("share_url") or "").split(".html")[0],
+            "video": Video._compact(data["video"]),
+            "statistics": Statistics._compact(data["statistics"]),
+            "description": (
+                data.get("desc") or "",
+                tuple(
+                    (tag.get("hashtag_name"), tag.get("start"), tag.get("end"))
+                    for tag in data.get("text_extra") or ()
+                    if tag.get("type") == 1
+                ),
+            ),
+            "music": Music._compact(data["music"]),
+            "author": Author._compact(data["author"]),
+        }
+
+    @property
+    def age(self) -> float:
+        """Seconds since the data was fetched, so how old the statistics are."""
+        return time() - self.fetched_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Gets the compact data the TikTokData is built from.
+        Each part is stored as its field values, in field order.
+
+        returns:
+            The compact data, which `TikTokData(data)` accepts.
+        """
+        return self._data
+
+
+@metrics.timed("get_tiktok")
+async def get_tiktok(
+    video_id: int, revalidate_after: Optional[float] = None
+) -> Optional["TikTokData"]:
+    """
+    Gets a TikTok, from the cache or the store when possible.
+
+    args:
+        video_id: The aweme id of the video.
+        revalidate_after: When the cached TikTok is older than this many seconds,
+            it is still returned, but refetched in the background.
+
+    returns:
+        The TikTok data.
+    """
+    video_id = int(video_id)
+    if (tiktok := _tiktok_cache.get(video_id)) is not None:
+        if revalidate_after is not None and tiktok.age > revalidate_after:
+            metrics.count("get_tiktok", "stale")
+            refresh_tiktok(video_id)
+        else:
+            metrics.count("get_tiktok", "hit")
+        return tiktok
+    metrics.count("get_tiktok", "miss")
+    tiktok = await _tiktok_inflight.do(video_id, _load_tiktok, video_id)
+    if revalidate_after is not None and tiktok.age > revalidate_after:
+        refresh_tiktok(video_id)  # read from the store, statistics and all
+    return tiktok
+
+
+def use_tiktok_store(store: Optional[TikTokStore]) -> None:
+    """
+    Sets where TikToks are kept across restarts, read when they aren't
+    cached and written when they are fetched.
+
+    args:
+        store: The store, None to only cache in memory.
+    """
+    global _tiktok_store
+    _tiktok_store = store
+
+
+async def preload_tiktoks(video_ids: Sequence[int]) -> int:
+    """
+    Caches TikToks from the store, so the first requests for them don't
+    wait on it.
+
+    args:
+        video_ids: The aweme ids of the videos.
+
+    returns:
+        How many were cached.
+    """
+    if _tiktok_store is None or not video_ids:
+        return 0
+    stored = await _tiktok_store.get_many(video_ids)
+    cached = (_cache_stored(video_id, *value) for video_id, value in stored.items())
+    return sum(tiktok is not None for tiktok in cached)
+
+
+def _cache_stored(
+    video_id: int, data: Dict[str, Any], fetched_at: float
+) -> Optional["TikTokData"]:
+    # cached for what is left of the time to live it had when it was fetched
+    ttl = fetched_at + _tiktok_cache.ttl - time()
+    if ttl <= 0:
+        return None
+    tiktok = TikTokData(data, fetched_at)
+    _tiktok_cache.set(video_id, tiktok, ttl=ttl)
+    return tiktok
+
+
+async def _load_tiktok(video_id: int) -> "TikTokData":
+    if _tiktok_store is not None:
+        stored = await _tiktok_store.get(video_id)
+        if stored is not None and (tiktok := _cache_stored(video_id, *stored)):
+            return tiktok
+    return await _fetch_tiktok(video_id)
+
+
+def refresh_tiktok(video_id: int) -> None:
+    """
+    Refetches a TikTok in the background, unless it is already being fetched.
+
+    args:
+        video_id: The aweme id of the video.
+    """
+    if video_id in _tiktok_inflight:
+        return
+    task = asyncio.create_task(_refresh_tiktok(video_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _refresh_tiktok(video_id: int) -> None:
+    try:
+        await _tiktok_inflight.do(video_id, _fetch_tiktok, video_id)
+    except Exception as e:
+        print(f"Error: unable to refresh {video_id}: {e!r}")
+
+
+def update_cached_tiktok(video_id: int, value: List[Any]) -> None:
+    """
+    Takes a TikTok another process fetched, when the one cached here is older.
+    Videos that aren't cached here are left to be fetched when needed.
+
+    args:
+        video_id: The aweme id of the video.
+        value: The compact data and when it was fetched.
+    """
+    data, fetched_at = value
+    cached = _tiktok_cache.peek(video_id)
+    if cached is not None and cached.fetched_at < fetched_at:
+        _tiktok_cache.set(video_id, TikTokData(data, fetched_at))
+
+
+def tiktok_cache_info() -> Dict[str, Dict[str, int]]:
+    return {
+        "tiktok": _tiktok_cache.info(),
+        "inflight": {"coalesced": _tiktok_inflight.coalesced},
+    }
+
+
+def aweme_load() -> float:
+    """
+    Gets how much of the aweme concurrency limit is in use.
+
+    returns:
+        The share of the limit in flight, 1 or more when requests are waiting.
+    """
+    return _aweme_limiter.in_flight / _aweme_limiter.limit
+
+
+def aweme_health() -> Dict[str, Any]:
+    return {
+        "limit": _aweme_limiter.limit,
+        "in_flight": _aweme_limiter.in_flight,
+        "rejected": _aweme_limiter.rejected,
+        "healthy": _aweme_breaker.healthy,
+        "failures": _aweme_breaker.failures,
+        "p50": _aweme_latency.percentile(0.5),
+        "p99": _aweme_latency.percentile(0.99),
+    }
+
+
+async def _fetch_tiktok(video_id: int) -> "TikTokData":
+    policy = aweme_policy
+    for retry in range(policy.retries + 1):
+        try:
+            body = await hedged(
+                lambda: _request_aweme(video_id, policy.attempt_timeout(_aweme_latency)),
+                policy.hedge_delay(_aweme_latency),
+            )
+            break
+        except (asyncio.TimeoutError, aiohttp.ClientError, UpstreamOverloaded):
+            if retry == policy.retries:
+                raise
+        await asyncio.sleep(policy.retry_delay(retry))
+
+    data = json_loads(body)
+    if data.get("aweme_detail") and data.get("status_code") == 0:
+        tiktok = TikTokData.from_dict(data["aweme_detail"])
+        _tiktok_cache.set(video_id, tiktok)
+        coherence.get_channel().publish(
+            "tiktok", video_id, [tiktok.to_dict(), tiktok.fetched_at]
+        )
+        if _tiktok_store is not None:
+            _tiktok_store.put(video_id, tiktok.to_dict(), tiktok.fetched_at)
+        return tiktok
+    raise ValueError("Unable to get TikTok data")
+
+
+async def _request_aweme(video_id: int, timeout: float) -> bytes:
+    if not _aweme_breaker.allow():
+        raise UpstreamUnavailable("TikTok isn't responding right now, try again later")
+    try:
+        async with _aweme_limiter.slot() as slot:
+            async with get_session().get(
+                f"{AWEME_DETAIL_URL}?aweme_id={video_id}",
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(timeout),
+            ) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise UpstreamOverloaded(f"TikTok answered with {response.status}")
+                body = await response.read()
+    except (asyncio.TimeoutError, aiohttp.ClientError, UpstreamOverloaded):
+        _aweme_breaker.record_failure()
+        raise
+    except BaseException:
+        _aweme_breaker.record_abandoned()
+        raise
+    _aweme_breaker.record_success()
+    _aweme_latency.record(monotonic() - slot.started)
+    return body
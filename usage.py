@@ -0,0 +1,199 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+from database import UsageData
+from rollup import apply_rollups
+
+_STOP = object()
+
+
+class UsageWriter:
+    """
+    Buffers usage data and writes it in batches from a background task,
+    adding each batch to the usage rollups at the same time.
+    Records are dropped, and counted, when the buffer is full.
+
+    `opted_out` is checked again when a batch is written, so the records of
+    users who opted out while they were queued are written without them.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 5,
+        opted_out: Callable[[int], bool] = lambda user_id: False,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.opted_out = opted_out
+        self.written = 0
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """
+        Starts the background writer.
+        """
+        if self._task is None:
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+
+    def put(self, record: UsageData) -> bool:
+        """
+        Queues a record without waiting.
+
+        args:
+            record: The usage data to write.
+
+        returns:
+            Whether the record was queued.
+        """
+        if self._closed:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def flush(self) -> None:
+        """
+        Waits until everything queued so far has been written.
+        """
+        if self._task is None:
+            return
+        if self._closed:  # stopping, which flushes everything
+            await asyncio.shield(self._task)
+            return
+        flushed = asyncio.get_running_loop().create_future()
+        await self._queue.put(flushed)
+        await flushed
+
+    async def stop(self) -> None:
+        """
+        Stops the writer after flushing everything still queued.
+        """
+        if self._task is None:
+            return
+        self._closed = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            record = await self._queue.get()
+            if record is _STOP:
+                return
+            if isinstance(record, asyncio.Future):  # flush() with nothing batched
+                _resolve(record)
+                continue
+            batch = [record]
+            flushed = None
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is _STOP:
+                    await self._flush(batch)
+                    return
+                if isinstance(record, asyncio.Future):
+                    flushed = record
+                    break
+                batch.append(record)
+            await self._flush(batch)
+            if flushed is not None:
+                _resolve(flushed)
+
+    async def _flush(self, batch: List[UsageData]) -> None:
+        for record in batch:
+            if record.user_id is not None and self.opted_out(record.user_id):
+                record.user_id = None
+                record.message_id = None
+        # the rollups count what happened, even when the raw records fail
+        inserted, rolled_up = await asyncio.gather(
+            UsageData.insert_many(batch, ordered=False),
+            apply_rollups(batch),
+            return_exceptions=True,
+        )
+        if isinstance(rolled_up, Exception):
+            print(f"Error: failed to roll up {len(batch)} usage records: {rolled_up}")
+        if isinstance(inserted, Exception):
+            print(f"Error: failed to write {len(batch)} usage records: {inserted}")
+            return
+        self.written += len(batch)
+
+
+def _resolve(flushed: asyncio.Future) -> None:
+    if not flushed.done():  # whoever was waiting may have gone away
+        flushed.set_result(None)
+
+
+async def delete_usage(
+    filter: Dict[str, Any], chunk_size: int = 1000, pause: float = 0.1
+) -> int:
+    """
+    Deletes usage records in chunks, pausing between them so a user with a
+    lot of records doesn't hog the primary.
+
+    args:
+        filter: Which records to delete.
+        chunk_size: How many records to delete per round trip.
+        pause: How long to wait between chunks, in seconds.
+
+    returns:
+        How many records were deleted.
+    """
+    collection = UsageData.get_motor_collection()
+    deleted = 0
+    while True:
+        ids = [
+            record["_id"]
+            async for record in collection.find(
+                filter, projection={"_id": True}, limit=chunk_size
+            )
+        ]
+        if not ids:
+            return deleted
+        result = await collection.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+        if len(ids) < chunk_size:
+            return deleted
+        await asyncio.sleep(pause)
+
+
+async def top_videos(limit: int, since: int) -> List[int]:
+    """
+    Gets the videos converted the most recently.
+
+    args:
+        limit: How many videos to get.
+        since: Unix time to count conversions from.
+
+    returns:
+        The video ids, the most converted first.
+    """
+    cursor = UsageData.get_motor_collection().aggregate(
+        [
+            {"$match": {"timestamp": {"$gte": since}}},
+            {"$group": {"_id": "$video_id", "conversions": {"$sum": 1}}},
+            {"$sort": {"conversions": -1}},
+            {"$limit": limit},
+        ]
+    )
+    return [doc["_id"] async for doc in cursor]